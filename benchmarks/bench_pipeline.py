@@ -0,0 +1,234 @@
+"""
+Stage-by-stage benchmark of the merge pipeline on synthetic battery curves.
+
+    python -m benchmarks.bench_pipeline --sizes 10k,100k,1M --output results.json
+    python -m benchmarks.bench_pipeline --sizes 100M --stages stream_merge
+    python -m benchmarks.bench_pipeline --sizes 10k,100k --compare results.json
+
+Each size gets a freshly generated Dataset A/Dataset B CSV pair. The load,
+merge, sort, fit, render, export and streaming stages are timed separately
+(best and mean of ``--repeat`` runs). Every stage calls the code the GUI and
+the batch CLI ship: merge_arrays(), fit_trend_arrays(), the off-screen renderer in socmerge.render and
+ArrayCurve.write_csv(). Results are written as JSON together with the
+commit and library versions, so runs from different commits can be
+compared with ``--compare``. Rendering needs no display.
+
+The SOC sort runs inside merge_arrays(), so 'sort' is not a call of its
+own: it is read from the ``merge.sort`` trace spans of the merge runs, and
+is part of the 'merge' time as well.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from socmerge import engine, trace
+from socmerge.arrays import ArrayCurve, fit_trend_arrays, merge_arrays
+from socmerge.render import DEFAULT_DPI, LaidOutFigure, analysis_snapshot
+from socmerge.streaming import stream_merge
+
+from .synthetic import write_pair_csv
+
+STAGES = ['load', 'merge', 'sort', 'fit', 'render', 'render_full', 'export_plot', 'export_csv',
+          'stream_merge']
+DEFAULT_STAGES = ['load', 'merge', 'sort', 'fit', 'render', 'export_plot', 'export_csv']
+
+
+def parse_size(text):
+    """Row count from '10k', '1M', '2.5M' or a plain integer."""
+    text = text.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000, 'g': 1_000_000_000}.get(text[-1:], 1)
+    number = text[:-1] if scale > 1 else text
+    return int(float(number) * scale)
+
+
+def time_stage(func, repeat):
+    """Best and mean wall time of ``func`` over ``repeat`` runs, plus its last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings), result
+
+
+def render_figure(curve, full_resolution=False):
+    """Lay out the charging plot as a saved batch plot is, decimated unless ``full_resolution``."""
+    snapshot = analysis_snapshot(curve, 'charging')
+    snapshot.full_resolution = full_resolution
+    return LaidOutFigure(snapshot, DEFAULT_DPI)
+
+
+def bench_size(rows, stages, repeat, work_dir, segment_options):
+    """Time the selected stages for one dataset size; returns result records."""
+    path_a = os.path.join(work_dir, f'a_{rows}.csv')
+    path_b = os.path.join(work_dir, f'b_{rows}.csv')
+    write_pair_csv(path_a, path_b, rows, **segment_options)
+
+    records = []
+    cache = {}
+
+    def report(stage, best, mean, runs):
+        records.append({'rows': rows, 'stage': stage, 'best_s': round(best, 6),
+                        'mean_s': round(mean, 6), 'repeat': runs})
+        print(f"{rows:>12,d}  {stage:<12s} best {best:9.4f}s  mean {mean:9.4f}s", flush=True)
+
+    def run(stage, func):
+        if stage not in stages:
+            if stage not in cache:
+                cache[stage] = func()
+            return cache[stage]
+        best, mean, result = time_stage(func, repeat)
+        report(stage, best, mean, repeat)
+        cache[stage] = result
+        return result
+
+    def run_traced(stage, span_name, func):
+        """Call ``func`` with tracing on and report its ``span_name`` spans as ``stage``."""
+        if stage not in stages:
+            return func()
+        timings = []
+
+        def listener(event):
+            if event['name'] == span_name:
+                timings.append(event['dur'] / 1e6)
+
+        was_enabled = trace.is_enabled()
+        trace.enable()
+        trace.TRACER.add_listener(listener)
+        try:
+            result = func()
+        finally:
+            trace.TRACER.remove_listener(listener)
+            if not was_enabled:
+                trace.disable()
+        if timings:
+            report(stage, min(timings), sum(timings) / len(timings), len(timings))
+        return result
+
+    in_memory = [stage for stage in stages if stage != 'stream_merge']
+    if in_memory:
+        df_a, df_b = run('load', lambda: (engine.load_dataset(path_a), engine.load_dataset(path_b)))
+        soc, voltage, window, removed_rows = run_traced(
+            'sort', 'merge.sort', lambda: run('merge', lambda: merge_arrays([df_a, df_b])))
+        trend = run('fit', lambda: fit_trend_arrays(soc, voltage))
+        curve = ArrayCurve(soc, voltage, window, removed_rows, trend)
+        if 'render' in stages or 'export_plot' in stages:
+            figure = run('render', lambda: render_figure(curve))
+        if 'render_full' in stages:
+            run('render_full', lambda: render_figure(curve, full_resolution=True))
+        if 'export_plot' in stages:
+            run('export_plot', lambda: figure.save(os.path.join(work_dir, 'plot.png'), 'png'))
+        if 'export_csv' in stages:
+            run('export_csv', lambda: curve.write_csv(os.path.join(work_dir, 'merged.csv')))
+
+    if 'stream_merge' in stages:
+        run('stream_merge', lambda: stream_merge(path_a, path_b,
+                                                 os.path.join(work_dir, 'streamed.csv')))
+
+    for path in (path_a, path_b):
+        os.remove(path)
+    return records
+
+
+def environment():
+    """Commit, versions and machine details stored with every result file."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    import matplotlib
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'matplotlib': matplotlib.__version__,
+        'pyarrow': engine.HAVE_PYARROW,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(records, baseline_path, threshold):
+    """Print new/old timing ratios against a baseline file; returns the number of regressions."""
+    with open(baseline_path) as handle:
+        baseline = {(r['rows'], r['stage']): r for r in json.load(handle)['results']}
+
+    regressions = 0
+    print(f"\n{'rows':>12s}  {'stage':<12s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}")
+    for record in records:
+        old = baseline.get((record['rows'], record['stage']))
+        if old is None or not old['best_s']:
+            continue
+        ratio = record['best_s'] / old['best_s']
+        flag = '  REGRESSION' if ratio > threshold else ''
+        regressions += bool(flag)
+        print(f"{record['rows']:>12,d}  {record['stage']:<12s} {old['best_s']:>10.4f} "
+              f"{record['best_s']:>10.4f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10k,100k,1M',
+                        help="Comma-separated total row counts, e.g. 10k,1M,100M (default: %(default)s)")
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help=f"Comma-separated stages from {','.join(STAGES)} (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage (default: %(default)s)")
+    parser.add_argument('--overlap', type=float, default=0.2,
+                        help="Overlap of the two SOC windows as a fraction of 0-100%% (default: %(default)s)")
+    parser.add_argument('--noise', type=float, default=0.002, help="Voltage noise in volts")
+    parser.add_argument('--order', choices=['sorted', 'noisy', 'shuffled'], default='sorted',
+                        help="SOC ordering within each file")
+    parser.add_argument('--duplicates', type=float, default=0.0,
+                        help="Fraction of rows repeating the previous SOC")
+    parser.add_argument('--extra-columns', type=int, default=0,
+                        help="Aux columns per file to mimic wide cycler exports")
+    parser.add_argument('--work-dir', default=None, help="Where to write the generated CSVs")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to compare against")
+    parser.add_argument('--regression-threshold', type=float, default=1.2,
+                        help="Ratio above which a stage counts as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {sorted(unknown)}")
+
+    segment_options = {
+        'overlap_fraction': args.overlap,
+        'noise': args.noise,
+        'order': args.order,
+        'duplicate_fraction': args.duplicates,
+        'extra_columns': args.extra_columns,
+    }
+
+    records = []
+    with tempfile.TemporaryDirectory(prefix='socmerge-bench-', dir=args.work_dir) as work_dir:
+        for size in args.sizes.split(','):
+            records += bench_size(parse_size(size), stages, args.repeat, work_dir, segment_options)
+
+    with open(args.output, 'w') as handle:
+        json.dump({'environment': environment(), 'options': segment_options, 'results': records},
+                  handle, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        return 1 if compare(records, args.compare, args.regression_threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
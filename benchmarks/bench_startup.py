@@ -0,0 +1,122 @@
+"""
+Cold-start benchmark of the analyzer window.
+
+    python -m benchmarks.bench_startup --output startup.json
+    python -m benchmarks.bench_startup --compare startup.json
+
+Every run starts a fresh interpreter that imports ``trial 3.py``, builds
+the main window and waits for it to be shown. It then creates the plot
+canvas and draws the welcome plot, which is what the first plot pays for
+the deferred matplotlib import. Stages (best and mean over ``--runs``):
+
+- ``process``: interpreter launch until the window is shown
+- ``import``: importing the GUI module
+- ``window``: building and showing the main window
+- ``first_canvas``: creating the canvas and drawing the first plot
+
+The run also reports which heavy modules were already imported when the
+window appeared. Results use the bench_pipeline JSON layout (with ``rows``
+0), so ``--compare`` flags regressions the same way. Without a display,
+Qt's offscreen platform is used.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, 'trial 3.py')
+
+STAGES = ['process', 'import', 'window', 'first_canvas']
+
+# Modules that should not be needed to show the window
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'pyarrow')
+
+
+def child(app_path, launched):
+    """Start the GUI once and print its stage timings as JSON."""
+    start = time.perf_counter()
+    import runpy
+    module = runpy.run_path(app_path, run_name='bench_startup')
+    imported = time.perf_counter()
+
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    window = module['VoltageSOCAnalyzer']()
+    window.show()
+    app.processEvents()
+    shown = time.perf_counter()
+    process = time.time() - launched
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    window.show_welcome_plot()
+    app.processEvents()
+    canvas = time.perf_counter()
+    window.close()
+
+    print(json.dumps({
+        'process': process,
+        'import': imported - start,
+        'window': shown - imported,
+        'first_canvas': canvas - shown,
+        'loaded': loaded,
+    }))
+
+
+def run_once(app_path, env):
+    """Timings of one cold start in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child', app_path, '--launched',
+         repr(time.time())],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True)
+    # Qt may print warnings; the timings are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="Cold starts to time (default: %(default)s)")
+    parser.add_argument('--app', default=APP_PATH, help="GUI script to start (default: trial 3.py)")
+    parser.add_argument('-o', '--output', default='startup_results.json', help="JSON results file")
+    parser.add_argument('--compare', default=None, help="Baseline JSON to compare against")
+    parser.add_argument('--regression-threshold', type=float, default=1.2,
+                        help="Ratio above which a stage counts as a regression (default: %(default)s)")
+    parser.add_argument('--child', metavar='APP', help=argparse.SUPPRESS)
+    parser.add_argument('--launched', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.launched)
+        return 0
+    # Imported only in the parent: bench_pipeline loads numpy and pandas, which would skew the child
+    from .bench_pipeline import compare, environment
+
+    env = dict(os.environ)
+    if sys.platform.startswith('linux') and not (env.get('DISPLAY') or env.get('WAYLAND_DISPLAY')):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    runs = [run_once(args.app, env) for _ in range(args.runs)]
+    records = []
+    for stage in STAGES:
+        timings = [run[stage] for run in runs]
+        best, mean = min(timings), sum(timings) / len(timings)
+        records.append({'rows': 0, 'stage': stage, 'best_s': round(best, 6),
+                        'mean_s': round(mean, 6), 'repeat': len(timings)})
+        print(f"{stage:<14s} best {best:8.4f}s  mean {mean:8.4f}s", flush=True)
+    loaded = runs[-1]['loaded']
+    print(f"Heavy modules loaded when the window appeared: {', '.join(loaded) or 'none'}")
+
+    with open(args.output, 'w') as handle:
+        json.dump({'environment': environment(), 'options': {'app': args.app, 'loaded': loaded},
+                   'results': records}, handle, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        return 1 if compare(records, args.compare, args.regression_threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
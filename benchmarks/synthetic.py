@@ -0,0 +1,86 @@
+"""
+Synthetic SOC/Voltage datasets shaped like battery open-circuit-voltage curves.
+
+Segments are generated in chunks so CSV files far larger than memory can be
+written for the streaming benchmarks.
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+
+def ocv_curve(soc):
+    """Smooth open-circuit-voltage shape over SOC in percent (steep ends, flat middle)."""
+    s = np.asarray(soc, dtype=np.float64) / 100.0
+    return 3.45 + 0.6 * s - 0.35 * np.exp(-s * 18.0) + 0.12 * np.exp((s - 1.0) * 25.0)
+
+
+def make_segment(rows, soc_range=(0.0, 100.0), noise=0.002, order='sorted',
+                 duplicate_fraction=0.0, extra_columns=0, seed=0):
+    """
+    One SOC/Voltage segment as a DataFrame.
+
+    ``order`` is 'sorted' (monotonic SOC), 'noisy' (monotonic trend with
+    jitter) or 'shuffled' (interior rows in random order; the first and last
+    rows stay at the ends of ``soc_range`` so the merge window is unchanged).
+    ``duplicate_fraction`` of the rows repeat the previous row's SOC, and
+    ``extra_columns`` adds aux channels to mimic wide cycler exports.
+    """
+    rng = np.random.default_rng(seed)
+    lo, hi = soc_range
+    soc = np.linspace(lo, hi, rows)
+
+    if order == 'noisy':
+        soc[1:-1] += rng.normal(0.0, (hi - lo) / max(rows, 1) * 5, max(rows - 2, 0))
+    elif order == 'shuffled' and rows > 2:
+        rng.shuffle(soc[1:-1])
+    elif order != 'sorted':
+        raise ValueError(f"Unknown order '{order}', expected 'sorted', 'noisy' or 'shuffled'")
+
+    if duplicate_fraction > 0 and rows > 1:
+        dup = np.flatnonzero(rng.random(rows - 1) < duplicate_fraction) + 1
+        soc[dup] = soc[dup - 1]
+
+    voltage = ocv_curve(soc) + rng.normal(0.0, noise, rows)
+    df = pd.DataFrame({'SOC': soc, 'Voltage': voltage})
+    for i in range(extra_columns):
+        df[f'Aux_{i:02d}'] = rng.random(rows)
+    return df
+
+
+def pair_ranges(overlap_fraction=0.2):
+    """SOC ranges of Dataset A and Dataset B whose overlap spans ``overlap_fraction`` of 0-100%."""
+    half = overlap_fraction * 50.0
+    return (0.0, 50.0 + half), (50.0 - half, 100.0)
+
+
+def make_pair(rows, overlap_fraction=0.2, seed=0, **segment_options):
+    """Dataset A/Dataset B pair with ``rows`` rows in total."""
+    range_a, range_b = pair_ranges(overlap_fraction)
+    df_a = make_segment(rows // 2, range_a, seed=seed, **segment_options)
+    df_b = make_segment(rows - rows // 2, range_b, seed=seed + 1, **segment_options)
+    return df_a, df_b
+
+
+def write_segment_csv(path, rows, soc_range=(0.0, 100.0), chunk_rows=DEFAULT_CHUNK_ROWS,
+                      seed=0, **segment_options):
+    """Write a segment to CSV chunk by chunk, so ``rows`` is not limited by memory."""
+    lo, hi = soc_range
+    edges = np.linspace(lo, hi, max(rows // chunk_rows, 1) + 1)
+    counts = np.diff(np.linspace(0, rows, len(edges)).astype(np.int64))
+
+    with open(path, 'w', newline='') as handle:
+        for i, count in enumerate(counts):
+            chunk = make_segment(int(count), (edges[i], edges[i + 1]), seed=seed + i,
+                                 **segment_options)
+            chunk.to_csv(handle, header=(i == 0), index=False)
+    return path
+
+
+def write_pair_csv(path_a, path_b, rows, overlap_fraction=0.2, seed=0, **segment_options):
+    """Write a Dataset A/Dataset B pair with ``rows`` rows in total to CSV."""
+    range_a, range_b = pair_ranges(overlap_fraction)
+    write_segment_csv(path_a, rows // 2, range_a, seed=seed, **segment_options)
+    write_segment_csv(path_b, rows - rows // 2, range_b, seed=seed + 1_000_003, **segment_options)
+    return path_a, path_b
@@ -0,0 +1,49 @@
+"""
+Headless Voltage vs SOC merge engine.
+
+The GUI in ``trial 3.py`` and the ``python -m socmerge`` command line both
+build on these functions; nothing in this package imports PyQt5, and
+matplotlib is only imported by socmerge.render when a plot is saved.
+
+The engine names below are resolved on first access.
+"""
+import importlib
+
+__all__ = [
+    'ALTERNATIVE_NAMES',
+    'ANALYSIS_MODES',
+    'PRECEDENCE_RULES',
+    'OPTIONAL_COLUMNS',
+    'REQUIRED_COLUMNS',
+    'WINDOW_METHODS',
+    'AnalysisResult',
+    'ColumnError',
+    'LoadCancelled',
+    'analyze_segments',
+    'find_column_mapping',
+    'fit_trend',
+    'in_windows',
+    'load_dataset',
+    'merge_curve',
+    'merge_datasets_with_overlap_removal',
+    'merge_segments',
+    'overlap_masks',
+    'overlap_window',
+    'read_header',
+    'run_analysis',
+    'sniff_columns',
+    'sort_merged',
+    'summarize_dataset',
+]
+
+
+def __getattr__(name):
+    # The engine (and with it pandas) is imported on first use, so importing a
+    # light submodule such as socmerge.trace stays cheap
+    if name in __all__:
+        return getattr(importlib.import_module('.engine', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
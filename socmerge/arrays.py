@@ -0,0 +1,212 @@
+"""
+NumPy backend for merged curves that keeps memory close to the input size.
+
+The DataFrame path copies the data several times: the two mask passes, the
+concatenation, the sort, the renumbering and the sorted copy kept for
+export. Here the keep masks are computed once per segment and the
+surviving SOC values are compressed into a single scratch buffer. One
+stable argsort of that buffer then gathers SOC and Voltage into their final
+ascending order. The scratch buffer is reused for Voltage, so the only
+temporaries are one column and the permutation.
+
+The rows can also be kept in time order (``order_column='Time'``), for
+curves merged from time-stamped phases (socmerge.phases).
+
+The sorted columns are contiguous float64 arrays. Large ones are
+memory-mapped onto unlinked temporary files, so the OS can page them out.
+The charging view is the arrays themselves and the discharging view is a
+reversed view of them. Export writes straight from those buffers in blocks.
+"""
+import logging
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .engine import ColumnError, overlap_masks
+from .fitting import DEFAULT_BIN_WIDTH, DEFAULT_SMOOTHING, BinAccumulator, fit_bins
+
+logger = logging.getLogger(__name__)
+
+# Columns at least this long are memory-mapped when ``mmap`` is left to 'auto'
+MMAP_MIN_ROWS = 1_000_000
+
+# Rows per block for trend binning and CSV export
+BLOCK_ROWS = 1_000_000
+
+
+def allocate(rows, mmap=False, tmp_dir=None):
+    """
+    Empty float64 array of ``rows`` values, in memory or memory-mapped.
+
+    Memory-mapped arrays live in an already unlinked temporary file, so the
+    disk space is released as soon as the array is garbage collected.
+    """
+    if not mmap or rows == 0:
+        return np.empty(rows, dtype=np.float64)
+    with tempfile.TemporaryFile(prefix='socmerge-', dir=tmp_dir) as handle:
+        # The mapping keeps its own reference to the file after the handle closes
+        return np.memmap(handle, dtype=np.float64, mode='w+', shape=(rows,))
+
+
+class ArrayCurve:
+    """
+    Merged SOC/Voltage rows held as two contiguous arrays in ascending SOC order.
+
+    Rows with a NaN SOC sit at the end and stay there in descending order.
+    Equal SOC values keep their merge order when ascending and reverse it
+    when descending, matching engine.sort_merged().
+
+    With ``ordered_by='time'`` the arrays are in time order instead, and
+    both directions read them as they are.
+    """
+
+    def __init__(self, soc, voltage, window, removed_rows, trend, ordered_by='soc'):
+        self.soc = soc
+        self.voltage = voltage
+        self.window = window
+        self.removed_rows = removed_rows
+        self.trend = trend
+        self.ordered_by = ordered_by
+        self.valid_rows = len(soc) - int(np.count_nonzero(np.isnan(soc)))
+        self._differentials = {}
+
+    def __len__(self):
+        return len(self.soc)
+
+    def _oriented(self, values, ascending):
+        if ascending or self.ordered_by == 'time':
+            return values
+        if self.valid_rows == len(values):
+            return values[::-1]
+        # NaN SOC rows must stay last, which a reversed view cannot express
+        return np.concatenate((values[self.valid_rows - 1::-1] if self.valid_rows else values[:0],
+                               values[self.valid_rows:]))
+
+    def columns(self, ascending=True):
+        """
+        (soc, voltage) in ascending (charging) or descending (discharging) order.
+
+        These are views of the stored buffers, not copies. The exception is
+        descending order when some SOC values are NaN, which needs one copy.
+        """
+        return self._oriented(self.soc, ascending), self._oriented(self.voltage, ascending)
+
+    def set_trend(self, trend):
+        """Replace the trend, e.g. after refitting with another model."""
+        self.trend = trend
+
+    def differential(self, **options):
+        """
+        DVA/ICA curves of the rows, computed once per set of options (see socmerge.differential).
+
+        They do not depend on the row order, so both directions share them.
+        """
+        key = tuple(sorted(options.items()))
+        if key not in self._differentials:
+            from .differential import differential_curves
+            self._differentials[key] = differential_curves(self.soc, self.voltage, **options)
+        return self._differentials[key]
+
+    def write_csv(self, path, ascending=True, block_rows=BLOCK_ROWS):
+        """Write the rows to CSV block by block, without building a sorted copy."""
+        soc, voltage = self.columns(ascending)
+        with trace.span('export.csv', rows=len(soc)), open(path, 'w', newline='') as handle:
+            handle.write('SOC,Voltage\n')
+            for start in range(0, len(soc), block_rows):
+                pd.DataFrame({'SOC': soc[start:start + block_rows],
+                              'Voltage': voltage[start:start + block_rows]}).to_csv(
+                    handle, header=False, index=False)
+
+
+def _column(df, name):
+    return np.asarray(df[name].to_numpy(), dtype=np.float64)
+
+
+def merge_arrays(segments, precedence='first', sensor_column='SOC', value_column='Voltage',
+                 mmap='auto', tmp_dir=None, window_method='endpoints', order_column=None):
+    """
+    Overlap-removal merge of dataset segments into sorted column arrays.
+
+    Applies overlap_masks(), the rule merge_segments() uses, and gives its
+    rows in stable-sorted order. Returns ``(sensor, value, window,
+    removed_rows)``, where ``sensor`` and ``value`` are in ascending sensor
+    order, or ascending ``order_column`` order when one is given. ``mmap``
+    is True, False or 'auto' (memory-map from MMAP_MIN_ROWS rows).
+    """
+    segments = list(segments)
+    if order_column is not None:
+        missing = [number for number, segment in enumerate(segments, start=1)
+                   if order_column not in segment.columns]
+        if missing:
+            raise ColumnError(f"Ordering by '{order_column}' needs that column in every dataset; "
+                              f"dataset(s) {missing} lack it")
+
+    # One mask pass per segment; None keeps every row
+    ranked, windows, masks = overlap_masks(segments, precedence, sensor_column, window_method)
+    counts = [len(segment) if mask is None else int(np.count_nonzero(mask))
+              for segment, mask in zip(ranked, masks)]
+    rows = sum(counts)
+    if mmap == 'auto':
+        mmap = rows >= MMAP_MIN_ROWS
+
+    # Lowest rank first, like the concatenation in merge_segments()
+    parts = list(zip(ranked, masks, counts))[::-1]
+
+    def gather(column, scratch, out=None, order=None):
+        with trace.span('merge.concat', column=column, rows=rows):
+            position = 0
+            for segment, mask, count in parts:
+                values = _column(segment, column)
+                if mask is None:
+                    scratch[position:position + count] = values
+                else:
+                    np.compress(mask, values, out=scratch[position:position + count])
+                position += count
+        if order is None:
+            with trace.span('merge.sort', column=column, rows=rows):
+                order = np.argsort(scratch, kind='stable')
+        if out is not None:
+            with trace.span('merge.gather', column=column, rows=rows, mmap=bool(mmap)):
+                np.take(scratch, order, out=out)
+        return order
+
+    # The scratch buffer holds one merged column at a time before it is gathered
+    scratch = np.empty(rows, dtype=np.float64)
+    sensor = allocate(rows, mmap, tmp_dir)
+    value = allocate(rows, mmap, tmp_dir)
+    order = None
+    if order_column is not None and order_column != sensor_column:
+        order = gather(order_column, scratch)
+    order = gather(sensor_column, scratch, sensor, order)
+    gather(value_column, scratch, value, order)
+
+    logger.info("Final merged dataset: %d rows", rows)
+    return sensor, value, windows[0], sum(len(segment) for segment in segments) - rows
+
+
+def fit_trend_arrays(soc, voltage, degree=2, block_rows=BLOCK_ROWS, model='poly',
+                     bin_width=DEFAULT_BIN_WIDTH, smoothing=DEFAULT_SMOOTHING):
+    """
+    Trend of Voltage over SOC fitted on fixed-width SOC bins (see socmerge.fitting).
+
+    The rows are binned block by block; the fit itself only sees the bins.
+    """
+    with trace.span('fit.bin', rows=len(soc), width=bin_width):
+        bins = BinAccumulator(bin_width)
+        for start in range(0, len(soc), block_rows):
+            bins.add(soc[start:start + block_rows], voltage[start:start + block_rows])
+    return fit_bins(bins, model, degree, smoothing)
+
+
+def merge_curve_arrays(segments, degree=2, precedence='first', mmap='auto', tmp_dir=None,
+                       model='poly', bin_width=DEFAULT_BIN_WIDTH, smoothing=DEFAULT_SMOOTHING,
+                       window_method='endpoints', order='soc'):
+    """Merge dataset segments into an ArrayCurve (in 'soc' or 'time' order) and fit its trend."""
+    soc, voltage, window, removed_rows = merge_arrays(
+        segments, precedence, mmap=mmap, tmp_dir=tmp_dir, window_method=window_method,
+        order_column='Time' if order == 'time' else None)
+    trend = fit_trend_arrays(soc, voltage, degree, model=model, bin_width=bin_width,
+                             smoothing=smoothing)
+    return ArrayCurve(soc, voltage, window, removed_rows, trend, ordered_by=order)
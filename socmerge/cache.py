@@ -0,0 +1,239 @@
+"""
+On-disk columnar cache for loaded datasets.
+
+The first load of a CSV stores the already column-mapped frame as an
+uncompressed Feather (Arrow IPC) file, which later loads memory-map instead
+of re-parsing text. Every entry is written as a single record batch with
+NaN kept as a float value rather than an Arrow null, so each numeric column
+is one contiguous, null-free buffer. get() wraps those buffers in the
+returned frame without copying them: the pages are only read when used and
+are shared with the OS page cache. Such columns are read-only: replacing a
+column works as usual, but writing into one needs a df.copy() first. Other
+columns (text, integers with gaps) go through the usual Arrow conversion.
+Without pyarrow the cache falls back to pickled frames.
+
+Entries are keyed by absolute path, size and modification time, so an edited
+file never hits a stale copy; the stale entry is deleted the next time that
+path is loaded. Cleaned copies (socmerge.clean) are stored next to the
+parsed frame as variants named after their cleaning options, so each
+option set is cleaned once per file version. Total cache size is capped by
+evicting the least recently used entries.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .clean import clean_dataset, clean_options, cleaning_key
+from .engine import load_dataset
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = feather = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'SOCMERGE_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'socmerge')
+)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Part of every entry's version; bumped when load_dataset() returns different columns
+ENTRY_FORMAT = 3
+
+
+class DatasetCache:
+    """LRU-capped cache of parsed datasets, keyed by source file identity."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = '.feather' if feather is not None else '.pkl'
+
+    def _path_prefix(self, file_path):
+        return hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+
+    def _version_prefix(self, file_path):
+        stat = os.stat(file_path)
+        version = hashlib.sha1(f"{ENTRY_FORMAT}:{stat.st_size}:{stat.st_mtime_ns}".encode('ascii')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{self._path_prefix(file_path)}-{version}")
+
+    def entry_path(self, file_path, variant=''):
+        """Cache file for the current version of ``file_path`` (or one of its variants)."""
+        suffix = f"-{variant}" if variant else ''
+        return f"{self._version_prefix(file_path)}{suffix}{self.extension}"
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.cache_dir, name) for name in names
+                if name.endswith(('.feather', '.pkl'))]
+
+    def _drop_stale(self, file_path):
+        prefix = os.path.join(self.cache_dir, self._path_prefix(file_path) + '-')
+        # Every variant of the current version stays
+        current = self._version_prefix(file_path)
+        for entry in self._entries():
+            if entry.startswith(prefix) and not entry.startswith(current):
+                logger.info("Dropping stale cache entry %s", entry)
+                _remove(entry)
+
+    def get(self, file_path, variant=''):
+        """Return the cached frame for ``file_path`` or None on a miss."""
+        entry = self.entry_path(file_path, variant)
+        if not os.path.exists(entry):
+            self._drop_stale(file_path)
+            return None
+
+        try:
+            with trace.span('cache.read', file=os.path.basename(file_path)):
+                if entry.endswith('.feather'):
+                    df = _frame(feather.read_table(entry, memory_map=True))
+                else:
+                    df = pd.read_pickle(entry)
+        except Exception as e:
+            logger.warning("Discarding unreadable cache entry %s: %s", entry, e)
+            _remove(entry)
+            return None
+
+        # Access time drives LRU eviction; mtime is used because atime is often disabled
+        os.utime(entry)
+        return df
+
+    def put(self, file_path, df, variant=''):
+        """Store ``df`` as the cached copy of ``file_path``."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = self.entry_path(file_path, variant)
+
+        # Write to a temporary name so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            with trace.span('cache.write', file=os.path.basename(file_path), rows=len(df)):
+                if feather is not None:
+                    feather.write_feather(_table(df), tmp_path, compression='uncompressed',
+                                          chunksize=max(len(df), 1))
+                else:
+                    df.to_pickle(tmp_path)
+            os.replace(tmp_path, entry)
+        except Exception:
+            _remove(tmp_path)
+            raise
+
+        self._drop_stale(file_path)
+        self.prune()
+
+    def load(self, file_path, progress=None, is_cancelled=None):
+        """Load a dataset through the cache, parsing and storing it on a miss."""
+        df = self.get(file_path)
+        if df is not None:
+            if progress is not None:
+                progress(1.0)
+            return df
+
+        df = load_dataset(file_path, progress=progress, is_cancelled=is_cancelled)
+        try:
+            self.put(file_path, df)
+        except Exception as e:
+            # A full or read-only cache must never stop a load
+            logger.warning("Could not cache %s: %s", file_path, e)
+        return df
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits ``max_bytes``."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.info("Evicting cache entry %s", entry)
+            _remove(entry)
+            total -= size
+
+    def clear(self):
+        """Delete every cache entry."""
+        for entry in self._entries():
+            _remove(entry)
+
+
+def _table(df):
+    """Arrow table of ``df`` whose float columns keep NaN as a value, not as a null."""
+    df = df.reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for position, name in enumerate(df.columns):
+        if pd.api.types.is_float_dtype(df[name].dtype) and isinstance(df[name].dtype, np.dtype):
+            column = pa.array(df[name].to_numpy(), from_pandas=False)
+            table = table.set_column(position, table.schema.field(position).with_type(column.type),
+                                     column)
+    return table
+
+
+def _frame(table):
+    """DataFrame over the memory-mapped ``table``, wrapping numeric buffers without a copy."""
+    if table.num_rows == 0:
+        return table.to_pandas()
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if (column.num_chunks == 1 and column.null_count == 0
+                and (pa.types.is_floating(column.type) or pa.types.is_integer(column.type))):
+            columns[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            columns[name] = table.select([name]).to_pandas()[name]
+    df = pd.DataFrame(columns, copy=False)
+    metadata = table.schema.pandas_metadata or {}
+    df.attrs.update(metadata.get('attributes', {}))
+    return df
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def load_cached(file_path, cache=None, progress=None, is_cancelled=None, clean=None):
+    """
+    load_dataset() through ``cache``, or straight from the CSV when it is None.
+
+    ``clean`` is a dict of clean_dataset() options ({} for the defaults) to
+    return a cleaned copy instead of the parsed frame; with a cache, the
+    cleaned copy is cached too.
+    """
+    if clean is None:
+        if cache is None:
+            return load_dataset(file_path, progress=progress, is_cancelled=is_cancelled)
+        return cache.load(file_path, progress=progress, is_cancelled=is_cancelled)
+
+    options = clean_options(**clean)
+    variant = cleaning_key(options)
+    if cache is not None:
+        df = cache.get(file_path, variant)
+        if df is not None:
+            if progress is not None:
+                progress(1.0)
+            return df
+
+    df = clean_dataset(load_cached(file_path, cache, progress, is_cancelled), **options)
+    if cache is not None:
+        try:
+            cache.put(file_path, df, variant)
+        except Exception as e:
+            logger.warning("Could not cache the cleaned copy of %s: %s", file_path, e)
+    return df
@@ -0,0 +1,255 @@
+"""
+Data-quality pass run once on a loaded dataset, before any merge.
+
+Cycler exports contain text cells, NaN and inf readings, SOC values a few
+tenths outside 0-100, single-sample voltage spikes and long runs of rows
+with the same SOC while the cell rests. clean_dataset() deals with all of
+them in whole-column NumPy/pandas operations, in this order:
+
+1. ``SOC`` and ``Voltage`` are coerced to numbers; unparsable cells become NaN.
+2. Rows with a NaN or infinite SOC or Voltage are dropped.
+3. SOC is clipped to ``soc_range``.
+4. Voltage outliers are rejected by a rolling median/MAD test over the rows
+   in SOC order: a row more than ``outlier_threshold`` robust standard
+   deviations from the median of its ``outlier_window`` neighbours is
+   dropped. The MAD is floored at ``mad_floor`` volts so a flat rest phase
+   does not turn measurement noise into outliers.
+5. Rows sharing the same SOC are collapsed into one row at the position of
+   the first of them, averaging Voltage (and any other numeric column).
+
+When the dataset has a ``Current`` column, steps 4 and 5 run separately on
+its charge, discharge and rest rows (see socmerge.phases), split with the
+same ``rest_current`` and ``charge_sign`` as the phase-aware merge. A
+charge and a discharge reading at the same SOC are never averaged or
+compared.
+
+With ``action='flag'`` nothing is changed or removed; a ``Quality`` column
+of FLAG_* bits records what the drop pass would have done to each row.
+
+The counts of each step are kept in the result's ``attrs['cleaning']``,
+which survives the columnar cache (see load_cached() in socmerge.cache).
+"""
+import hashlib
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .phases import DEFAULT_REST_CURRENT, phase_codes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOC_RANGE = (0.0, 100.0)
+DEFAULT_OUTLIER_WINDOW = 25
+DEFAULT_OUTLIER_THRESHOLD = 5.0
+DEFAULT_MAD_FLOOR = 0.005
+
+# What happens to rows that fail a check
+CLEAN_ACTIONS = ('drop', 'flag')
+
+# MAD -> standard deviation for normally distributed noise
+MAD_SCALE = 1.4826
+
+# Bits of the Quality column written by action='flag'
+FLAG_NON_NUMERIC = 1
+FLAG_NON_FINITE = 2
+FLAG_OUT_OF_RANGE = 4
+FLAG_OUTLIER = 8
+FLAG_DUPLICATE = 16
+
+QUALITY_COLUMN = 'Quality'
+
+REPORT_FIELDS = ('rows', 'non_numeric', 'non_finite', 'clipped', 'outliers', 'duplicates', 'kept')
+
+
+def clean_options(soc_range=DEFAULT_SOC_RANGE, outlier_window=DEFAULT_OUTLIER_WINDOW,
+                  outlier_threshold=DEFAULT_OUTLIER_THRESHOLD, mad_floor=DEFAULT_MAD_FLOOR,
+                  collapse_duplicates=True, action='drop', rest_current=DEFAULT_REST_CURRENT,
+                  charge_sign=1):
+    """Validated keyword arguments for clean_dataset(), with every default filled in."""
+    if action not in CLEAN_ACTIONS:
+        raise ValueError(f"Unknown cleaning action '{action}', expected one of {list(CLEAN_ACTIONS)}")
+    low, high = (float(value) for value in soc_range)
+    if not low < high:
+        raise ValueError(f"SOC range must be increasing, got {soc_range}")
+    if int(outlier_window) < 3:
+        raise ValueError(f"Outlier window must span at least 3 rows, got {outlier_window}")
+    if not outlier_threshold > 0:
+        raise ValueError(f"Outlier threshold must be positive, got {outlier_threshold}")
+    if not float(rest_current) >= 0:
+        raise ValueError(f"Rest current must not be negative, got {rest_current}")
+    if charge_sign not in (1, -1):
+        raise ValueError(f"charge_sign must be 1 or -1, got {charge_sign}")
+    return {
+        'soc_range': (low, high),
+        'outlier_window': int(outlier_window),
+        'outlier_threshold': float(outlier_threshold),
+        'mad_floor': float(mad_floor),
+        'collapse_duplicates': bool(collapse_duplicates),
+        'action': action,
+        'rest_current': float(rest_current),
+        'charge_sign': int(charge_sign),
+    }
+
+
+def cleaning_key(options):
+    """Short stable name of a set of clean_options(), used to tell cached variants apart."""
+    text = json.dumps(clean_options(**options), sort_keys=True)
+    return 'clean-' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def _numeric(series):
+    """(float64 values, mask of cells that were present but not numbers)."""
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan), np.zeros(len(series), dtype=bool)
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return values, np.isnan(values) & series.notna().to_numpy()
+
+
+def rolling_outliers(soc, voltage, window=DEFAULT_OUTLIER_WINDOW, threshold=DEFAULT_OUTLIER_THRESHOLD,
+                     mad_floor=DEFAULT_MAD_FLOOR, groups=None):
+    """
+    Mask of Voltage values far from the rolling median of their SOC neighbours.
+
+    With ``groups`` (e.g. phase codes), only rows of the same group are neighbours.
+    """
+    if groups is not None:
+        outliers = np.zeros(len(soc), dtype=bool)
+        for group in np.unique(groups):
+            rows = np.flatnonzero(groups == group)
+            outliers[rows] = rolling_outliers(soc[rows], voltage[rows], window, threshold, mad_floor)
+        return outliers
+    if len(soc) == 0:
+        return np.zeros(0, dtype=bool)
+    order = np.argsort(soc, kind='stable')
+    ordered = pd.Series(voltage[order])
+    # Centred windows; the ends of the curve use the neighbours they have
+    median = ordered.rolling(window, center=True, min_periods=1).median()
+    deviation = (ordered - median).abs()
+    mad = deviation.rolling(window, center=True, min_periods=1).median().to_numpy()
+    limit = threshold * np.maximum(MAD_SCALE * mad, mad_floor)
+    outliers = np.empty(len(soc), dtype=bool)
+    outliers[order] = deviation.to_numpy() > limit
+    return outliers
+
+
+def _duplicate_groups(soc, groups=None):
+    """(sort order, group start offsets in it, first row of each group) of equal SOC values."""
+    if groups is None:
+        order = np.argsort(soc, kind='stable')
+        ordered = soc[order]
+        changed = ordered[1:] != ordered[:-1]
+    else:
+        # lexsort is stable too; rows only match within the same group
+        order = np.lexsort((soc, groups))
+        ordered, ordered_groups = soc[order], groups[order]
+        changed = (ordered[1:] != ordered[:-1]) | (ordered_groups[1:] != ordered_groups[:-1])
+    starts = np.flatnonzero(np.concatenate(([True], changed)))
+    # The sort is stable, so each group's first sorted row is its earliest row
+    return order, starts, order[starts]
+
+
+def _collapse(df, soc, groups=None):
+    """Average rows with equal SOC (and group) into the position of the first of them."""
+    order, starts, first = _duplicate_groups(soc, groups)
+    if len(first) == len(soc):
+        return df
+    counts = np.diff(np.append(starts, len(soc)))
+    position = np.argsort(first, kind='stable')
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_float_dtype(column.dtype) or pd.api.types.is_integer_dtype(column.dtype):
+            sums = np.add.reduceat(column.to_numpy(dtype=np.float64)[order], starts)
+            columns[name] = (sums / counts)[position]
+        else:
+            columns[name] = column.to_numpy()[first[position]]
+    return pd.DataFrame(columns)
+
+
+def clean_dataset(df, soc_range=DEFAULT_SOC_RANGE, outlier_window=DEFAULT_OUTLIER_WINDOW,
+                  outlier_threshold=DEFAULT_OUTLIER_THRESHOLD, mad_floor=DEFAULT_MAD_FLOOR,
+                  collapse_duplicates=True, action='drop', rest_current=DEFAULT_REST_CURRENT,
+                  charge_sign=1):
+    """
+    Cleaned copy of a 'SOC'/'Voltage' frame; see the module docstring for the steps.
+
+    The original row order is kept. The per-step counts are returned in
+    ``attrs['cleaning']`` (see describe_cleaning()).
+    """
+    options = clean_options(soc_range, outlier_window, outlier_threshold, mad_floor,
+                            collapse_duplicates, action, rest_current, charge_sign)
+    low, high = options['soc_range']
+    report = dict.fromkeys(REPORT_FIELDS, 0)
+    report['rows'] = len(df)
+
+    with trace.span('clean.dataset', rows=len(df), action=action) as stage:
+        soc, soc_text = _numeric(df['SOC'])
+        voltage, voltage_text = _numeric(df['Voltage'])
+        non_numeric = soc_text | voltage_text
+        invalid = ~(np.isfinite(soc) & np.isfinite(voltage))
+        report['non_numeric'] = int(np.count_nonzero(non_numeric))
+        report['non_finite'] = int(np.count_nonzero(invalid & ~non_numeric))
+
+        out_of_range = ~invalid & ((soc < low) | (soc > high))
+        report['clipped'] = int(np.count_nonzero(out_of_range))
+        valid = ~invalid
+        clipped = np.clip(soc[valid], low, high)
+        phases = None
+        if 'Current' in df.columns:
+            phases = phase_codes(_numeric(df['Current'])[0], options['rest_current'],
+                                 options['charge_sign'])
+
+        outliers = np.zeros(len(df), dtype=bool)
+        outliers[valid] = rolling_outliers(clipped, voltage[valid], options['outlier_window'],
+                                           options['outlier_threshold'], options['mad_floor'],
+                                           None if phases is None else phases[valid])
+        report['outliers'] = int(np.count_nonzero(outliers))
+
+        if action == 'flag':
+            result = _flagged(df, np.clip(soc, low, high), phases, invalid, non_numeric, out_of_range,
+                              outliers, options['collapse_duplicates'], report)
+        else:
+            keep = valid & ~outliers
+            result = df.loc[keep].reset_index(drop=True)
+            result['SOC'] = np.clip(soc[keep], low, high)
+            result['Voltage'] = voltage[keep]
+            if options['collapse_duplicates']:
+                result = _collapse(result, result['SOC'].to_numpy(),
+                                   None if phases is None else phases[keep])
+            report['duplicates'] = int(keep.sum()) - len(result)
+        report['kept'] = len(result)
+        stage.set(kept=report['kept'])
+
+    result.attrs['cleaning'] = report
+    logger.info("Cleaned %d rows: %s", report['rows'], describe_cleaning(report))
+    return result
+
+
+def _flagged(df, soc, phases, invalid, non_numeric, out_of_range, outliers, collapse_duplicates, report):
+    quality = np.zeros(len(df), dtype=np.uint8)
+    quality[non_numeric] |= FLAG_NON_NUMERIC
+    quality[invalid & ~non_numeric] |= FLAG_NON_FINITE
+    quality[out_of_range] |= FLAG_OUT_OF_RANGE
+    quality[outliers] |= FLAG_OUTLIER
+    if collapse_duplicates:
+        candidates = np.flatnonzero(~invalid & ~outliers)
+        duplicate = np.ones(len(candidates), dtype=bool)
+        groups = None if phases is None else phases[candidates]
+        duplicate[_duplicate_groups(soc[candidates], groups)[2]] = False
+        quality[candidates[duplicate]] |= FLAG_DUPLICATE
+        report['duplicates'] = int(np.count_nonzero(duplicate))
+    result = df.copy()
+    result[QUALITY_COLUMN] = quality
+    return result
+
+
+def describe_cleaning(report):
+    """One-line summary of a cleaning report, e.g. for the information panel."""
+    if not report:
+        return "not cleaned"
+    return (f"{report['non_numeric']} non-numeric, {report['non_finite']} NaN/inf, "
+            f"{report['clipped']} clipped, {report['outliers']} outliers, "
+            f"{report['duplicates']} duplicates; {report['kept']} of {report['rows']} rows kept")
@@ -0,0 +1,711 @@
+"""
+Command-line entry point for unattended merging.
+
+    python -m socmerge batch manifest.csv --output-dir merged/
+
+The manifest is a CSV file with one merge job per row. Required columns
+are ``dataset_a`` and ``dataset_b``; further ``dataset_*`` columns
+(``dataset_c``, ``dataset_d``, ...) add more segments, and empty cells are
+skipped. Segments are ranked in column order (``--precedence first``) or
+reverse column order (``--precedence last``) for the N-way overlap-removal
+merge. Optional ``mode`` (charging or discharging) and ``name`` columns
+override the defaults per row. Relative paths are resolved against the
+manifest's directory.
+
+Pairs are spread across a process pool (``--workers``, all cores by
+default). Each merged CSV is written as soon as its pair finishes, and
+``summary.csv`` in the output directory gains one status/timing row per
+pair as it completes. A pair that fails only marks its own row as failed;
+a worker process that dies (e.g. out of memory) takes the pool down with
+it, so the unfinished pairs are rerun as described in iter_results().
+Manifest names must be unique, since they name the output files.
+
+``--stream`` switches to the bounded-memory merge in socmerge.streaming
+for files larger than RAM, and ``--cache-dir`` reads datasets through the
+columnar cache in socmerge.cache (not with ``--stream``, which reads the
+files in chunks). ``--lookup-table`` also writes each merged
+curve as a binary socmerge.lookup table next to its CSV. ``--format``
+writes Parquet, Feather or HDF5 instead of CSV, and ``--partition-dir``
+appends every merged curve to one partitioned dataset (socmerge.export). ``--fit`` picks the
+trend model (polynomial, monotone or smoothing spline, see socmerge.fitting),
+fitted on ``--bin-width`` SOC bins. ``--plot png,pdf`` also saves each
+curve's analysis plot in those formats, rendered off-screen in the same
+worker (socmerge.render); with ``--cache-dir`` the renderings are cached.
+``--clean`` runs the data-quality pass in socmerge.clean on every dataset
+before the merge (cached with ``--cache-dir``), and ``--window quantile``
+takes each segment's overlap window from robust SOC quantiles instead of
+its first and last rows. ``--phases`` splits every dataset into charge,
+discharge and rest rows by the sign of its current and merges only the
+row's mode phase (socmerge.phases); with ``--mode both`` (or a ``both``
+mode cell) one pass writes the charging and the discharging curve.
+``--order time`` keeps merged rows in time order instead of SOC order.
+``--differential`` also writes each curve's dV/dSOC and dQ/dV curves
+(socmerge.differential) as ``_dva.csv`` and ``_ica.csv`` files, and their
+plots with ``--plot``; ``--capacity`` gives the cell capacity in Ah.
+
+    python -m socmerge prewarm data/ --recursive
+
+parses every CSV under a directory into the cache ahead of time, and
+
+    python -m socmerge lookup curve.soclut --soc 10 50 90
+
+answers voltage-at-SOC (or ``--voltage`` for SOC-at-voltage) queries
+against a saved lookup table.
+
+    python -m socmerge serve --port 8765
+
+runs the local HTTP merge service in socmerge.server, and
+
+    python -m socmerge watch incoming/ --output-dir merged/
+
+merges cycler files into per-cell curves as they land in a directory
+(socmerge.watch).
+
+``--trace trace.json`` (before the subcommand) records per-stage timings,
+including those from batch worker processes, as a Chrome trace.
+
+Only numpy and pandas are imported; PyQt5 is never loaded, and matplotlib
+only by workers rendering ``--plot`` output.
+"""
+import argparse
+import csv
+import fnmatch
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from . import engine, trace
+from .arrays import merge_curve_arrays
+from .cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DatasetCache, load_cached
+from .differential import DIFFERENTIAL_KINDS
+from .export import COMPRESSIONS, EXPORT_FORMATS, PARTITION_FORMATS, write_curve, write_partition
+from .fitting import DEFAULT_BIN_WIDTH, DEFAULT_SMOOTHING, FIT_MODELS
+from .lookup import LOOKUP_METHODS, CurveTable
+from .phases import DEFAULT_REST_CURRENT, ROW_ORDERS, merge_phase_curves
+from .render import (DEFAULT_DPI, PLOT_FORMATS, RenderCache, analysis_snapshot, differential_snapshot,
+                     render_plot)
+from .server import DEFAULT_CACHE_ENTRIES, DEFAULT_MAX_UPLOAD_BYTES, DEFAULT_PORT, MergeServer, MergeService
+from .streaming import DEFAULT_CHUNK_ROWS, stream_merge
+from .watch import (DEFAULT_INTERVAL, DEFAULT_PATTERN, DEFAULT_SETTLE, DEFAULT_WORKERS, DEFAULT_WRITE_INTERVAL,
+                    WatchMerger, watch)
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ['name', 'status', 'rows', 'seconds', 'output', 'trend', 'error']
+
+# Manifest mode that writes both analysis directions from one --phases pass
+BOTH_MODES = 'both'
+
+# Pool crashes a pair may be caught in before it is rerun in a pool of its own
+MAX_SHARED_CRASHES = 1
+
+
+def read_manifest(manifest_path, default_mode='charging'):
+    """Read the manifest CSV into a list of job dictionaries."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    with open(manifest_path, newline='') as handle:
+        reader = csv.DictReader(handle)
+        fieldnames = reader.fieldnames or []
+        missing = {'dataset_a', 'dataset_b'} - set(fieldnames)
+        if missing:
+            raise ValueError(f"Manifest is missing column(s): {sorted(missing)}")
+        dataset_columns = [field for field in fieldnames if field.startswith('dataset_')]
+
+        for row_num, row in enumerate(reader, start=1):
+            paths = [os.path.join(base_dir, row[column].strip())
+                     for column in dataset_columns if (row[column] or '').strip()]
+            mode = (row.get('mode') or default_mode).strip().lower()
+            name = (row.get('name') or '').strip() or (
+                f"{row_num:05d}_{_stem(paths[0]) if paths else 'empty'}__"
+                f"{_stem(paths[-1]) if paths else 'empty'}"
+            )
+            jobs.append({'name': name, 'datasets': paths, 'mode': mode})
+
+    counts = {}
+    for job in jobs:
+        counts[job['name']] = counts.get(job['name'], 0) + 1
+    duplicates = sorted(name for name, count in counts.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Manifest names must be unique; repeated: {duplicates}")
+    return jobs
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def process_pair(job, output_dir, degree=2, precedence='first', stream=False,
+                 chunk_rows=DEFAULT_CHUNK_ROWS, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 lookup_table=False, collect_trace=False, fit='poly', bin_width=DEFAULT_BIN_WIDTH,
+                 smoothing=DEFAULT_SMOOTHING, fmt='csv', compression=None, partition_dir=None,
+                 plot_formats=(), dpi=DEFAULT_DPI, clean=False, window_method='endpoints',
+                 phases=False, order='soc', rest_current=DEFAULT_REST_CURRENT, charge_sign=1,
+                 differential=False, capacity=None):
+    """Merge one manifest row's datasets and write the result; never raises."""
+    if collect_trace:
+        # Worker processes start with tracing off; their events travel back in the result
+        trace.enable()
+    with trace.span('batch.pair', pair=job['name']):
+        result = _process_pair(job, output_dir, degree, precedence, stream, chunk_rows,
+                               cache_dir, cache_max_bytes, lookup_table,
+                               {'model': fit, 'bin_width': bin_width, 'smoothing': smoothing},
+                               {'fmt': fmt, 'compression': compression, 'partition_dir': partition_dir},
+                               {'formats': plot_formats, 'dpi': dpi,
+                                'differential': {'capacity': capacity} if differential else None},
+                               {'clean': {'rest_current': rest_current, 'charge_sign': charge_sign}
+                                if clean else None, 'window_method': window_method,
+                                'phases': phases, 'order': order, 'rest_current': rest_current,
+                                'charge_sign': charge_sign})
+    if collect_trace:
+        result['trace'] = trace.TRACER.drain()
+    return result
+
+
+def _process_pair(job, output_dir, degree, precedence, stream, chunk_rows, cache_dir,
+                  cache_max_bytes, lookup_table, fit_options, export_options, plot_options,
+                  merge_options):
+    start = time.perf_counter()
+    cache = DatasetCache(cache_dir, cache_max_bytes) if cache_dir else None
+    try:
+        if len(job['datasets']) < 2:
+            raise ValueError("At least two datasets are required per manifest row")
+        fmt = export_options['fmt']
+        if stream:
+            output_path = os.path.join(output_dir, f"{job['name']}_{job['mode']}{EXPORT_FORMATS[fmt][0]}")
+            if len(job['datasets']) != 2:
+                raise ValueError("--stream merges exactly two datasets per manifest row")
+            path_a, path_b = job['datasets'] if precedence == 'first' else job['datasets'][::-1]
+            result = stream_merge(path_a, path_b, output_path,
+                                  mode=job['mode'], degree=degree, chunk_rows=chunk_rows,
+                                  **fit_options)
+            rows = result.rows
+            outputs, trends = [output_path], [result.trend.describe()]
+        else:
+            curves = _merge_job(job, cache, degree, precedence, fit_options, merge_options)
+            outputs, trends, rows = [], [], 0
+            for mode, result in curves.items():
+                output_path = os.path.join(output_dir, f"{job['name']}_{mode}{EXPORT_FORMATS[fmt][0]}")
+                if export_options['partition_dir']:
+                    output_path = write_partition(result, export_options['partition_dir'], job['name'],
+                                                  mode, fmt, export_options['compression'])
+                else:
+                    write_curve(result, output_path, fmt, engine.ANALYSIS_MODES[mode],
+                                export_options['compression'], mode)
+                if lookup_table:
+                    table_path = os.path.join(output_dir, f"{job['name']}_{mode}.soclut")
+                    CurveTable.from_curve(result).save(table_path)
+                snapshots = {'': analysis_snapshot(result, mode)} if plot_options['formats'] else {}
+                if plot_options['differential'] is not None:
+                    differential = result.differential(**plot_options['differential'])
+                    base = os.path.join(output_dir, f"{job['name']}_{mode}")
+                    differential.write_csv(f"{base}_dva.csv", f"{base}_ica.csv")
+                    if plot_options['formats']:
+                        snapshots.update((f'_{kind}', differential_snapshot(differential, kind, mode))
+                                         for kind in DIFFERENTIAL_KINDS)
+                render_cache = RenderCache(os.path.join(cache_dir, 'plots')) if cache_dir else None
+                for suffix, snapshot in snapshots.items():
+                    plot_paths = [os.path.join(output_dir, f"{job['name']}_{mode}{suffix}.{plot_format}")
+                                  for plot_format in plot_options['formats']]
+                    render_plot(snapshot, plot_paths, plot_options['dpi'], render_cache)
+                outputs.append(output_path)
+                trends.append(result.trend.describe())
+                rows += len(result)
+
+        return {
+            'name': job['name'],
+            'status': 'ok',
+            'rows': rows,
+            'seconds': round(time.perf_counter() - start, 4),
+            'output': ';'.join(outputs),
+            'trend': ' | '.join(trends),
+            'error': '',
+        }
+    except Exception as e:
+        return {
+            'name': job['name'],
+            'status': 'failed',
+            'rows': 0,
+            'seconds': round(time.perf_counter() - start, 4),
+            'output': '',
+            'trend': '',
+            'error': f"{type(e).__name__}: {e}".replace('\n', ' '),
+        }
+
+
+def _merge_job(job, cache, degree, precedence, fit_options, merge_options):
+    """{mode: ArrayCurve} of one manifest row, loaded (and cleaned) once for all its modes."""
+    if job['mode'] == BOTH_MODES:
+        if not merge_options['phases']:
+            raise ValueError(f"Mode '{BOTH_MODES}' needs --phases")
+        modes = list(engine.ANALYSIS_MODES)
+    elif job['mode'] in engine.ANALYSIS_MODES:
+        modes = [job['mode']]
+    else:
+        raise ValueError(f"Unknown analysis mode '{job['mode']}', "
+                         f"expected one of {[*engine.ANALYSIS_MODES, BOTH_MODES]}")
+
+    segments = [load_cached(path, cache, clean=merge_options['clean']) for path in job['datasets']]
+    if merge_options['phases']:
+        return merge_phase_curves(segments, modes, degree=degree, precedence=precedence,
+                                  order=merge_options['order'], rest_current=merge_options['rest_current'],
+                                  charge_sign=merge_options['charge_sign'],
+                                  window_method=merge_options['window_method'], **fit_options)
+    return {modes[0]: merge_curve_arrays(segments, degree=degree, precedence=precedence,
+                                         window_method=merge_options['window_method'],
+                                         order=merge_options['order'], **fit_options)}
+
+
+def _failed(job, error):
+    return {
+        'name': job['name'], 'status': 'failed', 'rows': 0,
+        'seconds': 0.0, 'output': '', 'trend': '',
+        'error': f"{type(error).__name__}: {error}",
+    }
+
+
+def _run_pool(jobs, output_dir, workers, options):
+    """Yield (job, result) as each job finishes; result is None for jobs lost to a broken pool."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_pair, job, output_dir, **options): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                yield job, future.result()
+            except BrokenProcessPool:
+                yield job, None
+            except Exception as e:
+                yield job, _failed(job, e)
+
+
+def iter_results(jobs, output_dir, workers=None, **options):
+    """
+    Yield each pair's result dictionary as soon as it finishes.
+
+    A worker that dies (e.g. out of memory) breaks the whole pool, and every
+    pair that had not finished fails with it. Those pairs are resubmitted to
+    a fresh pool. Pairs caught in more than MAX_SHARED_CRASHES crashes are
+    then rerun one at a time in a single-worker pool each, so in the end
+    only the pair whose worker dies on its own is reported as failed.
+    """
+    if workers == 1:
+        for job in jobs:
+            yield process_pair(job, output_dir, **options)
+        return
+
+    crashes = {job['name']: 0 for job in jobs}
+    pending = list(jobs)
+    while pending:
+        shared = [job for job in pending if crashes[job['name']] <= MAX_SHARED_CRASHES]
+        batches = [(shared, workers, False)] if shared else []
+        batches += [([job], 1, True) for job in pending if crashes[job['name']] > MAX_SHARED_CRASHES]
+        pending = []
+        for batch, pool_size, isolated in batches:
+            for job, result in _run_pool(batch, output_dir, pool_size, options):
+                if result is not None:
+                    yield result
+                elif isolated:
+                    yield _failed(job, BrokenProcessPool("the worker process died while merging this pair"))
+                else:
+                    crashes[job['name']] += 1
+                    pending.append(job)
+        if pending:
+            logger.warning("A worker process died; rerunning %d unfinished pair(s)", len(pending))
+
+
+def run_batch(args):
+    """Run every manifest row, logging failures without stopping the batch."""
+    fmt = args.format or ('parquet' if args.partition_dir else 'csv')
+    compression = args.compression.lower() if args.compression else None
+    if args.stream and (fmt != 'csv' or args.partition_dir):
+        logger.error("--stream writes CSV files only")
+        return 2
+    if args.partition_dir and fmt not in PARTITION_FORMATS:
+        logger.error("--partition-dir needs --format %s", ' or '.join(PARTITION_FORMATS))
+        return 2
+    if compression is not None and compression not in COMPRESSIONS[fmt]:
+        logger.error("%s supports --compression %s", fmt, ', '.join(COMPRESSIONS[fmt]))
+        return 2
+    if args.stream and args.plot:
+        logger.error("--plot needs the in-memory merge, not --stream")
+        return 2
+    if args.stream and (args.clean or args.window != 'endpoints'):
+        logger.error("--clean and --window quantile need the in-memory merge, not --stream")
+        return 2
+    if args.stream and (args.phases or args.order != 'soc'):
+        logger.error("--phases and --order time need the in-memory merge, not --stream")
+        return 2
+    if args.stream and args.cache_dir:
+        logger.error("--stream reads the files in chunks and does not use --cache-dir")
+        return 2
+    if args.stream and args.differential:
+        logger.error("--differential needs the in-memory merge, not --stream")
+        return 2
+    if args.capacity is not None and not args.differential:
+        logger.error("--capacity only applies with --differential")
+        return 2
+    if args.mode == BOTH_MODES and not args.phases:
+        logger.error("--mode %s needs --phases", BOTH_MODES)
+        return 2
+    try:
+        jobs = read_manifest(args.manifest, default_mode=args.mode)
+    except ValueError as e:
+        logger.error("%s", e)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    trace_events = []
+    summary_path = os.path.join(args.output_dir, 'summary.csv')
+    with open(summary_path, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+
+        results = iter_results(jobs, args.output_dir, workers=args.workers, degree=args.degree,
+                               precedence=args.precedence,
+                               stream=args.stream, chunk_rows=args.chunk_rows,
+                               cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 ** 2,
+                               lookup_table=args.lookup_table, collect_trace=bool(args.trace),
+                               fit=args.fit, bin_width=args.bin_width, smoothing=args.smoothing,
+                               fmt=fmt, compression=compression,
+                               partition_dir=args.partition_dir, plot_formats=args.plot, dpi=args.dpi,
+                               clean=args.clean, window_method=args.window, phases=args.phases,
+                               order=args.order, rest_current=args.rest_current,
+                               charge_sign=1 if args.charge_current == 'positive' else -1,
+                               differential=args.differential, capacity=args.capacity)
+        for result in results:
+            trace_events.extend(result.pop('trace', ()))
+            writer.writerow(result)
+            handle.flush()
+
+            if result['status'] == 'ok':
+                logger.info("%s: %d rows in %.3fs -> %s", result['name'], result['rows'],
+                            result['seconds'], result['output'])
+            else:
+                failed += 1
+                logger.error("%s: %s", result['name'], result['error'])
+
+    logger.info("Processed %d pair(s) in %.1fs, %d failed; summary in %s",
+                len(jobs), time.perf_counter() - start, failed, summary_path)
+    if args.trace:
+        write_trace(args.trace, trace_events)
+    return 1 if failed else 0
+
+
+def prewarm_file(file_path, cache_dir, cache_max_bytes, collect_trace=False):
+    """Parse one CSV into the cache; never raises. Returns (path, status, seconds, error, trace events)."""
+    if collect_trace:
+        trace.enable()
+    start = time.perf_counter()
+    try:
+        cache = DatasetCache(cache_dir, cache_max_bytes)
+        hit = cache.get(file_path) is not None
+        if not hit:
+            cache.put(file_path, engine.load_dataset(file_path))
+        status, error = 'cached' if hit else 'ok', ''
+    except Exception as e:
+        status, error = 'failed', f"{type(e).__name__}: {e}".replace('\n', ' ')
+    events = trace.TRACER.drain() if collect_trace else []
+    return file_path, status, time.perf_counter() - start, error, events
+
+
+def run_prewarm(args):
+    """Load every matching CSV under a directory into the dataset cache."""
+    paths = []
+    for root, dirs, files in os.walk(args.directory):
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if fnmatch.fnmatch(name, args.pattern))
+        if not args.recursive:
+            break
+
+    cache_max_bytes = args.cache_max_mb * 1024 ** 2
+    failed = 0
+    trace_events = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(prewarm_file, path, args.cache_dir, cache_max_bytes,
+                                   bool(args.trace))
+                   for path in paths]
+        for future in as_completed(futures):
+            path, status, seconds, error, events = future.result()
+            trace_events.extend(events)
+            if status == 'failed':
+                failed += 1
+                logger.error("%s: %s", path, error)
+            else:
+                logger.info("%s: %s in %.3fs", path, status, seconds)
+
+    logger.info("Prewarmed %d file(s) into %s, %d failed", len(paths), args.cache_dir, failed)
+    if args.trace:
+        write_trace(args.trace, trace_events)
+    return 1 if failed else 0
+
+
+def run_watch(args):
+    """Merge files into per-cell curves as they appear, until interrupted."""
+    try:
+        merger = WatchMerger(args.output_dir, pattern=args.pattern, mode=args.mode,
+                             precedence=args.precedence, degree=args.degree, model=args.fit,
+                             bin_width=args.bin_width, smoothing=args.smoothing,
+                             lookup_table=args.lookup_table, workers=args.workers,
+                             write_interval=args.write_interval)
+    except (ValueError, re.error) as e:
+        logger.error("%s", e)
+        return 2
+    try:
+        watch(args.directory, merger, interval=args.interval, settle=args.settle,
+              recursive=args.recursive, once=args.once)
+    except ValueError as e:
+        logger.error("%s", e)
+        return 2
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", args.directory)
+    logger.info("%d cell(s) merged; status in %s", len(merger.cells),
+                os.path.join(args.output_dir, 'cells.csv'))
+    return 0
+
+
+def write_trace(path, events):
+    """Write a Chrome trace and log the stages that took longest overall."""
+    trace.write_chrome_trace(path, events)
+    logger.info("Trace with %d span(s) written to %s", len(events), path)
+    for name, stats in list(trace.summarize(events).items())[:8]:
+        logger.info("  %-16s %5d x  total %9.1f ms  max %9.1f ms",
+                    name, stats['count'], stats['total_ms'], stats['max_ms'])
+
+
+def run_lookup(args):
+    """Print lookup results for the queried SOC or voltage values as CSV."""
+    table = CurveTable.load(args.table)
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(['SOC', 'Voltage'])
+    if args.soc is not None:
+        answers = table.voltage_at(args.soc, method=args.method, clip=not args.no_clip)
+        writer.writerows(zip(args.soc, answers.tolist()))
+    else:
+        answers = table.soc_at(args.voltage, method=args.method, clip=not args.no_clip)
+        writer.writerows(zip(answers.tolist(), args.voltage))
+    return 0
+
+
+def run_serve(args):
+    """Serve merge requests over HTTP until interrupted."""
+    service = MergeService(workers=args.workers, max_pending=args.max_pending,
+                           cache_entries=args.cache_entries, data_root=args.data_root)
+    server = MergeServer((args.host, args.port), service,
+                         max_upload_bytes=args.max_upload_mb * 1024 ** 2)
+    logger.info("Serving merges on %s with %d worker(s), queue limit %d",
+                server.url, service.workers, service.max_pending)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value}")
+    return number
+
+
+def _positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got {value}")
+    return number
+
+
+def _plot_formats(value):
+    formats = [fmt.strip().lower().lstrip('.') for fmt in value.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in PLOT_FORMATS]
+    if not formats or unknown:
+        raise argparse.ArgumentTypeError(f"expected formats from {', '.join(PLOT_FORMATS)}, got {value}")
+    return list(dict.fromkeys(formats))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='socmerge',
+        description="Headless Voltage vs SOC dataset merging."
+    )
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Log per-merge details")
+    parser.add_argument('--trace', metavar='FILE', default=None,
+                        help="Record stage timings as a Chrome trace JSON file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help="Merge every dataset group listed in a manifest")
+    batch.add_argument('manifest', help="CSV manifest with dataset_a,dataset_b[,dataset_c...] columns")
+    batch.add_argument('-o', '--output-dir', required=True,
+                       help="Directory for merged CSV files")
+    batch.add_argument('--mode', choices=[*sorted(engine.ANALYSIS_MODES), BOTH_MODES], default='charging',
+                       help="Analysis mode for rows without a 'mode' column ('both' needs --phases)")
+    batch.add_argument('--degree', type=int, default=2,
+                       help="Polynomial degree of the trend fit")
+    batch.add_argument('--fit', choices=FIT_MODELS, default='poly',
+                       help="Trend model fitted to the SOC bins (default: %(default)s)")
+    batch.add_argument('--bin-width', type=_positive_float, default=DEFAULT_BIN_WIDTH,
+                       help="SOC bin width for the trend fit (default: %(default)s)")
+    batch.add_argument('--smoothing', type=_positive_float, default=DEFAULT_SMOOTHING,
+                       help="Curvature penalty of --fit spline (default: %(default)s)")
+    batch.add_argument('--precedence', choices=engine.PRECEDENCE_RULES, default='first',
+                       help="Which end of each row's dataset list wins overlaps (default: %(default)s)")
+    batch.add_argument('--window', choices=engine.WINDOW_METHODS, default='endpoints',
+                       help="Take each segment's overlap window from its first/last rows or from "
+                            "its 1st-99th SOC percentiles (default: %(default)s)")
+    batch.add_argument('--clean', action='store_true',
+                       help="Coerce, de-duplicate and drop invalid or outlying rows before merging")
+    batch.add_argument('--phases', action='store_true',
+                       help="Split datasets into charge/discharge/rest rows by the sign of their "
+                            "Current column and merge each mode from its own phase")
+    batch.add_argument('--order', choices=ROW_ORDERS, default='soc',
+                       help="Order merged rows by SOC or by the Time column (default: %(default)s)")
+    batch.add_argument('--rest-current', type=float, default=DEFAULT_REST_CURRENT,
+                       help="Currents up to this magnitude count as rest with --phases "
+                            "(default: %(default)s)")
+    batch.add_argument('--charge-current', choices=('positive', 'negative'), default='positive',
+                       help="Sign of the charging current in the files (default: %(default)s)")
+    batch.add_argument('-j', '--workers', type=_positive_int, default=os.cpu_count(),
+                       help="Worker processes (default: all cores; 1 runs in-process)")
+    outputs = batch.add_mutually_exclusive_group()
+    outputs.add_argument('--stream', action='store_true',
+                         help="Merge in bounded memory with an external sort (SOC and Voltage only)")
+    outputs.add_argument('--lookup-table', action='store_true',
+                         help="Also save each merged curve as a .soclut lookup table")
+    batch.add_argument('--format', choices=list(EXPORT_FORMATS), default=None,
+                       help="Merged output format (default: csv, or parquet with --partition-dir)")
+    batch.add_argument('--compression', default=None,
+                       help="Codec for binary formats, e.g. snappy, zstd, lz4, gzip or none "
+                            "(default: the format's usual codec)")
+    batch.add_argument('--partition-dir', default=None,
+                       help="Add every merged curve to one partitioned dataset in this directory "
+                            "(cell=<name>/mode=<mode>) instead of separate files")
+    batch.add_argument('--plot', type=_plot_formats, default=[], metavar='FORMATS',
+                       help="Also save each curve's analysis plot, e.g. png or png,pdf,svg")
+    batch.add_argument('--dpi', type=_positive_int, default=DEFAULT_DPI,
+                       help="Resolution of --plot output (default: %(default)s)")
+    batch.add_argument('--differential', action='store_true',
+                       help="Also write each curve's dV/dSOC (DVA) and dQ/dV (ICA) curves")
+    batch.add_argument('--capacity', type=_positive_float, default=None, metavar='AH',
+                       help="Cell capacity in Ah, for --differential curves in V/Ah and Ah/V "
+                            "instead of per cent SOC")
+    batch.add_argument('--chunk-rows', type=_positive_int, default=DEFAULT_CHUNK_ROWS,
+                       help="Rows per chunk in --stream mode (default: %(default)s)")
+    batch.add_argument('--cache-dir', default=None,
+                       help="Read datasets through the columnar cache in this directory")
+    batch.add_argument('--cache-max-mb', type=_positive_int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                       help="Cache size cap in MB (default: %(default)s)")
+    batch.set_defaults(func=run_batch)
+
+    prewarm = subparsers.add_parser('prewarm', help="Parse every CSV in a directory into the cache")
+    prewarm.add_argument('directory', help="Directory containing CSV datasets")
+    prewarm.add_argument('--pattern', default='*.csv',
+                         help="Filename glob to match (default: %(default)s)")
+    prewarm.add_argument('-r', '--recursive', action='store_true',
+                         help="Include subdirectories")
+    prewarm.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                         help="Cache directory (default: %(default)s)")
+    prewarm.add_argument('--cache-max-mb', type=_positive_int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                         help="Cache size cap in MB (default: %(default)s)")
+    prewarm.add_argument('-j', '--workers', type=_positive_int, default=os.cpu_count(),
+                         help="Worker processes (default: all cores)")
+    prewarm.set_defaults(func=run_prewarm)
+
+    lookup = subparsers.add_parser('lookup', help="Query a saved .soclut lookup table")
+    lookup.add_argument('table', help="Lookup table written by batch --lookup-table or the GUI")
+    query = lookup.add_mutually_exclusive_group(required=True)
+    query.add_argument('--soc', type=float, nargs='+', help="SOC values to look up voltages for")
+    query.add_argument('--voltage', type=float, nargs='+', help="Voltages to look up SOC for")
+    lookup.add_argument('--method', choices=LOOKUP_METHODS, default='linear',
+                        help="Interpolation between table points (default: %(default)s)")
+    lookup.add_argument('--no-clip', action='store_true',
+                        help="Return NaN outside the table instead of the nearest end value")
+    lookup.set_defaults(func=run_lookup)
+
+    serve = subparsers.add_parser('serve', help="Run the local HTTP merge service")
+    serve.add_argument('--host', default='127.0.0.1',
+                       help="Interface to listen on (default: %(default)s)")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT,
+                       help="Port to listen on; 0 picks a free one (default: %(default)s)")
+    serve.add_argument('-j', '--workers', type=_positive_int, default=os.cpu_count(),
+                       help="Merge worker processes (default: all cores)")
+    serve.add_argument('--max-pending', type=_positive_int, default=None,
+                       help="Merges queued or running before new ones get 503 (default: 2 x workers)")
+    serve.add_argument('--max-upload-mb', type=_positive_int,
+                       default=DEFAULT_MAX_UPLOAD_BYTES // 1024 ** 2,
+                       help="Largest accepted request body in MB (default: %(default)s)")
+    serve.add_argument('--cache-entries', type=_positive_int, default=DEFAULT_CACHE_ENTRIES,
+                       help="Merge results kept for repeated requests (default: %(default)s)")
+    serve.add_argument('--data-root', default=None,
+                       help="Only allow dataset paths under this directory")
+    serve.set_defaults(func=run_serve)
+
+    watcher = subparsers.add_parser('watch', help="Merge files into per-cell curves as they arrive")
+    watcher.add_argument('directory', help="Directory the cyclers write CSV or Parquet files into")
+    watcher.add_argument('-o', '--output-dir', required=True,
+                         help="Directory for the merged per-cell files and cells.csv")
+    watcher.add_argument('--pattern', default=DEFAULT_PATTERN,
+                         help="Regex matched against file names without extension; its 'cell' "
+                              "group names the cell (default: %(default)s)")
+    watcher.add_argument('--mode', choices=sorted(engine.ANALYSIS_MODES), default='charging',
+                         help="SOC order of the merged CSVs (default: %(default)s)")
+    watcher.add_argument('--precedence', choices=engine.PRECEDENCE_RULES, default='first',
+                         help="Whether the earliest or the newest file wins overlaps (default: %(default)s)")
+    watcher.add_argument('--degree', type=int, default=2,
+                         help="Polynomial degree of the trend fit")
+    watcher.add_argument('--fit', choices=FIT_MODELS, default='poly',
+                         help="Trend model fitted to the SOC bins (default: %(default)s)")
+    watcher.add_argument('--bin-width', type=_positive_float, default=DEFAULT_BIN_WIDTH,
+                         help="SOC bin width for the trend fit (default: %(default)s)")
+    watcher.add_argument('--smoothing', type=_positive_float, default=DEFAULT_SMOOTHING,
+                         help="Curvature penalty of --fit spline (default: %(default)s)")
+    watcher.add_argument('--lookup-table', action='store_true',
+                         help="Also keep a .soclut lookup table per cell")
+    watcher.add_argument('--interval', type=_positive_float, default=DEFAULT_INTERVAL,
+                         help="Seconds between directory scans (default: %(default)s)")
+    watcher.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                         help="Seconds a file must stay unchanged before it is merged (default: %(default)s)")
+    watcher.add_argument('--write-interval', type=float, default=DEFAULT_WRITE_INTERVAL,
+                         help="Seconds a changed cell may wait for its outputs while files keep "
+                              "arriving (default: %(default)s)")
+    watcher.add_argument('-r', '--recursive', action='store_true',
+                         help="Include subdirectories")
+    watcher.add_argument('-j', '--workers', type=_positive_int, default=DEFAULT_WORKERS,
+                         help="Threads parsing newly arrived files (default: %(default)s)")
+    watcher.add_argument('--once', action='store_true',
+                         help="Merge the files already present and exit")
+    watcher.set_defaults(func=run_watch)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # Per-merge details are noise across thousands of pairs unless asked for
+    logging.getLogger(__package__).setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if not args.trace:
+        return args.func(args)
+    trace.enable()
+    status = args.func(args)
+    if args.func not in (run_batch, run_prewarm):
+        # Pool-based commands collect their workers' spans themselves
+        write_trace(args.trace, trace.TRACER.snapshot())
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Shape-preserving downsampling of long curves for plotting.
+
+Both methods return indices into the original arrays, in their original
+order, so callers can keep full-resolution data and draw only the selected
+points.
+
+- ``minmax``: split the series into equal-count buckets and keep the first,
+  last, minimum and maximum of each. Spikes are never lost.
+- ``lttb``: Largest-Triangle-Three-Buckets. Keeps the point of each bucket
+  that forms the largest triangle with its neighbours, which gives a
+  visually faithful line with one point per bucket.
+"""
+import numpy as np
+
+METHODS = ('minmax', 'lttb')
+
+
+def _bucket_edges(n, n_buckets):
+    return np.unique(np.linspace(0, n, n_buckets + 1).astype(np.int64))
+
+
+def minmax_indices(y, n_buckets):
+    """Indices of the first, last, min and max point of each bucket."""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 4 * n_buckets:
+        return np.arange(n)
+
+    edges = _bucket_edges(n, n_buckets)
+    starts, stops = edges[:-1], edges[1:]
+    bucket = np.repeat(np.arange(len(starts)), stops - starts)
+
+    # fmin/fmax skip NaNs; a bucket that is all NaN only keeps its ends
+    mins = np.fmin.reduceat(y, starts)
+    maxs = np.fmax.reduceat(y, starts)
+    min_hits = np.flatnonzero(y == mins[bucket])
+    max_hits = np.flatnonzero(y == maxs[bucket])
+    # First hit per bucket
+    min_idx = min_hits[np.unique(bucket[min_hits], return_index=True)[1]]
+    max_idx = max_hits[np.unique(bucket[max_hits], return_index=True)[1]]
+
+    return np.unique(np.concatenate((starts, stops - 1, min_idx, max_idx)))
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets selection of ``n_out`` points."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest are split into n_out - 2 buckets
+    edges = 1 + _bucket_edges(n - 2, n_out - 2)
+    selected = np.empty(len(edges) + 1, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(len(edges) - 1):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        if i + 2 < len(edges):
+            next_x = x[stop:edges[i + 2]].mean()
+            next_y = y[stop:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        area = np.abs((x[prev] - next_x) * (y[start:stop] - y[prev])
+                      - (x[prev] - x[start:stop]) * (next_y - y[prev]))
+        prev = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        selected[i + 1] = prev
+
+    return selected
+
+
+def decimate_indices(x, y, n_points, method='minmax'):
+    """Indices of roughly ``n_points`` points that preserve the shape of (x, y)."""
+    if method == 'minmax':
+        # Each bucket contributes up to four points
+        return minmax_indices(y, max(n_points // 4, 1))
+    if method == 'lttb':
+        return lttb_indices(x, y, n_points)
+    raise ValueError(f"Unknown decimation method '{method}', expected one of {METHODS}")
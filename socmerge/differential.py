@@ -0,0 +1,166 @@
+"""
+Differential analysis of merged curves: DVA (dV/dSOC) and ICA (dQ/dV).
+
+Differentiating the raw rows amplifies sensor noise, and the rows of a
+dense log can number tens of millions. Both curves are therefore taken
+from fixed-width bins:
+
+1. One block-wise pass over the merged arrays fills two BinAccumulators.
+   The first holds mean Voltage per ``soc_step`` SOC bin, the second mean
+   SOC per ``voltage_step`` voltage bin. Memory is bounded by the bin
+   count, not the row count, and memory-mapped curves are read in blocks.
+2. Empty bins inside the range are filled by linear interpolation, so
+   each curve lies on a uniform grid. The first and last filled bins are
+   usually only partly covered, which biases their means, so they are
+   left out.
+3. A Savitzky-Golay filter (least-squares polynomial of ``polyorder``
+   over ``window`` bins) returns the smoothed first derivative. The edges
+   use the polynomial fitted to the first and last window.
+
+Charge Q is taken as SOC, so dQ/dV is in %/V. With ``capacity`` (Ah) it is
+in Ah/V instead, and dV/dSOC becomes dV/dQ in V/Ah. Neither depends on the
+row order, so the charging and discharging views of a curve share one
+result. ArrayCurve.differential() caches it next to the merge.
+"""
+import logging
+import math
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .fitting import BinAccumulator
+
+logger = logging.getLogger(__name__)
+
+# Differential curves offered by the GUI and the batch CLI
+DIFFERENTIAL_KINDS = ('dva', 'ica')
+
+DEFAULT_SOC_STEP = 0.2
+DEFAULT_VOLTAGE_STEP = 0.002
+DEFAULT_WINDOW = 15
+DEFAULT_POLYORDER = 3
+
+# Rows per block of the binning pass
+BLOCK_ROWS = 1_000_000
+
+
+def savgol_coeffs(window, polyorder, deriv=0, delta=1.0):
+    """Savitzky-Golay weights of the window's samples for the ``deriv``-th derivative at its centre."""
+    if window % 2 == 0 or window < 1:
+        raise ValueError(f"Savitzky-Golay window must be a positive odd number, got {window}")
+    if not 0 <= deriv <= polyorder < window:
+        raise ValueError(f"Need deriv <= polyorder < window, got {deriv}, {polyorder}, {window}")
+    offsets = np.arange(window) - window // 2
+    vander = np.vander(offsets, polyorder + 1, increasing=True)
+    # Row k of the pseudo-inverse gives the k-th polynomial coefficient at offset 0
+    return np.linalg.pinv(vander)[deriv] * math.factorial(deriv) / delta ** deriv
+
+
+def savgol_filter(values, window=DEFAULT_WINDOW, polyorder=DEFAULT_POLYORDER, deriv=0, delta=1.0):
+    """
+    Savitzky-Golay smoothed values (or derivative) of uniformly spaced samples.
+
+    Series shorter than ``window`` use the largest odd window that fits,
+    lowering ``polyorder`` with it.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    size = len(values)
+    window = min(window, size if size % 2 else size - 1)
+    polyorder = min(polyorder, window - 1)
+    if window < 1 or polyorder < deriv:
+        return np.zeros(size) if deriv else values.copy()
+
+    half = window // 2
+    out = np.empty(size)
+    coeffs = savgol_coeffs(window, polyorder, deriv, delta)
+    out[half:size - half] = np.convolve(values, coeffs[::-1], mode='valid')
+
+    # Edges: the polynomial fitted to the first or last full window
+    offsets = np.arange(window)
+    for part, positions, target in ((values[:window], offsets[:half], slice(0, half)),
+                                     (values[size - window:], offsets[window - half:],
+                                      slice(size - half, size))):
+        poly = np.polyder(np.polyfit(offsets, part, polyorder), deriv)
+        out[target] = np.polyval(poly, positions) / delta ** deriv
+    return out
+
+
+def _uniform(bins):
+    """(bin centres, mean y) over every bin strictly between the first and the last filled one."""
+    filled = np.flatnonzero(bins.counts)
+    if len(filled) < 3:
+        return np.zeros(0), np.zeros(0)
+    first, last = filled[1], filled[-2]
+    counts = bins.counts[first:last + 1]
+    sums = bins.voltage_sums[first:last + 1]
+    centres = (bins.first_bin + first + np.arange(len(counts)) + 0.5) * bins.width
+    means = np.full(len(counts), np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    empty = counts == 0
+    if empty.any():
+        means[empty] = np.interp(centres[empty], centres[~empty], means[~empty])
+    return centres, means
+
+
+class DifferentialCurves:
+    """
+    dV/dSOC on a SOC grid and dQ/dV on a voltage grid of one merged curve.
+
+    ``soc``/``dv_dsoc`` and ``voltage``/``dq_dv`` are ascending, smoothed
+    arrays over the bins; ``units`` names the derivative units.
+    """
+
+    def __init__(self, soc, dv_dsoc, voltage, dq_dv, capacity=None, options=None):
+        self.soc = soc
+        self.dv_dsoc = dv_dsoc
+        self.voltage = voltage
+        self.dq_dv = dq_dv
+        self.capacity = capacity
+        self.options = options or {}
+        self.units = {'dva': 'V/Ah' if capacity else 'V/%', 'ica': 'Ah/V' if capacity else '%/V'}
+
+    def dva_frame(self):
+        """Differential voltage curve as a 'SOC'/'dV_dSOC' DataFrame."""
+        return pd.DataFrame({'SOC': self.soc, 'dV_dSOC': self.dv_dsoc})
+
+    def ica_frame(self):
+        """Incremental capacity curve as a 'Voltage'/'dQ_dV' DataFrame."""
+        return pd.DataFrame({'Voltage': self.voltage, 'dQ_dV': self.dq_dv})
+
+    def write_csv(self, dva_path=None, ica_path=None):
+        """Write either or both curves to CSV."""
+        if dva_path:
+            self.dva_frame().to_csv(dva_path, index=False)
+        if ica_path:
+            self.ica_frame().to_csv(ica_path, index=False)
+
+
+def differential_curves(soc, voltage, soc_step=DEFAULT_SOC_STEP, voltage_step=DEFAULT_VOLTAGE_STEP,
+                        window=DEFAULT_WINDOW, polyorder=DEFAULT_POLYORDER, capacity=None,
+                        block_rows=BLOCK_ROWS):
+    """DifferentialCurves of SOC/Voltage rows in any order; NaN rows are skipped."""
+    if capacity is not None and not capacity > 0:
+        raise ValueError(f"Capacity must be positive, got {capacity}")
+    with trace.span('diff.bin', rows=len(soc)):
+        by_soc = BinAccumulator(soc_step)
+        by_voltage = BinAccumulator(voltage_step)
+        for start in range(0, len(soc), block_rows):
+            soc_block = np.asarray(soc[start:start + block_rows], dtype=np.float64)
+            voltage_block = np.asarray(voltage[start:start + block_rows], dtype=np.float64)
+            by_soc.add(soc_block, voltage_block)
+            by_voltage.add(voltage_block, soc_block)
+
+    with trace.span('diff.smooth', soc_bins=len(by_soc.counts), voltage_bins=len(by_voltage.counts)):
+        soc_grid, mean_voltage = _uniform(by_soc)
+        voltage_grid, mean_soc = _uniform(by_voltage)
+        # Per cent SOC -> Ah when the capacity is known
+        charge_scale = capacity / 100.0 if capacity else 1.0
+        dv_dsoc = savgol_filter(mean_voltage, window, polyorder, 1, soc_step * charge_scale)
+        dq_dv = savgol_filter(mean_soc * charge_scale, window, polyorder, 1, voltage_step)
+
+    logger.info("Differential curves: %d SOC bins, %d voltage bins from %d rows",
+                len(soc_grid), len(voltage_grid), by_soc.rows)
+    options = {'soc_step': soc_step, 'voltage_step': voltage_step, 'window': window,
+               'polyorder': polyorder}
+    return DifferentialCurves(soc_grid, dv_dsoc, voltage_grid, dq_dv, capacity, options)
@@ -0,0 +1,499 @@
+"""
+Qt-free merge, sort and trend-fit steps behind the Voltage vs SOC Analyzer.
+
+Everything here works on plain pandas DataFrames and reports problems by
+raising exceptions, so it can run on headless test-rig servers as well as
+behind the GUI.
+"""
+import csv
+import importlib.util
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+
+logger = logging.getLogger(__name__)
+
+# pyarrow is optional; checked without importing it to keep startup fast
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+REQUIRED_COLUMNS = ['SOC', 'Voltage']
+
+# Kept when present; the phase-aware merge in socmerge.phases needs them
+OPTIONAL_COLUMNS = ['Time', 'Current']
+
+ALTERNATIVE_NAMES = {
+    'SOC': ['soc', 'State_of_Charge', 'StateOfCharge', 'SoC'],
+    'Voltage': ['voltage', 'V', 'Volt', 'Volts'],
+    'Time': ['time', 't', 'Timestamp', 'timestamp', 'Test_Time(s)', 'Test_Time', 'Date_Time'],
+    'Current': ['current', 'I', 'Current(A)', 'Amps', 'Amp'],
+}
+
+# Name tokens that identify an optional column when no alternative name matches exactly
+OPTIONAL_TOKENS = {
+    'Time': {'time', 'timestamp'},
+    'Current': {'current'},
+}
+
+# Tokens of columns that are never taken as an optional one, e.g. 'Step_Time'
+# restarts at every step and 'Cycle_Current' is a per-cycle summary
+EXCLUDED_TOKENS = {'step', 'cycle'}
+
+# Words of a column name: 'TestTime(s)' -> test, time, s
+_NAME_TOKEN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+')
+
+# File extensions read as Parquet instead of CSV (needs pyarrow)
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+# Analysis mode -> ascending SOC order
+ANALYSIS_MODES = {
+    'charging': True,
+    'discharging': False,
+}
+
+
+# Which end of an ordered segment list wins where SOC windows overlap
+PRECEDENCE_RULES = ('first', 'last')
+
+# How a segment's overlap window is taken from its sensor values
+WINDOW_METHODS = ('endpoints', 'quantile')
+
+# Sensor quantiles spanned by the 'quantile' window
+DEFAULT_WINDOW_QUANTILES = (0.01, 0.99)
+
+
+class ColumnError(ValueError):
+    """Raised when a dataset is missing one of the required columns."""
+
+
+class LoadCancelled(Exception):
+    """Raised when a caller cancels a dataset load part-way through."""
+
+
+class AnalysisResult:
+    """Merged SOC/Voltage rows in analysis order plus the details shown after an analysis."""
+
+    def __init__(self, merged, mode, window, removed_rows, trend):
+        self.merged = merged
+        self.mode = mode
+        self.window = window
+        self.removed_rows = removed_rows
+        self.trend = trend
+
+
+def find_column_mapping(columns):
+    """
+    Map file column names onto the required 'SOC'/'Voltage' names.
+
+    Required columns that are already present need no entry; the others are
+    matched against ALTERNATIVE_NAMES or a case-insensitive substring of the
+    required name. OPTIONAL_COLUMNS are matched by name tokens instead, see
+    _optional_mapping().
+    """
+    columns = list(columns)
+    if all(col in columns for col in REQUIRED_COLUMNS):
+        return _optional_mapping(columns, {})
+
+    column_mapping = {}
+    for req_col in REQUIRED_COLUMNS:
+        for col in columns:
+            if col in ALTERNATIVE_NAMES[req_col] or req_col.lower() in col.lower():
+                column_mapping[col] = req_col
+                break
+        else:
+            raise ColumnError(
+                f"Dataset must contain '{req_col}' column.\n"
+                f"Available columns: {columns}"
+            )
+    column_mapping.update(_optional_mapping(columns, column_mapping))
+    return column_mapping
+
+
+def _name_tokens(name):
+    return {token.lower() for token in _NAME_TOKEN.findall(str(name))}
+
+
+def _optional_mapping(columns, required_mapping):
+    """
+    Map file columns onto OPTIONAL_COLUMNS, taking the first match of:
+
+    1. an ALTERNATIVE_NAMES entry, in the order listed there;
+    2. the target or an alternative name, ignoring case;
+    3. a column whose name tokens include one of OPTIONAL_TOKENS and none
+       of EXCLUDED_TOKENS, in file order.
+
+    Substrings never match, so 'Runtime' is not a time column and
+    'Overcurrent_Flag' is not a current column.
+    """
+    column_mapping = {}
+    for opt_col in OPTIONAL_COLUMNS:
+        if opt_col in columns:
+            continue
+        free = [col for col in columns
+                if col not in REQUIRED_COLUMNS and col not in OPTIONAL_COLUMNS
+                and col not in required_mapping and col not in column_mapping]
+        names = [opt_col] + ALTERNATIVE_NAMES[opt_col]
+        lowered = {name.lower() for name in names}
+        tokens = {col: _name_tokens(col) for col in free}
+        match = next((name for name in ALTERNATIVE_NAMES[opt_col] if name in free), None)
+        if match is None:
+            match = next((col for col in free if str(col).lower() in lowered), None)
+        if match is None:
+            match = next((col for col in free if tokens[col] & OPTIONAL_TOKENS[opt_col]
+                          and not tokens[col] & EXCLUDED_TOKENS), None)
+        if match is not None:
+            column_mapping[match] = opt_col
+    return column_mapping
+
+
+def optional_columns(column_mapping, columns):
+    """File column names of the OPTIONAL_COLUMNS present, keyed by their target name."""
+    source = {target: col for col, target in column_mapping.items()}
+    return {name: source.get(name, name) for name in OPTIONAL_COLUMNS
+            if name in source or name in columns}
+
+
+def time_seconds(values):
+    """
+    Timestamps as float64 seconds.
+
+    Numbers are kept as they are (elapsed test time); date/time values and
+    strings are converted to seconds since the epoch. Unparsable cells are NaN.
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if getattr(series.dt, 'tz', None) is not None:
+            series = series.dt.tz_convert(None)
+        return (series - pd.Timestamp(0)).dt.total_seconds().to_numpy(dtype=np.float64, na_value=np.nan)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.notna().sum() == series.notna().sum():
+        return numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    return time_seconds(pd.to_datetime(series, errors='coerce'))
+
+
+def _finish(df, column_mapping):
+    df = df.rename(columns=column_mapping) if column_mapping else df
+    if 'Time' in df.columns and not pd.api.types.is_float_dtype(df['Time'].dtype):
+        df['Time'] = time_seconds(df['Time'])
+    return df
+
+
+def is_parquet(file_path):
+    return os.path.splitext(file_path)[1].lower() in PARQUET_EXTENSIONS
+
+
+def read_header(file_path):
+    """Column names from the header row of a CSV file (or a Parquet schema), without parsing any data."""
+    if is_parquet(file_path):
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(file_path).names)
+    with open(file_path, newline='', encoding='utf-8-sig') as handle:
+        return next(csv.reader(handle), [])
+
+
+def sniff_columns(file_path):
+    """Return the file's (SOC column, Voltage column) names using the usual column detection."""
+    return _source_columns(find_column_mapping(read_header(file_path)))
+
+
+def _source_columns(column_mapping):
+    source = {target: col for col, target in column_mapping.items()}
+    return source.get('SOC', 'SOC'), source.get('Voltage', 'Voltage')
+
+
+def load_dataset(file_path, progress=None, is_cancelled=None, chunk_rows=250_000,
+                 all_columns=False, dtype=np.float64, parser='auto', optional=True):
+    """
+    Read a CSV (or Parquet) dataset and rename its columns to 'SOC'/'Voltage'.
+
+    The header row is sniffed first, so a file without usable columns fails
+    before any data is parsed. Unless ``all_columns`` is set, only the
+    detected SOC and Voltage columns (plus 'Time' and 'Current' when present
+    and ``optional`` is set) are then parsed, as ``dtype`` values;
+    files with non-numeric cells fall back to pandas' type inference.
+    'Time' is always returned as float seconds (see time_seconds()).
+    ``parser='auto'`` uses the multithreaded pyarrow engine when it is
+    installed and the C engine otherwise.
+
+    When ``progress`` or ``is_cancelled`` callbacks are given the file is
+    parsed in chunks of ``chunk_rows``: ``progress`` receives the fraction of
+    bytes read so far and a true ``is_cancelled()`` raises LoadCancelled.
+
+    ``.parquet``/``.pq`` files are read column-wise with pyarrow instead.
+    """
+    name = os.path.basename(file_path)
+    with trace.span('csv.columns', file=name):
+        header = read_header(file_path)
+        column_mapping = find_column_mapping(header)
+        extra = optional_columns(column_mapping, header) if optional else {}
+        if not optional:
+            column_mapping = {col: target for col, target in column_mapping.items()
+                              if target in REQUIRED_COLUMNS}
+
+    if is_parquet(file_path):
+        with trace.span('parquet.parse', file=name) as stage:
+            df = _read_parquet(file_path, column_mapping, all_columns, dtype, extra)
+            stage.set(rows=len(df))
+        if progress is not None:
+            progress(1.0)
+        return _finish(df, column_mapping)
+
+    read_kwargs = {}
+    if not all_columns:
+        soc_col, voltage_col = _source_columns(column_mapping)
+        read_kwargs['usecols'] = [soc_col, voltage_col, *extra.values()]
+        if dtype is not None:
+            # Timestamps may be date strings; time_seconds() converts them after parsing
+            numeric = [soc_col, voltage_col] + ([extra['Current']] if 'Current' in extra else [])
+            read_kwargs['dtype'] = {col: dtype for col in numeric}
+
+    with trace.span('csv.parse', file=name) as stage:
+        try:
+            df = _read_csv(file_path, read_kwargs, parser, progress, is_cancelled, chunk_rows)
+        except ValueError:
+            if 'dtype' not in read_kwargs:
+                raise
+            # Non-numeric cells: parse the same columns with inferred types instead
+            del read_kwargs['dtype']
+            stage.set(inferred_types=True)
+            df = _read_csv(file_path, read_kwargs, parser, progress, is_cancelled, chunk_rows)
+        stage.set(rows=len(df))
+
+    return _finish(df, column_mapping)
+
+
+def _read_csv(file_path, read_kwargs, parser, progress, is_cancelled, chunk_rows):
+    if progress is None and is_cancelled is None:
+        if parser == 'auto':
+            parser = 'pyarrow' if HAVE_PYARROW else 'c'
+        return pd.read_csv(file_path, engine=parser, **read_kwargs)
+
+    # Chunked reads need the C engine; pyarrow has no chunksize support
+    total_bytes = max(os.path.getsize(file_path), 1)
+    chunks = []
+    with open(file_path, 'rb') as handle:
+        for chunk in pd.read_csv(handle, chunksize=chunk_rows, **read_kwargs):
+            if is_cancelled is not None and is_cancelled():
+                raise LoadCancelled(f"Loading {file_path} was cancelled")
+            chunks.append(chunk)
+            if progress is not None:
+                progress(min(handle.tell() / total_bytes, 1.0))
+
+    if not chunks:
+        # Header-only file: let pandas build the empty frame
+        return pd.read_csv(file_path, **read_kwargs)
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def _read_parquet(file_path, column_mapping, all_columns, dtype, extra):
+    columns = None if all_columns else [*_source_columns(column_mapping), *extra.values()]
+    df = pd.read_parquet(file_path, columns=columns)
+    if columns is not None and dtype is not None:
+        try:
+            numeric = [col for col in columns if col != extra.get('Time')]
+            df = df.astype({col: dtype for col in numeric})
+        except (TypeError, ValueError):
+            pass  # Non-numeric cells: keep the stored types, like the CSV fallback
+    return df
+
+
+def summarize_dataset(df):
+    """Row/column counts and SOC/Voltage ranges for the information panel."""
+    with trace.span('stats.summary', rows=len(df)):
+        soc = df['SOC'].to_numpy()
+        voltage = df['Voltage'].to_numpy()
+        has_rows = len(df) > 0
+        return {
+            'rows': len(df),
+            'columns': list(df.columns),
+            'soc_min': np.nanmin(soc) if has_rows else np.nan,
+            'soc_max': np.nanmax(soc) if has_rows else np.nan,
+            'voltage_min': np.nanmin(voltage) if has_rows else np.nan,
+            'voltage_max': np.nanmax(voltage) if has_rows else np.nan,
+        }
+
+
+def overlap_window(df_a, sensor_column='SOC', method='endpoints', quantiles=DEFAULT_WINDOW_QUANTILES):
+    """
+    Return the (min, max) sensor range of Dataset A.
+
+    With 'endpoints' the range is spanned by the first and last rows. With
+    'quantile' it runs between the given quantiles of all finite sensor
+    values, so a noisy or resting first or last row cannot move it.
+    """
+    if method == 'quantile':
+        values = np.asarray(df_a[sensor_column].to_numpy(), dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return np.nan, np.nan
+        low, high = np.quantile(values, quantiles)
+        return float(low), float(high)
+    if method != 'endpoints':
+        raise ValueError(f"Unknown window method '{method}', expected one of {list(WINDOW_METHODS)}")
+    first_value_a = df_a[sensor_column].iloc[0]
+    last_value_a = df_a[sensor_column].iloc[-1]
+
+    # Ensure we have min and max values (in case data is not sorted)
+    return min(first_value_a, last_value_a), max(first_value_a, last_value_a)
+
+
+def merge_datasets_with_overlap_removal(df_a, df_b, sensor_column='SOC'):
+    """
+    Merge datasets using the specific logic:
+    1. Get first and last values from Dataset A
+    2. Remove overlapping range from Dataset B
+    3. Concatenate remaining Dataset B with Dataset A
+    """
+    return merge_segments([df_a, df_b], precedence='first', sensor_column=sensor_column)
+
+
+def _window_union(windows):
+    """Coalesce (min, max) windows into sorted, disjoint interval start/end arrays."""
+    starts, ends = [], []
+    for lo, hi in sorted(windows):
+        if starts and lo <= ends[-1]:
+            ends[-1] = max(ends[-1], hi)
+        else:
+            starts.append(lo)
+            ends.append(hi)
+    return np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+
+
+def in_windows(values, windows):
+    """Vectorized test of which values fall inside any of the closed (min, max) windows."""
+    values = np.asarray(values, dtype=np.float64)
+    if not windows:
+        return np.zeros(len(values), dtype=bool)
+    starts, ends = _window_union(windows)
+    slot = np.searchsorted(starts, values, side='right') - 1
+    return (slot >= 0) & (values <= ends[np.maximum(slot, 0)])
+
+
+def overlap_masks(segments, precedence='first', sensor_column='SOC', window_method='endpoints'):
+    """
+    The overlap-removal rule shared by every merge: which rows of each segment survive.
+
+    Segments are ranked by ``precedence``: with 'first' earlier segments win,
+    with 'last' later ones do. The top-ranked segment is kept whole; every
+    other segment loses the rows whose sensor value lies inside the window
+    of any higher-ranked segment (see overlap_window() for ``window_method``).
+
+    Returns ``(ranked, windows, masks)`` in rank order, where each mask is a
+    boolean keep array, or None for the top-ranked segment.
+    """
+    if precedence not in PRECEDENCE_RULES:
+        raise ValueError(f"Unknown precedence '{precedence}', expected one of {list(PRECEDENCE_RULES)}")
+    segments = list(segments)
+    if not segments:
+        raise ValueError("At least one dataset is required to merge")
+
+    ranked = segments if precedence == 'first' else segments[::-1]
+    windows = [overlap_window(segment, sensor_column, window_method) for segment in ranked]
+    logger.info("Dataset A range: %.3f to %.3f", *windows[0])
+
+    masks = [None]
+    with trace.span('merge.mask', segments=len(ranked)):
+        for rank, segment in enumerate(ranked[1:], start=1):
+            keep = ~in_windows(segment[sensor_column].to_numpy(), windows[:rank])
+            masks.append(keep)
+            kept = int(np.count_nonzero(keep))
+            logger.info("Filtered out %d rows from segment %d, %d remaining",
+                        len(keep) - kept, rank + 1, kept)
+    return ranked, windows, masks
+
+
+def merge_segments(segments, precedence='first', sensor_column='SOC', window_method='endpoints'):
+    """
+    Overlap-removal merge of any number of dataset segments into one DataFrame.
+
+    Applies overlap_masks(). The survivors are combined with a single
+    concatenation, lowest rank first, so two segments give exactly the
+    pairwise Dataset A/Dataset B merge. socmerge.arrays.merge_arrays()
+    produces the same rows already sorted, without the DataFrame copies.
+    """
+    ranked, _, masks = overlap_masks(segments, precedence, sensor_column, window_method)
+    kept = [segment if mask is None else segment[mask] for segment, mask in zip(ranked, masks)]
+
+    with trace.span('merge.concat') as stage:
+        merged_df = pd.concat(kept[::-1], ignore_index=True)
+        stage.set(rows=len(merged_df))
+    logger.info("Final merged dataset: %d rows", len(merged_df))
+
+    return merged_df
+
+
+def sort_merged(merged_df, ascending=True, sensor_column='SOC'):
+    """
+    Sort merged data by the sensor column and renumber the rows.
+
+    Equal values keep their merge order when ascending; descending is the
+    ascending order read backwards, ties included, as ArrayCurve and the
+    streaming merge give it. Rows with a NaN sensor value stay last, in
+    merge order.
+    """
+    with trace.span('merge.sort', rows=len(merged_df)):
+        values = np.asarray(merged_df[sensor_column].to_numpy(), dtype=np.float64)
+        order = np.argsort(values, kind='stable')
+        if not ascending:
+            valid = len(values) - int(np.count_nonzero(np.isnan(values)))
+            order = np.concatenate((order[:valid][::-1], order[valid:]))
+        return merged_df.take(order).reset_index(drop=True)
+
+
+def fit_trend(merged_df, degree=2, **options):
+    """
+    Fit the Voltage-vs-SOC trend line drawn over the analysis plots.
+
+    Same binned fit as the GUI and the batch CLI (socmerge.fitting);
+    ``options`` are the model, bin_width and smoothing of fit_trend_arrays().
+    """
+    from .arrays import fit_trend_arrays
+
+    soc = np.asarray(merged_df['SOC'].to_numpy(), dtype=np.float64)
+    voltage = np.asarray(merged_df['Voltage'].to_numpy(), dtype=np.float64)
+    return fit_trend_arrays(soc, voltage, degree, **options)
+
+
+def merge_curve(segments, degree=2, precedence='first', window_method='endpoints', **options):
+    """
+    Merge dataset segments and fit the trend once for both analysis directions.
+
+    Returns a socmerge.arrays.ArrayCurve; ``options`` go to merge_curve_arrays().
+    """
+    from .arrays import merge_curve_arrays
+
+    return merge_curve_arrays(segments, degree, precedence, window_method=window_method, **options)
+
+
+def analyze_segments(segments, mode='charging', degree=2, precedence='first', curve=None):
+    """
+    Merge, sort and fit any number of segments for a charging or discharging analysis.
+
+    Pass the ArrayCurve of an earlier analysis of the same segments as
+    ``curve`` to skip the merge and fit and only reorder the rows.
+    """
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+
+    if curve is None:
+        curve = merge_curve(segments, degree, precedence)
+    soc, voltage = curve.columns(ascending=ANALYSIS_MODES[mode])
+
+    return AnalysisResult(
+        merged=pd.DataFrame({'SOC': np.array(soc), 'Voltage': np.array(voltage)}),
+        mode=mode,
+        window=curve.window,
+        removed_rows=curve.removed_rows,
+        trend=curve.trend,
+    )
+
+
+def run_analysis(df_a, df_b, mode='charging', degree=2, curve=None):
+    """Merge, sort and fit two datasets for a charging or discharging analysis."""
+    return analyze_segments([df_a, df_b], mode, degree, 'first', curve)
@@ -0,0 +1,179 @@
+"""
+Export of merged curves to CSV and binary columnar formats.
+
+- ``csv``: plain text, as written by ArrayCurve.write_csv().
+- ``parquet``: compressed columnar file (snappy by default; zstd, gzip,
+  brotli, lz4 or none). Needs pyarrow.
+- ``feather``: Arrow IPC file that readers can memory-map (lz4 by default;
+  zstd or none). Needs pyarrow.
+- ``hdf5``: ``SOC`` and ``Voltage`` datasets in one HDF5 group (gzip by
+  default; lzf or none). Needs h5py.
+
+Binary files are written block by block from the curve's arrays, so no
+DataFrame copy of the merged rows is built. The Dataset A window, removed
+row count and trend model travel along as file metadata.
+
+write_partition() adds a curve to a partitioned dataset directory laid out
+as ``cell=<name>/mode=<mode>/part-0.<ext>``. Many cells, written by any
+number of processes, then read back as one table with ``cell`` and
+``mode`` columns (``pandas.read_parquet(root)`` or ``pyarrow.dataset``).
+Writing the same cell and mode again replaces its part.
+"""
+import json
+import os
+from urllib.parse import quote
+
+import numpy as np
+
+from . import trace
+from .arrays import BLOCK_ROWS
+from .engine import ANALYSIS_MODES
+
+# Format -> file extensions; the first one is used for new files
+EXPORT_FORMATS = {
+    'csv': ('.csv',),
+    'parquet': ('.parquet', '.pq'),
+    'feather': ('.feather', '.arrow'),
+    'hdf5': ('.h5', '.hdf5'),
+}
+
+# Format -> accepted compression codecs; the first one is the default
+COMPRESSIONS = {
+    'csv': ('none',),
+    'parquet': ('snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none'),
+    'feather': ('lz4', 'zstd', 'none'),
+    'hdf5': ('gzip', 'lzf', 'none'),
+}
+
+# Formats write_partition() can lay out as a partitioned dataset
+PARTITION_FORMATS = ('parquet', 'feather')
+
+
+def format_for_path(path):
+    """Export format implied by a file extension; raises ValueError for unknown ones."""
+    extension = os.path.splitext(path)[1].lower()
+    for fmt, extensions in EXPORT_FORMATS.items():
+        if extension in extensions:
+            return fmt
+    raise ValueError(f"Cannot tell the export format of '{path}', expected an extension from "
+                     f"{[ext for exts in EXPORT_FORMATS.values() for ext in exts]}")
+
+
+def _compression(fmt, compression):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {list(EXPORT_FORMATS)}")
+    compression = COMPRESSIONS[fmt][0] if compression is None else compression.lower()
+    if compression not in COMPRESSIONS[fmt]:
+        raise ValueError(f"Unknown {fmt} compression '{compression}', expected one of {list(COMPRESSIONS[fmt])}")
+    return None if compression == 'none' else compression
+
+
+def curve_metadata(curve, mode=None):
+    """Merge details stored alongside the rows in binary exports."""
+    trend = curve.trend
+    return {
+        'mode': mode,
+        'window': [float(value) for value in curve.window],
+        'removed_rows': int(curve.removed_rows),
+        'fit': getattr(trend, 'model', 'poly'),
+        'trend': [float(coeff) for coeff in getattr(trend, 'coeffs', ())],
+    }
+
+
+def _blocks(soc, voltage, block_rows):
+    # Descending views have negative strides; Arrow and h5py want contiguous blocks
+    for start in range(0, len(soc), block_rows):
+        yield (np.ascontiguousarray(soc[start:start + block_rows]),
+               np.ascontiguousarray(voltage[start:start + block_rows]))
+
+
+def _arrow_schema(metadata):
+    import pyarrow as pa
+    return pa.schema([('SOC', pa.float64()), ('Voltage', pa.float64())],
+                     metadata={'socmerge': json.dumps(metadata)})
+
+
+def _write_parquet(soc, voltage, path, compression, metadata, block_rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(metadata)
+    with pq.ParquetWriter(path, schema, compression=compression or 'none') as writer:
+        for soc_block, voltage_block in _blocks(soc, voltage, block_rows):
+            writer.write_table(pa.Table.from_arrays([soc_block, voltage_block], schema=schema))
+
+
+def _write_feather(soc, voltage, path, compression, metadata, block_rows):
+    import pyarrow as pa
+    schema = _arrow_schema(metadata)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        for soc_block, voltage_block in _blocks(soc, voltage, block_rows):
+            writer.write_batch(pa.RecordBatch.from_arrays([soc_block, voltage_block], schema=schema))
+
+
+def _write_hdf5(soc, voltage, path, compression, metadata, block_rows):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("HDF5 export needs h5py (pip install h5py)") from None
+    with h5py.File(path, 'w') as handle:
+        # Compression needs a chunked layout, which an empty dataset cannot have
+        options = {'chunks': True, 'compression': compression} if len(soc) else {}
+        datasets = [handle.create_dataset(name, shape=(len(soc),), dtype='<f8', **options)
+                    for name in ('SOC', 'Voltage')]
+        start = 0
+        for soc_block, voltage_block in _blocks(soc, voltage, block_rows):
+            datasets[0][start:start + len(soc_block)] = soc_block
+            datasets[1][start:start + len(soc_block)] = voltage_block
+            start += len(soc_block)
+        handle.attrs['socmerge'] = json.dumps(metadata)
+
+
+_WRITERS = {
+    'parquet': _write_parquet,
+    'feather': _write_feather,
+    'hdf5': _write_hdf5,
+}
+
+
+def write_curve(curve, path, fmt=None, ascending=True, compression=None, mode=None,
+                block_rows=BLOCK_ROWS):
+    """
+    Write an ArrayCurve in ascending or descending SOC order.
+
+    ``fmt`` defaults to the one implied by the file extension, and
+    ``compression`` to the format's default codec (see COMPRESSIONS).
+    """
+    fmt = fmt or format_for_path(path)
+    codec = _compression(fmt, compression)
+    if fmt == 'csv':
+        curve.write_csv(path, ascending, block_rows)
+        return path
+
+    soc, voltage = curve.columns(ascending)
+    with trace.span(f'export.{fmt}', rows=len(soc), compression=codec or 'none'):
+        _WRITERS[fmt](soc, voltage, path, codec, curve_metadata(curve, mode), block_rows)
+    return path
+
+
+def partition_path(root, cell, mode, fmt='parquet'):
+    """File of one cell and mode inside a partitioned dataset directory."""
+    # Partition values are URI-encoded, which pyarrow decodes when reading
+    return os.path.join(root, f"cell={quote(str(cell), safe='')}", f"mode={mode}",
+                        f"part-0{EXPORT_FORMATS[fmt][0]}")
+
+
+def write_partition(curve, root, cell, mode='charging', fmt='parquet', compression=None,
+                    block_rows=BLOCK_ROWS):
+    """Add (or replace) one cell's curve, in ``mode``'s SOC order, in the dataset under ``root``."""
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+    if fmt not in PARTITION_FORMATS:
+        raise ValueError(f"Partitioned datasets are written as {list(PARTITION_FORMATS)}, not '{fmt}'")
+    path = partition_path(root, cell, mode, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write beside the final name and rename, so readers of the dataset never see a partial part
+    tmp_path = os.path.join(os.path.dirname(path), f".part-0.{os.getpid()}.tmp")
+    write_curve(curve, tmp_path, fmt, ANALYSIS_MODES[mode], compression, mode, block_rows)
+    os.replace(tmp_path, path)
+    return path
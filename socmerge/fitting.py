@@ -0,0 +1,247 @@
+"""
+Trend fits whose cost does not grow with the number of merged rows.
+
+Rows are first reduced to fixed-width SOC bins (mean SOC, mean Voltage and
+row count per bin) with vectorized bincounts, block by block. The selected
+model is then fitted to the non-empty bins, each bin counting once, so
+densely sampled SOC regions no longer dominate the fit:
+
+- ``poly``: least-squares polynomial of the chosen degree.
+- ``monotone``: monotone piecewise-linear fit (isotonic regression by
+  pool-adjacent-violators, one knot per pooled block), rising or falling
+  with the curve's overall direction.
+- ``spline``: discrete smoothing spline (Whittaker smoother) over the bin
+  lattice, with a curvature penalty set by ``smoothing``.
+
+The fitted trend is tabulated once on a fixed SOC grid of GRID_POINTS
+points, which is what the plots draw; evaluating it at arbitrary SOC values
+interpolates that grid (or evaluates the polynomial directly).
+"""
+import logging
+
+import numpy as np
+
+from . import trace
+
+logger = logging.getLogger(__name__)
+
+FIT_MODELS = ('poly', 'monotone', 'spline')
+
+# Bin width in SOC units (percent): 1000 bins over 0-100 %
+DEFAULT_BIN_WIDTH = 0.1
+
+# Bins covering more SOC range than this point to a wrong --bin-width or SOC unit
+MAX_BINS = 1_000_000
+
+# Curvature penalty of the smoothing spline, in SOC units to the fourth power
+DEFAULT_SMOOTHING = 1.0
+
+# The spline is solved on at most this many bins; finer lattices are pooled first
+SPLINE_MAX_BINS = 500
+
+# Points of the SOC grid the trend is tabulated on
+GRID_POINTS = 1000
+
+# PAVA passes stop once a pass pools fewer than this fraction of the blocks;
+# the few violators left are pooled one by one
+PAVA_MIN_POOLED = 0.05
+
+
+class BinAccumulator:
+    """
+    Per-bin row count and SOC/Voltage sums over fixed-width SOC bins.
+
+    Bins are anchored at SOC 0, so chunks can be added in any order and the
+    bin range grows as needed. Rows with a NaN SOC or Voltage are skipped.
+    """
+
+    def __init__(self, width=DEFAULT_BIN_WIDTH):
+        if not width > 0:
+            raise ValueError(f"Bin width must be positive, got {width}")
+        self.width = float(width)
+        self.first_bin = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.soc_sums = np.zeros(0)
+        self.voltage_sums = np.zeros(0)
+        self.rows = 0
+
+    def _extend(self, low, high):
+        if not len(self.counts):
+            self.first_bin = low
+            before, after = 0, high - low + 1
+        else:
+            before = max(self.first_bin - low, 0)
+            after = max(high - (self.first_bin + len(self.counts) - 1), 0)
+        if len(self.counts) + before + after > MAX_BINS:
+            raise ValueError(f"SOC range spans more than {MAX_BINS} bins of width {self.width}; "
+                             f"use a larger bin width")
+        if before or after:
+            self.counts = np.pad(self.counts, (before, after))
+            self.soc_sums = np.pad(self.soc_sums, (before, after))
+            self.voltage_sums = np.pad(self.voltage_sums, (before, after))
+            self.first_bin -= before
+
+    def add(self, soc, voltage):
+        soc = np.asarray(soc, dtype=np.float64)
+        voltage = np.asarray(voltage, dtype=np.float64)
+        finite = np.isfinite(soc) & np.isfinite(voltage)
+        if not finite.all():
+            soc, voltage = soc[finite], voltage[finite]
+        if not len(soc):
+            return
+
+        index = np.floor(soc / self.width).astype(np.int64)
+        self._extend(int(index.min()), int(index.max()))
+        index -= self.first_bin
+        size = len(self.counts)
+        self.counts += np.bincount(index, minlength=size)
+        self.soc_sums += np.bincount(index, weights=soc, minlength=size)
+        self.voltage_sums += np.bincount(index, weights=voltage, minlength=size)
+        self.rows += len(soc)
+
+    def means(self):
+        """(soc, voltage, counts) of the non-empty bins in ascending SOC order."""
+        filled = self.counts > 0
+        counts = self.counts[filled]
+        return self.soc_sums[filled] / counts, self.voltage_sums[filled] / counts, counts
+
+
+class Trend:
+    """
+    Fitted Voltage-vs-SOC trend tabulated on a fixed ascending SOC grid.
+
+    Callable like the np.poly1d it replaces. ``coeffs`` holds the polynomial
+    coefficients (highest power first) for the ``poly`` model and is empty
+    otherwise.
+    """
+
+    def __init__(self, model, soc, voltage, coeffs=(), bins=0):
+        self.model = model
+        self.soc = soc
+        self.voltage = voltage
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)
+        self.bins = bins
+
+    def __call__(self, soc):
+        soc = np.asarray(soc, dtype=np.float64)
+        if self.model == 'poly':
+            return np.polyval(self.coeffs, soc)
+        values = np.interp(soc, self.soc, self.voltage)
+        return np.where(np.isnan(soc), np.nan, values)
+
+    def grid(self, ascending=True):
+        """(soc, voltage) of the tabulated trend in ascending or descending SOC order."""
+        if ascending:
+            return self.soc, self.voltage
+        return self.soc[::-1], self.voltage[::-1]
+
+    def describe(self):
+        """Short text form for summaries: the coefficients, or the model and bin count."""
+        if self.model == 'poly':
+            return ' '.join(f"{c:.6g}" for c in self.coeffs)
+        return f"{self.model} ({self.bins} bins)"
+
+
+def _pool_sequential(values, weights, sizes):
+    """Classic one-block-at-a-time pool-adjacent-violators over existing blocks."""
+    out_values, out_weights, out_sizes = [], [], []
+    for value, weight, size in zip(values.tolist(), weights.tolist(), sizes.tolist()):
+        # Pool ties as well, so block values end up strictly increasing
+        while out_values and out_values[-1] >= value:
+            prev_weight = out_weights.pop()
+            value = (out_values.pop() * prev_weight + value * weight) / (prev_weight + weight)
+            weight += prev_weight
+            size += out_sizes.pop()
+        out_values.append(value)
+        out_weights.append(weight)
+        out_sizes.append(size)
+    return np.asarray(out_values), np.asarray(out_weights), np.asarray(out_sizes, dtype=np.int64)
+
+
+def pava_blocks(y, weights):
+    """
+    Pool-adjacent-violators: (values, weights, sizes) of the increasing blocks.
+
+    Pooling adjacent violators in any order reaches the same fit, so each
+    pass pools every maximal non-increasing run of blocks at once with
+    reduceat. Noisy curves collapse in a handful of passes; when a pass
+    pools fewer than PAVA_MIN_POOLED of the blocks (e.g. one long cascade),
+    the remaining blocks are finished sequentially.
+    """
+    values = np.asarray(y, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    while len(values) > 1:
+        falls = values[1:] <= values[:-1]
+        if not falls.any():
+            return values, weights, sizes
+        starts = np.flatnonzero(np.concatenate(([True], ~falls)))
+        if len(values) - len(starts) < PAVA_MIN_POOLED * len(values):
+            return _pool_sequential(values, weights, sizes)
+        pooled_weights = np.add.reduceat(weights, starts)
+        values = np.add.reduceat(values * weights, starts) / pooled_weights
+        weights = pooled_weights
+        sizes = np.add.reduceat(sizes, starts)
+    return values, weights, sizes
+
+
+def _monotone_knots(soc, voltage):
+    # Rising or falling with the curve overall, as the lookup table's inverse does
+    sign = 1.0 if voltage[-1] >= voltage[0] else -1.0
+    values, _, sizes = pava_blocks(sign * voltage, np.ones(len(voltage)))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    return np.add.reduceat(soc, starts) / sizes, sign * values
+
+
+def _smoothing_spline(bins, smoothing):
+    """Whittaker smoother over the full bin lattice; empty bins carry zero weight."""
+    filled = bins.counts > 0
+    first, last = np.flatnonzero(filled)[[0, -1]]
+    counts = bins.counts[first:last + 1]
+    voltage_sums = bins.voltage_sums[first:last + 1]
+
+    # Pool neighbouring bins so the dense solve stays small
+    factor = -(-len(counts) // SPLINE_MAX_BINS)
+    if factor > 1:
+        starts = np.arange(0, len(counts), factor)
+        counts = np.add.reduceat(counts, starts)
+        voltage_sums = np.add.reduceat(voltage_sums, starts)
+    spacing = bins.width * factor
+    centers = (bins.first_bin + first + (np.arange(len(counts)) + 0.5) * factor) * bins.width
+
+    weights = (counts > 0).astype(np.float64)
+    means = np.divide(voltage_sums, counts, out=np.zeros(len(counts)), where=counts > 0)
+    if len(counts) < 3:
+        return centers[counts > 0], means[counts > 0]
+
+    # minimise sum w (y - z)^2 + lam * sum (second difference of z)^2,
+    # with lam scaled so the curvature penalty does not depend on the bin width
+    second_diff = np.diff(np.eye(len(counts)), 2, axis=0)
+    lam = smoothing / spacing ** 4
+    system = np.diag(weights) + lam * (second_diff.T @ second_diff)
+    return centers, np.linalg.solve(system, weights * means)
+
+
+def fit_bins(bins, model='poly', degree=2, smoothing=DEFAULT_SMOOTHING, grid_points=GRID_POINTS):
+    """Fit a trend of the given model to a BinAccumulator and tabulate it on the SOC grid."""
+    if model not in FIT_MODELS:
+        raise ValueError(f"Unknown fit model '{model}', expected one of {list(FIT_MODELS)}")
+    soc, voltage, _ = bins.means()
+    if not len(soc):
+        raise ValueError("Cannot fit a trend to a curve without valid rows")
+
+    with trace.span('fit.model', model=model, bins=len(soc)):
+        grid = np.linspace(soc[0], soc[-1], grid_points)
+        coeffs = ()
+        if model == 'poly':
+            if degree >= len(soc):
+                logger.warning("Only %d SOC bins; lowering the trend degree from %d to %d",
+                               len(soc), degree, len(soc) - 1)
+                degree = len(soc) - 1
+            coeffs = np.polyfit(soc, voltage, degree)
+            values = np.polyval(coeffs, grid)
+        elif model == 'monotone':
+            values = np.interp(grid, *_monotone_knots(soc, voltage))
+        else:
+            values = np.interp(grid, *_smoothing_spline(bins, smoothing))
+    return Trend(model, grid, values, coeffs, len(soc))
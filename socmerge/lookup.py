@@ -0,0 +1,202 @@
+"""
+Voltage-at-SOC and SOC-at-voltage lookups over a merged curve.
+
+A CurveTable is built once from a merged result and answers vectorized
+batch queries in both directions:
+
+- Forward (SOC -> Voltage): rows that share a SOC value are averaged into
+  one knot, so the knots are strictly increasing in SOC.
+- Inverse (Voltage -> SOC): measured voltage is noisy and rarely monotone
+  in SOC, so it is first replaced by its least-squares monotone fit
+  (isotonic regression, pool-adjacent-violators). Each flat block of that
+  fit becomes one knot at the block's mean SOC. Every voltage then maps to
+  exactly one SOC. The pooling runs as whole-array NumPy passes, see
+  socmerge.fitting.pava_blocks().
+
+Both directions interpolate piecewise-linearly or with a shape-preserving
+cubic (PCHIP) whose knot slopes are precomputed. Queries outside the table
+are clamped to its ends unless ``clip=False``, which returns NaN instead.
+
+Tables are saved as a small binary file (fixed header plus raw little-endian
+float64 arrays) that loads in milliseconds.
+"""
+import struct
+
+import numpy as np
+
+from . import trace
+from .fitting import pava_blocks
+
+LOOKUP_METHODS = ('linear', 'pchip')
+
+# File layout: magic, version, forward knot count, inverse knot count, then
+# soc, voltage, slopes (forward) and voltage, soc, slopes (inverse) as <f8
+_MAGIC = b'SOCLUT\x00\x00'
+_VERSION = 1
+_HEADER = struct.Struct('<8sIQQ')
+
+# Batches at least this large are answered in sorted order and scattered back,
+# which turns random table searches into cache-friendly sequential ones
+SORTED_QUERY_MIN = 65_536
+
+
+def pchip_slopes(x, y):
+    """Fritsch-Carlson knot slopes for a monotone-preserving cubic through (x, y)."""
+    n = len(x)
+    if n < 2:
+        return np.zeros(n)
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    slopes = np.empty(n)
+    slopes[0], slopes[-1] = delta[0], delta[-1]
+    if n > 2:
+        # Weighted harmonic mean of neighbouring secants; zero at local extrema
+        w1 = 2 * h[1:] + h[:-1]
+        w2 = h[1:] + 2 * h[:-1]
+        same_sign = delta[:-1] * delta[1:] > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            harmonic = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+        slopes[1:-1] = np.where(same_sign, harmonic, 0.0)
+    return slopes
+
+
+def _evaluate(x, y, slopes, q, method):
+    if len(x) == 1:
+        return np.full(q.shape, y[0])
+    if method == 'linear':
+        return np.interp(q, x, y)
+    q = np.clip(q, x[0], x[-1])
+    i = np.clip(np.searchsorted(x, q, side='right') - 1, 0, len(x) - 2)
+    h = x[i + 1] - x[i]
+    t = (q - x[i]) / h
+    t2, t3 = t * t, t * t * t
+    return ((2 * t3 - 3 * t2 + 1) * y[i] + (t3 - 2 * t2 + t) * h * slopes[i]
+            + (-2 * t3 + 3 * t2) * y[i + 1] + (t3 - t2) * h * slopes[i + 1])
+
+
+def _interpolate(x, y, slopes, queries, method, clip):
+    if method not in LOOKUP_METHODS:
+        raise ValueError(f"Unknown lookup method '{method}', expected one of {LOOKUP_METHODS}")
+    queries = np.asarray(queries, dtype=np.float64)
+    flat = queries.ravel()
+
+    if len(flat) >= SORTED_QUERY_MIN and np.any(flat[1:] < flat[:-1]):
+        order = np.argsort(flat)
+        result = np.empty(len(flat))
+        result[order] = _evaluate(x, y, slopes, flat[order], method)
+    else:
+        result = _evaluate(x, y, slopes, flat, method)
+
+    if not clip:
+        result[(flat < x[0]) | (flat > x[-1])] = np.nan
+    # NaN queries give NaN answers in either method
+    result[np.isnan(flat)] = np.nan
+    result = result.reshape(queries.shape)
+    return result if result.ndim else float(result)
+
+
+class CurveTable:
+    """Sorted knot tables of one merged curve for fast batch lookups in both directions."""
+
+    def __init__(self, soc, voltage, soc_slopes, inv_voltage, inv_soc, inv_slopes):
+        self.soc = soc
+        self.voltage = voltage
+        self.soc_slopes = soc_slopes
+        self.inv_voltage = inv_voltage
+        self.inv_soc = inv_soc
+        self.inv_slopes = inv_slopes
+
+    @classmethod
+    def from_arrays(cls, soc, voltage):
+        """Build the tables from SOC/Voltage rows in any order; NaN rows are ignored."""
+        with trace.span('lookup.build', rows=len(soc)):
+            return cls._build(soc, voltage)
+
+    @classmethod
+    def _build(cls, soc, voltage):
+        soc = np.asarray(soc, dtype=np.float64)
+        voltage = np.asarray(voltage, dtype=np.float64)
+        finite = np.isfinite(soc) & np.isfinite(voltage)
+        if not finite.all():
+            soc, voltage = soc[finite], voltage[finite]
+        if not len(soc):
+            raise ValueError("Cannot build a lookup table from a curve without valid rows")
+        if np.any(soc[1:] < soc[:-1]):
+            order = np.argsort(soc, kind='stable')
+            soc, voltage = soc[order], voltage[order]
+
+        # Average the voltage of rows that share a SOC value
+        starts = np.flatnonzero(np.concatenate(([True], soc[1:] != soc[:-1])))
+        counts = np.diff(np.append(starts, len(soc))).astype(np.float64)
+        knot_soc = soc[starts]
+        knot_voltage = np.add.reduceat(voltage, starts) / counts
+
+        # Monotone inverse, in whichever direction the curve runs overall
+        increasing = knot_voltage[-1] >= knot_voltage[0]
+        sign = 1.0 if increasing else -1.0
+        values, weights, sizes = pava_blocks(sign * knot_voltage, counts)
+        block_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        inv_voltage = sign * values
+        inv_soc = np.add.reduceat(knot_soc * counts, block_starts) / weights
+        if not increasing:
+            inv_voltage, inv_soc = inv_voltage[::-1].copy(), inv_soc[::-1].copy()
+
+        return cls(knot_soc, knot_voltage, pchip_slopes(knot_soc, knot_voltage),
+                   inv_voltage, inv_soc, pchip_slopes(inv_voltage, inv_soc))
+
+    @classmethod
+    def from_curve(cls, curve):
+        """Build the tables from an ArrayCurve (or any object with ``soc``/``voltage`` arrays)."""
+        return cls.from_arrays(curve.soc, curve.voltage)
+
+    def __len__(self):
+        return len(self.soc)
+
+    @property
+    def soc_range(self):
+        return float(self.soc[0]), float(self.soc[-1])
+
+    @property
+    def voltage_range(self):
+        return float(self.inv_voltage[0]), float(self.inv_voltage[-1])
+
+    def voltage_at(self, soc, method='linear', clip=True):
+        """Voltage at each SOC in ``soc`` (scalar or array)."""
+        return _interpolate(self.soc, self.voltage, self.soc_slopes, soc, method, clip)
+
+    def soc_at(self, voltage, method='linear', clip=True):
+        """SOC at each voltage in ``voltage`` (scalar or array), from the monotone inverse."""
+        return _interpolate(self.inv_voltage, self.inv_soc, self.inv_slopes, voltage, method, clip)
+
+    def save(self, path):
+        """Write the tables to a compact binary file."""
+        with open(path, 'wb') as handle:
+            handle.write(_HEADER.pack(_MAGIC, _VERSION, len(self.soc), len(self.inv_voltage)))
+            for array in (self.soc, self.voltage, self.soc_slopes,
+                          self.inv_voltage, self.inv_soc, self.inv_slopes):
+                handle.write(np.ascontiguousarray(array, dtype='<f8').tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Read tables written by save(), memory-mapping the arrays unless ``mmap`` is False."""
+        with open(path, 'rb') as handle:
+            header = handle.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError(f"{path} is not a SOC lookup table")
+            magic, version, forward, inverse = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a SOC lookup table")
+            if version != _VERSION:
+                raise ValueError(f"{path} has unsupported lookup table version {version}")
+            data = None if mmap else handle.read()
+
+        arrays = []
+        offset = _HEADER.size
+        for count in (forward, forward, forward, inverse, inverse, inverse):
+            if mmap:
+                arrays.append(np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(count,)))
+            else:
+                arrays.append(np.frombuffer(data, dtype='<f8', count=count,
+                                            offset=offset - _HEADER.size))
+            offset += 8 * count
+        return cls(*arrays)
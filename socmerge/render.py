@@ -0,0 +1,428 @@
+"""
+Off-screen plot rendering from snapshots of the plotted arrays.
+
+A PlotSnapshot holds everything a saved plot needs: each series' arrays
+and line style, the title, axis labels and limits, the figure size and the
+matplotlib style. It keeps no reference to a live figure, so it can be
+pickled to a worker process and drawn there with the Agg backend while the
+GUI stays responsive.
+
+render_plot() lays a figure out once (tight layout and tight bounding box)
+and writes every requested format from that layout. Unless the snapshot
+asks for full resolution, series are first min/max-decimated to the
+output's pixel width, so a 300 DPI PNG of millions of rows stays cheap.
+
+Rendered files are cached by the snapshot's content hash (arrays, style
+and DPI). Saving the same plot again copies the cached file instead of
+drawing it. Each process also keeps its most recent laid-out figures, so
+the Renderer's worker can save a plot it has just drawn in another format
+without laying it out again.
+
+matplotlib is imported only when a plot is drawn; pyplot is never used.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import trace
+from .cache import DEFAULT_CACHE_DIR
+from .decimate import decimate_indices
+from .engine import ANALYSIS_MODES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DPI = 300
+
+# Formats render_plot() writes, by file extension
+PLOT_FORMATS = ('png', 'pdf', 'svg', 'eps', 'ps')
+
+# matplotlib style of the GUI and of batch plots
+PLOT_STYLE = 'seaborn-v0_8'
+
+DEFAULT_FIGSIZE = (12, 8)
+
+DEFAULT_PLOT_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'plots')
+DEFAULT_PLOT_CACHE_BYTES = 512 * 1024 ** 2
+
+# Laid-out figures kept per process for saving in further formats
+FIGURE_CACHE_SIZE = 4
+
+# Per-mode styling of the analysis plots
+ANALYSIS_STYLES = {
+    'charging': {
+        'color': 'blue',
+        'label': 'Charging Curve',
+        'title': 'Charging Analysis - Voltage vs SOC (Ascending Order)',
+        'order': 'ascending',
+    },
+    'discharging': {
+        'color': 'orange',
+        'label': 'Discharging Curve',
+        'title': 'Discharging Analysis - Voltage vs SOC (Descending Order)',
+        'order': 'descending',
+    },
+}
+
+SOC_LABEL = 'State of Charge (SOC) [%]'
+VOLTAGE_LABEL = 'Voltage [V]'
+
+# Per-kind styling of the differential plots (socmerge.differential)
+DIFFERENTIAL_STYLES = {
+    'dva': {
+        'title': 'Differential Voltage Analysis - dV/dSOC vs SOC',
+        'xlabel': SOC_LABEL,
+        'ylabel': 'dV/dSOC [{unit}]',
+        'label': 'dV/dSOC',
+    },
+    'ica': {
+        'title': 'Incremental Capacity Analysis - dQ/dV vs Voltage',
+        'xlabel': VOLTAGE_LABEL,
+        'ylabel': 'dQ/dV [{unit}]',
+        'label': 'dQ/dV',
+    },
+}
+
+# Line2D properties a snapshot copies from a plotted line
+_LINE_PROPERTIES = ('color', 'linestyle', 'linewidth', 'marker', 'markersize', 'alpha', 'label',
+                    'zorder')
+
+
+def style_params(style=PLOT_STYLE):
+    """
+    rcParams of one matplotlib style.
+
+    Bundled styles are read from their own file instead of loading the whole
+    style library, which matplotlib.style does on import.
+    """
+    import matplotlib
+    if not style:
+        return {}
+    path = os.path.join(matplotlib.get_data_path(), 'stylelib', f'{style}.mplstyle')
+    if os.path.exists(path):
+        return matplotlib.rc_params_from_file(path, use_default_template=False)
+    import matplotlib.style
+    if style not in matplotlib.style.library:
+        raise ValueError(f"Unknown matplotlib style '{style}'")
+    return matplotlib.style.library[style]
+
+
+def plot_format(path):
+    """Plot format implied by a file extension; raises ValueError for unknown ones."""
+    fmt = os.path.splitext(path)[1].lower().lstrip('.')
+    if fmt not in PLOT_FORMATS:
+        raise ValueError(f"Cannot save a plot as '{path}', expected one of "
+                         f"{['.' + fmt for fmt in PLOT_FORMATS]}")
+    return fmt
+
+
+class PlotSnapshot:
+    """Picklable description of a single-axes line plot."""
+
+    def __init__(self, title='', xlabel='', ylabel='', figsize=DEFAULT_FIGSIZE, xlim=None,
+                 ylim=None, style=PLOT_STYLE, full_resolution=False, title_size=14,
+                 label_size=12, legend=True):
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.figsize = tuple(float(size) for size in figsize)
+        self.xlim = None if xlim is None else tuple(float(limit) for limit in xlim)
+        self.ylim = None if ylim is None else tuple(float(limit) for limit in ylim)
+        self.style = style
+        self.full_resolution = full_resolution
+        self.title_size = title_size
+        self.label_size = label_size
+        self.legend = legend
+        self.series = []  # (x, y, line properties)
+
+    def add_series(self, x, y, **properties):
+        self.series.append((np.ascontiguousarray(x, dtype=np.float64),
+                            np.ascontiguousarray(y, dtype=np.float64), properties))
+
+    @classmethod
+    def from_axes(cls, ax, data=None, **options):
+        """
+        Snapshot of the lines, labels and limits of a live matplotlib Axes.
+
+        ``data`` maps lines to the full-resolution (x, y) arrays behind them,
+        such as those a decimating view keeps; other lines are copied as drawn.
+        """
+        from matplotlib.colors import to_hex
+
+        data = data or {}
+        snapshot = cls(ax.get_title(), ax.get_xlabel(), ax.get_ylabel(),
+                       ax.figure.get_size_inches(), ax.get_xlim(), ax.get_ylim(),
+                       title_size=ax.title.get_fontsize(), label_size=ax.xaxis.label.get_fontsize(),
+                       legend=ax.get_legend() is not None, **options)
+        for line in ax.get_lines():
+            x, y = data.get(line, (line.get_xdata(), line.get_ydata()))
+            properties = {name: getattr(line, f'get_{name}')() for name in _LINE_PROPERTIES}
+            properties['color'] = to_hex(properties['color'], keep_alpha=True)
+            snapshot.add_series(x, y, **properties)
+        return snapshot
+
+    def key(self, dpi=DEFAULT_DPI):
+        """Content hash of the arrays, styling and DPI; equal plots share a key."""
+        digest = hashlib.sha256()
+        layout = {name: value for name, value in vars(self).items() if name != 'series'}
+        layout['series'] = [properties for _, _, properties in self.series]
+        layout['dpi'] = dpi
+        digest.update(json.dumps(layout, sort_keys=True, default=str).encode('utf-8'))
+        for x, y, _ in self.series:
+            digest.update(x.tobytes())
+            digest.update(y.tobytes())
+        return digest.hexdigest()
+
+
+def analysis_snapshot(curve, mode, figsize=DEFAULT_FIGSIZE):
+    """Snapshot of the charging or discharging plot the GUI draws for a merged ArrayCurve."""
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+    style = ANALYSIS_STYLES[mode]
+    ascending = ANALYSIS_MODES[mode]
+    snapshot = PlotSnapshot(style['title'], SOC_LABEL, VOLTAGE_LABEL, figsize)
+    snapshot.add_series(*curve.columns(ascending), color=style['color'], label=style['label'],
+                        marker='o', linestyle='-', markersize=5, linewidth=2)
+    snapshot.add_series(*curve.trend.grid(ascending), color='red', label='Trend', linestyle='--',
+                        alpha=0.8)
+    return snapshot
+
+
+def differential_arrays(curves, kind):
+    """(x, y) arrays of one kind of DifferentialCurves plot, 'dva' or 'ica'."""
+    if kind not in DIFFERENTIAL_STYLES:
+        raise ValueError(f"Unknown differential plot '{kind}', expected one of {list(DIFFERENTIAL_STYLES)}")
+    return (curves.soc, curves.dv_dsoc) if kind == 'dva' else (curves.voltage, curves.dq_dv)
+
+
+def differential_snapshot(curves, kind, mode=None, figsize=DEFAULT_FIGSIZE):
+    """Snapshot of the DVA or ICA plot of DifferentialCurves, coloured like ``mode``'s analysis."""
+    style = DIFFERENTIAL_STYLES[kind]
+    title = style['title'] if mode is None else f"{style['title']} ({mode.capitalize()})"
+    snapshot = PlotSnapshot(title, style['xlabel'], style['ylabel'].format(unit=curves.units[kind]),
+                            figsize)
+    color = ANALYSIS_STYLES[mode]['color'] if mode in ANALYSIS_STYLES else 'green'
+    snapshot.add_series(*differential_arrays(curves, kind), color=color, label=style['label'],
+                        linestyle='-', linewidth=2)
+    return snapshot
+
+
+def _visible_points(x, y, xlim, points):
+    # Like the GUI's decimated view: only the visible x range, about one point per pixel column
+    if xlim is not None:
+        low, high = sorted(xlim)
+        visible = np.flatnonzero((x >= low) & (x <= high))
+        if len(visible) < len(x):
+            if len(visible) <= points:
+                return x[visible], y[visible]
+            index = visible[decimate_indices(x[visible], y[visible], points)]
+            return x[index], y[index]
+    if len(x) <= points:
+        return x, y
+    index = decimate_indices(x, y, points)
+    return x[index], y[index]
+
+
+class LaidOutFigure:
+    """A figure drawn once, with the tight bounding box every saved format reuses."""
+
+    def __init__(self, snapshot, dpi):
+        import matplotlib
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.style = style_params(snapshot.style)
+        self.dpi = dpi
+        with matplotlib.rc_context(self.style):
+            self.figure = Figure(figsize=snapshot.figsize, dpi=dpi)
+            FigureCanvasAgg(self.figure)
+            ax = self.figure.add_subplot(111)
+            points = max(int(snapshot.figsize[0] * dpi), 100)
+            for x, y, properties in snapshot.series:
+                if not snapshot.full_resolution:
+                    x, y = _visible_points(x, y, snapshot.xlim, points)
+                ax.plot(x, y, **properties)
+            ax.set_xlabel(snapshot.xlabel, fontsize=snapshot.label_size)
+            ax.set_ylabel(snapshot.ylabel, fontsize=snapshot.label_size)
+            ax.set_title(snapshot.title, fontsize=snapshot.title_size, fontweight='bold')
+            ax.grid(True, alpha=0.3)
+            if snapshot.xlim is not None:
+                ax.set_xlim(snapshot.xlim)
+            if snapshot.ylim is not None:
+                ax.set_ylim(snapshot.ylim)
+            if snapshot.legend and snapshot.series:
+                ax.legend()
+            self.figure.tight_layout()
+
+            # The one layout pass: every format is cropped to this box instead of measuring again
+            renderer = self.figure.canvas.get_renderer()
+            self.figure.draw(renderer)
+            self.bbox = self.figure.get_tightbbox(renderer).padded(
+                matplotlib.rcParams['savefig.pad_inches'])
+
+    def save(self, path, fmt):
+        import matplotlib
+        with matplotlib.rc_context(self.style):
+            self.figure.savefig(path, format=fmt, dpi=self.dpi, bbox_inches=self.bbox)
+
+
+_figures = OrderedDict()
+
+
+def _laid_out(snapshot, dpi, key):
+    figure = _figures.pop(key, None)
+    if figure is None:
+        with trace.span('render.layout', series=len(snapshot.series),
+                        rows=sum(len(x) for x, _, _ in snapshot.series)):
+            figure = LaidOutFigure(snapshot, dpi)
+    _figures[key] = figure
+    while len(_figures) > FIGURE_CACHE_SIZE:
+        _figures.popitem(last=False)
+    return figure
+
+
+class RenderCache:
+    """LRU-capped directory of rendered plot files, keyed by snapshot hash and format."""
+
+    def __init__(self, cache_dir=DEFAULT_PLOT_CACHE_DIR, max_bytes=DEFAULT_PLOT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key, fmt):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def fetch(self, key, fmt, path):
+        """Copy a cached rendering to ``path``; False on a miss."""
+        entry = self.entry_path(key, fmt)
+        try:
+            shutil.copyfile(entry, path)
+        except FileNotFoundError:
+            return False
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry)
+        return True
+
+    def store(self, key, fmt, path):
+        """Keep a copy of a freshly rendered ``path``."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, self.entry_path(key, fmt))
+        except Exception:
+            _remove(tmp_path)
+            raise
+        self.prune()
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.cache_dir, name) for name in names
+                if name.rpartition('.')[2] in PLOT_FORMATS]
+
+    def prune(self):
+        """Evict least recently used renderings until the cache fits ``max_bytes``."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(entry)
+            total -= size
+
+    def clear(self):
+        for entry in self._entries():
+            _remove(entry)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def render_plot(snapshot, paths, dpi=DEFAULT_DPI, cache=None):
+    """
+    Save a snapshot to every path in ``paths`` (format from each extension).
+
+    Formats found in ``cache`` (a RenderCache) are copied from it; the rest
+    share one layout pass. Returns the number of files actually drawn.
+    """
+    formats = [(path, plot_format(path)) for path in paths]
+    key = snapshot.key(dpi)
+    pending = []
+    for path, fmt in formats:
+        if cache is not None and cache.fetch(key, fmt, path):
+            logger.info("Plot %s copied from the render cache", path)
+        else:
+            pending.append((path, fmt))
+
+    if pending:
+        figure = _laid_out(snapshot, dpi, key)
+        for path, fmt in pending:
+            with trace.span('render.save', format=fmt, dpi=dpi):
+                figure.save(path, fmt)
+            if cache is not None:
+                try:
+                    cache.store(key, fmt, path)
+                except OSError as e:
+                    # A full or read-only cache must never fail the save itself
+                    logger.warning("Could not cache plot %s: %s", path, e)
+    return len(pending)
+
+
+def render_job(snapshot, paths, dpi, cache_dir, cache_max_bytes, collect_trace=False):
+    """render_plot() in a worker process; returns (files drawn, trace events)."""
+    if collect_trace:
+        trace.enable()
+    cache = RenderCache(cache_dir, cache_max_bytes) if cache_dir else None
+    drawn = render_plot(snapshot, paths, dpi, cache)
+    return drawn, trace.TRACER.drain() if collect_trace else []
+
+
+class Renderer:
+    """
+    Renders snapshots in one background worker process.
+
+    The worker is started on first use with the 'spawn' method, so it never
+    inherits a GUI toolkit's threads. Jobs run in submission order.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_PLOT_CACHE_DIR, cache_max_bytes=DEFAULT_PLOT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self._executor = None
+
+    def submit(self, snapshot, paths, dpi=DEFAULT_DPI):
+        """Queue a render; the Future's result is (files drawn, worker trace events)."""
+        for path in paths:
+            plot_format(path)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=1,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor.submit(render_job, snapshot, list(paths), dpi, self.cache_dir,
+                                     self.cache_max_bytes, trace.is_enabled())
+
+    def close(self):
+        """Finish queued renders and stop the worker."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
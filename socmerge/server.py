@@ -0,0 +1,507 @@
+"""
+Local HTTP service for the overlap-removal merge and trend fit.
+
+    python -m socmerge serve --port 8765 --workers 4
+
+Endpoints:
+
+- ``GET /health``: service status, queue depth and cache size.
+- ``POST /merge``: merge two or more datasets. The body is either JSON,
+  ``{"datasets": ["a.csv", "b.parquet"], "mode": "charging", "degree": 2,
+  "precedence": "first", "fit": "poly"}``, with paths on this machine, or
+  ``multipart/form-data`` with one file part per dataset (in order) and
+  optional ``mode``/``degree``/``precedence``/``fit`` fields. The reply is JSON with
+  the row count, Dataset A window, removed rows, trend coefficients and the
+  URL of the merged CSV. Add ``?format=csv`` to get the CSV itself.
+- ``GET /results/<key>.csv``: merged rows of an earlier merge.
+
+Merges run on a bounded process pool. At most ``max_pending`` merges are
+queued or running; beyond that the service answers 503 with a Retry-After
+header instead of queueing without limit. Requests are keyed by the SHA-256
+of every dataset's content plus the options. A repeated request is answered
+from the result cache without merging, and identical requests that arrive
+while the first is still running share its job.
+
+Datasets named by path may change between the request and the merge. The
+worker therefore copies each one into the work directory while hashing it
+and merges that copy, so the merged bytes are exactly the hashed ones. If
+the digest no longer matches the request key, the request gets 409
+Conflict instead of a result filed under the wrong key.
+
+A worker that dies (e.g. out of memory) breaks the process pool. The
+service then starts a fresh pool for later requests; only the merges that
+were running on the broken one fail, with 503 and a Retry-After header.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.parser import BytesParser
+from email.policy import HTTP
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .arrays import merge_curve_arrays
+from .engine import ANALYSIS_MODES, PARQUET_EXTENSIONS, PRECEDENCE_RULES, ColumnError, load_dataset
+from .fitting import FIT_MODELS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_UPLOAD_BYTES = 256 * 1024 ** 2
+DEFAULT_CACHE_ENTRIES = 128
+
+_HASH_BLOCK = 1024 ** 2
+
+
+class ServiceBusy(Exception):
+    """Raised when the merge queue is full."""
+
+
+class WorkerLost(Exception):
+    """Raised when the worker running a merge died; reported as 503 so the client retries."""
+
+
+class RequestError(ValueError):
+    """Raised for malformed merge requests; reported as 400 Bad Request."""
+
+
+class DatasetChanged(RequestError):
+    """Raised when a dataset no longer matches the digest it was requested with; reported as 409."""
+
+
+def _snapshot(path, digest, directory):
+    """Copy ``path`` into ``directory`` while hashing it; the copy must match ``digest``."""
+    fd, copy_path = tempfile.mkstemp(dir=directory, suffix=os.path.splitext(path)[1].lower())
+    hasher = hashlib.sha256()
+    try:
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            for block in iter(lambda: source.read(_HASH_BLOCK), b''):
+                hasher.update(block)
+                target.write(block)
+        if hasher.hexdigest() != digest:
+            raise DatasetChanged(f"{path} changed while the merge was queued; repeat the request")
+    except BaseException:
+        os.remove(copy_path)
+        raise
+    return copy_path
+
+
+def merge_job(paths, mode, degree, precedence, fit, csv_path, digests=None, snapshot_dir=None):
+    """
+    Merge, sort and fit in a worker process; writes the CSV and returns the merge details.
+
+    With ``digests``, each dataset is first copied to ``snapshot_dir`` and
+    checked against its digest, and the copies are merged.
+    """
+    snapshots = []
+    try:
+        if digests is not None:
+            for path, digest in zip(paths, digests):
+                snapshots.append(_snapshot(path, digest, snapshot_dir))
+            paths = snapshots
+        curve = merge_curve_arrays([load_dataset(path) for path in paths], degree, precedence,
+                                   model=fit)
+    finally:
+        for path in snapshots:
+            os.remove(path)
+    # Publish atomically so a concurrent GET never reads a partial file
+    tmp_path = csv_path + '.tmp'
+    curve.write_csv(tmp_path, ascending=ANALYSIS_MODES[mode])
+    os.replace(tmp_path, csv_path)
+    return {
+        'rows': len(curve),
+        'mode': mode,
+        'window': [float(value) for value in curve.window],
+        'removed_rows': int(curve.removed_rows),
+        'fit': fit,
+        'trend': [float(coeff) for coeff in curve.trend.coeffs],
+    }
+
+
+class ResultCache:
+    """LRU of finished merges: details in memory, merged CSV files on disk."""
+
+    def __init__(self, directory, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def csv_path(self, key):
+        return os.path.join(self.directory, key + '.csv')
+
+    def get(self, key):
+        with self._lock:
+            details = self._entries.get(key)
+            if details is not None:
+                self._entries.move_to_end(key)
+            return details
+
+    def put(self, key, details):
+        with self._lock:
+            self._entries[key] = details
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                try:
+                    os.remove(self.csv_path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MergeService:
+    """Content-addressed merge jobs on a bounded process pool; usable without HTTP."""
+
+    def __init__(self, workers=None, max_pending=None, cache_entries=DEFAULT_CACHE_ENTRIES,
+                 work_dir=None, data_root=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.data_root = os.path.realpath(data_root) if data_root else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._owns_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix='socmerge-serve-')
+        self.upload_dir = os.path.join(self.work_dir, 'uploads')
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.cache = ResultCache(os.path.join(self.work_dir, 'results'), cache_entries)
+
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # path -> (size, mtime_ns, digest), so unchanged files are hashed once
+        self._digests = {}
+        self._digest_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return len(self._inflight)
+
+    def try_reserve(self):
+        """Claim a queue slot without blocking; False when the queue is full."""
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def resolve_path(self, path):
+        """Absolute path of a requested dataset, confined to ``data_root`` when one is set."""
+        real = os.path.realpath(path)
+        if self.data_root and os.path.commonpath([real, self.data_root]) != self.data_root:
+            raise RequestError(f"Path is outside the served data root: {path}")
+        if not os.path.isfile(real):
+            raise RequestError(f"No such dataset: {path}")
+        return real
+
+    def file_digest(self, path):
+        """SHA-256 of a dataset file, memoized by size and modification time."""
+        stat = os.stat(path)
+        with self._digest_lock:
+            memo = self._digests.get(path)
+        if memo is not None and memo[:2] == (stat.st_size, stat.st_mtime_ns):
+            return memo[2]
+        # Hashed outside the lock, so one large file does not hold up other requests
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(_HASH_BLOCK), b''):
+                digest.update(block)
+        with self._digest_lock:
+            self._digests[path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        return digest.hexdigest()
+
+    @staticmethod
+    def request_key(digests, mode, degree, precedence, fit='poly'):
+        key = hashlib.sha256()
+        for digest in digests:
+            key.update(digest.encode('ascii'))
+        key.update(f"|{mode}|{degree}|{precedence}|{fit}".encode('ascii'))
+        return key.hexdigest()[:32]
+
+    def merge(self, paths, digests, mode='charging', degree=2, precedence='first', fit='poly',
+              reserved=False, timeout=None, uploaded=False):
+        """
+        Merge ``paths`` (or reuse a cached result) and return ``(key, details, cached)``.
+
+        Raises ServiceBusy when the queue is full. With ``reserved`` the caller
+        already holds a slot from try_reserve(); it is used for the new job or
+        given back when none is needed. Unless the files are the service's own
+        ``uploaded`` copies, the worker merges snapshots checked against
+        ``digests`` (see merge_job()).
+        """
+        submitted = False
+        try:
+            if mode not in ANALYSIS_MODES:
+                raise RequestError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+            if precedence not in PRECEDENCE_RULES:
+                raise RequestError(f"Unknown precedence '{precedence}', expected one of {list(PRECEDENCE_RULES)}")
+            if fit not in FIT_MODELS:
+                raise RequestError(f"Unknown fit model '{fit}', expected one of {list(FIT_MODELS)}")
+            if len(paths) < 2:
+                raise RequestError("At least two datasets are required")
+
+            key = self.request_key(digests, mode, degree, precedence, fit)
+            with self._lock:
+                details = self.cache.get(key)
+                future = None if details is not None else self._inflight.get(key)
+                if details is None and future is None:
+                    if not reserved and not self.try_reserve():
+                        raise ServiceBusy(f"{self.max_pending} merges already queued or running")
+                    reserved = False
+                    job = (merge_job, list(paths), mode, degree, precedence, fit, self.cache.csv_path(key),
+                           None if uploaded else list(digests), self.upload_dir)
+                    executor = self.executor
+                    try:
+                        future = executor.submit(*job)
+                    except BrokenProcessPool:
+                        # A worker died since the last merge and its callbacks have not run yet
+                        executor = self._replace_pool(executor)
+                        future = executor.submit(*job)
+                    self._inflight[key] = future
+                    submitted = True
+        finally:
+            if reserved:
+                self.release()
+        if submitted:
+            # Outside the lock: the callback runs at once if the job already finished
+            future.add_done_callback(lambda done: self._finished(key, done, executor))
+
+        if details is not None:
+            return key, details, True
+        try:
+            return key, future.result(timeout), False
+        except BrokenProcessPool:
+            raise WorkerLost("The worker process died during the merge; retry later") from None
+
+    def _replace_pool(self, broken):
+        """Start a fresh pool in place of a broken one; call with the lock held."""
+        if self.executor is broken:
+            logger.warning("A worker process died; starting a new process pool")
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            broken.shutdown(wait=False)
+        return self.executor
+
+    def _finished(self, key, future, executor):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if not future.cancelled():
+                error = future.exception()
+                if error is None:
+                    self.cache.put(key, future.result())
+                elif isinstance(error, BrokenProcessPool):
+                    self._replace_pool(executor)
+        self.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self._owns_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'socmerge'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send_json(status, {'error': message}, headers)
+
+    def _send_file(self, path, content_type='text/csv'):
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            self._send_error(HTTPStatus.NOT_FOUND, "Result is no longer cached; repeat the merge")
+            return
+        with handle:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(os.fstat(handle.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(handle, self.wfile)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(HTTPStatus.OK, {
+                'status': 'ok',
+                'workers': self.service.workers,
+                'pending': self.service.pending,
+                'max_pending': self.service.max_pending,
+                'cached': len(self.service.cache),
+            })
+        elif path.startswith('/results/') and path.endswith('.csv'):
+            key = path[len('/results/'):-len('.csv')]
+            if not key.isalnum() or self.service.cache.get(key) is None:
+                self._send_error(HTTPStatus.NOT_FOUND, f"Unknown result {key}")
+                return
+            self._send_file(self.service.cache.csv_path(key))
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, f"Unknown endpoint {path}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/merge':
+            self._send_error(HTTPStatus.NOT_FOUND, f"Unknown endpoint {url.path}")
+            return
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._send_error(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_error(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer")
+            return
+        if length > self.server.max_upload_bytes:
+            self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                             f"Request body exceeds {self.server.max_upload_bytes} bytes")
+            return
+
+        # Hold a queue slot before reading the body, so a full queue also caps upload memory
+        if not self.service.try_reserve():
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Merge queue is full, retry later",
+                             {'Retry-After': '1'})
+            return
+
+        uploads = []
+        handed_over = False
+        try:
+            body = self.rfile.read(length)
+            options, paths, digests, uploads = self._parse_request(body)
+            # From here on merge() owns the reserved slot
+            handed_over = True
+            key, details, cached = self.service.merge(paths, digests, reserved=True,
+                                                      uploaded=bool(uploads), **options)
+        except ServiceBusy as e:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e), {'Retry-After': '1'})
+            return
+        except WorkerLost as e:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, str(e), {'Retry-After': '1'})
+            return
+        except DatasetChanged as e:
+            self._send_error(HTTPStatus.CONFLICT, str(e))
+            return
+        except (RequestError, ColumnError, ValueError) as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, f"{type(e).__name__}: {e}")
+            return
+        except Exception as e:
+            logger.exception("Merge failed")
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+            return
+        finally:
+            if not handed_over:
+                self.service.release()
+            for upload in uploads:
+                try:
+                    os.remove(upload)
+                except FileNotFoundError:
+                    pass
+
+        if parse_qs(url.query).get('format') == ['csv']:
+            self._send_file(self.service.cache.csv_path(key))
+            return
+        self._send_json(HTTPStatus.OK, dict(details, key=key, cached=cached,
+                                            csv=f"/results/{key}.csv"))
+
+    def _parse_request(self, body):
+        """Return (options, paths, digests, uploaded temp files) of a JSON or multipart request."""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            return self._parse_multipart(content_type, body)
+        if not content_type.startswith('application/json'):
+            raise RequestError("Send application/json with dataset paths or multipart/form-data uploads")
+
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError as e:
+            raise RequestError(f"Invalid JSON: {e}") from None
+        datasets = request.get('datasets')
+        if not isinstance(datasets, list) or not all(isinstance(p, str) for p in datasets):
+            raise RequestError("'datasets' must be a list of file paths")
+        paths = [self.service.resolve_path(path) for path in datasets]
+        digests = [self.service.file_digest(path) for path in paths]
+        return self._options(request), paths, digests, []
+
+    def _parse_multipart(self, content_type, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        if not message.is_multipart():
+            raise RequestError("Malformed multipart body")
+
+        fields, paths, digests = {}, [], []
+        try:
+            for part in message.iter_parts():
+                payload = part.get_payload(decode=True) or b''
+                filename = part.get_filename()
+                if filename is None:
+                    name = part.get_param('name', header='content-disposition')
+                    fields[name] = payload.decode('utf-8').strip()
+                    continue
+                suffix = os.path.splitext(filename)[1].lower()
+                suffix = suffix if suffix in PARQUET_EXTENSIONS else '.csv'
+                fd, path = tempfile.mkstemp(dir=self.service.upload_dir, suffix=suffix)
+                with os.fdopen(fd, 'wb') as handle:
+                    handle.write(payload)
+                paths.append(path)
+                digests.append(hashlib.sha256(payload).hexdigest())
+        except Exception:
+            for path in paths:
+                os.remove(path)
+            raise
+        return self._options(fields), paths, digests, paths
+
+    @staticmethod
+    def _options(values):
+        try:
+            degree = int(values.get('degree', 2))
+        except (TypeError, ValueError):
+            raise RequestError(f"Invalid degree: {values.get('degree')!r}") from None
+        return {
+            'mode': str(values.get('mode', 'charging')).lower(),
+            'degree': degree,
+            'precedence': str(values.get('precedence', 'first')).lower(),
+            'fit': str(values.get('fit', 'poly')).lower(),
+        }
+
+
+class MergeServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer bound to a MergeService."""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, max_upload_bytes=DEFAULT_MAX_UPLOAD_BYTES):
+        super().__init__(address, MergeRequestHandler)
+        self.service = service
+        self.max_upload_bytes = max_upload_bytes
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
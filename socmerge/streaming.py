@@ -0,0 +1,235 @@
+"""
+Streaming overlap-removal merge for datasets larger than memory.
+
+Dataset A is read in chunks to find its first/last SOC window, and Dataset
+B is then read in chunks with in-window rows dropped on the fly. Every
+surviving chunk is sorted and spilled to a temporary run file. The runs are
+combined with a blockwise k-way merge (an external merge sort) that writes
+the final charging or discharging order straight to the output CSV.
+
+Peak memory is bounded by ``chunk_rows`` however large the inputs are. Only
+the SOC and Voltage columns are carried through. Cells that do not parse as
+numbers become NaN, and rows with a NaN SOC or Voltage are skipped (and
+counted) instead of aborting the stream.
+
+Rows with equal SOC come out in the same order as from the in-memory merge:
+ascending order lists them in concatenation order (Dataset B's survivors,
+then Dataset A, each in file order), and descending order is exactly the
+reverse. The run files are kept in that order and the k-way merge breaks
+ties by run, so no row ever overtakes an equal one.
+"""
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .engine import ANALYSIS_MODES, ColumnError, is_parquet, sniff_columns
+from .fitting import DEFAULT_BIN_WIDTH, DEFAULT_SMOOTHING, BinAccumulator, fit_bins
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+
+class StreamMergeResult:
+    """Row counts, SOC window and trend of a streamed merge."""
+
+    def __init__(self, output_path, mode, window, rows_a, rows_b, removed_rows, trend,
+                 skipped_rows=0):
+        self.output_path = output_path
+        self.mode = mode
+        self.window = window
+        self.rows_a = rows_a
+        self.rows_b = rows_b
+        self.removed_rows = removed_rows
+        self.trend = trend
+        self.skipped_rows = skipped_rows
+
+    @property
+    def rows(self):
+        return self.rows_a + self.rows_b - self.removed_rows - self.skipped_rows
+
+
+def _numeric(values):
+    """float64 array of ``values``; cells that are not numbers become NaN."""
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        values = pd.to_numeric(values, errors='coerce')
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _iter_chunks(file_path, chunk_rows):
+    """
+    Yield (soc, voltage, skipped) for each chunk of a CSV (or Parquet) file.
+
+    ``soc`` and ``voltage`` are float64 arrays without the ``skipped`` rows
+    whose SOC or Voltage is missing or not a number.
+    """
+    soc_col, voltage_col = sniff_columns(file_path)
+
+    if is_parquet(file_path):
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows,
+                                                         columns=[soc_col, voltage_col])
+        chunks = ((batch.column(soc_col).to_pandas(), batch.column(voltage_col).to_pandas())
+                  for batch in batches)
+    else:
+        reader = pd.read_csv(file_path, usecols=[soc_col, voltage_col], chunksize=chunk_rows)
+        chunks = ((chunk[soc_col], chunk[voltage_col]) for chunk in reader)
+
+    for soc, voltage in chunks:
+        soc, voltage = _numeric(soc), _numeric(voltage)
+        valid = ~(np.isnan(soc) | np.isnan(voltage))
+        skipped = len(soc) - int(np.count_nonzero(valid))
+        if skipped:
+            soc, voltage = soc[valid], voltage[valid]
+        yield soc, voltage, skipped
+
+
+class _RunWriter:
+    """Sort chunks by SOC key and spill them to .npy run files."""
+
+    def __init__(self, tmp_dir, sign):
+        self.tmp_dir = tmp_dir
+        self.sign = sign
+        self.runs = []
+
+    def add(self, soc, voltage):
+        if not len(soc):
+            return
+        order = np.argsort(soc, kind='stable')
+        if self.sign < 0:
+            # Descending is the reverse of ascending, ties included
+            order = order[::-1]
+        path = os.path.join(self.tmp_dir, f"run_{len(self.runs):06d}.npy")
+        np.save(path, np.column_stack((soc[order], voltage[order])))
+        self.runs.append(path)
+
+
+def _merge_runs(run_paths, sign, block_rows):
+    """
+    Yield sorted (n, 2) blocks from pre-sorted run files, breaking ties by run order.
+
+    Each step loads the next block of every run and emits every row that
+    sorts strictly before the smallest unfinished block tail: no unread row
+    can sort before or alongside it. When no row does, the rows equal to
+    that tail are drained run by run.
+    """
+    runs = [np.load(path, mmap_mode='r') for path in run_paths]
+    positions = [0] * len(runs)
+
+    while True:
+        active = [i for i, run in enumerate(runs) if positions[i] < len(run)]
+        if not active:
+            return
+
+        blocks = {i: runs[i][positions[i]:positions[i] + block_rows] for i in active}
+        limit = np.inf
+        for i, block in blocks.items():
+            if positions[i] + len(block) < len(runs[i]):
+                limit = min(limit, block[-1, 0] * sign)
+
+        parts = []
+        for i, block in blocks.items():
+            take = np.searchsorted(block[:, 0] * sign, limit, side='left')
+            if take:
+                parts.append(np.asarray(block[:take]))
+                positions[i] += take
+
+        if parts:
+            merged = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            yield merged[np.argsort(merged[:, 0] * sign, kind='stable')]
+            continue
+
+        # Every pending row is at the limit or beyond; the ones at it go out in run order
+        for i in active:
+            while positions[i] < len(runs[i]):
+                block = runs[i][positions[i]:positions[i] + block_rows]
+                take = np.searchsorted(block[:, 0] * sign, limit, side='right')
+                if take:
+                    yield np.asarray(block[:take])
+                    positions[i] += take
+                if take < len(block):
+                    break
+
+
+def stream_merge(path_a, path_b, output_path, mode='charging', degree=2,
+                 chunk_rows=DEFAULT_CHUNK_ROWS, tmp_dir=None, model='poly',
+                 bin_width=DEFAULT_BIN_WIDTH, smoothing=DEFAULT_SMOOTHING):
+    """
+    Merge two CSV files with overlap removal without loading either into memory.
+
+    Same rule as merge_datasets_with_overlap_removal(): Dataset B rows whose
+    SOC lies inside Dataset A's first/last window are dropped, the rest are
+    combined with all of Dataset A and written to ``output_path`` in
+    ascending (charging) or descending (discharging) SOC order. The trend
+    is fitted on SOC bins accumulated along the way (see socmerge.fitting).
+    Rows without a numeric SOC and Voltage are skipped, so Dataset A's
+    window runs between its first and last valid rows.
+    """
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+    sign = 1.0 if ANALYSIS_MODES[mode] else -1.0
+    bins = BinAccumulator(bin_width)
+
+    with tempfile.TemporaryDirectory(prefix='socmerge-', dir=tmp_dir) as work_dir:
+        run_writer = _RunWriter(work_dir, sign)
+
+        # Dataset A is kept whole; only its first and last SOC matter for the window
+        first_value_a = last_value_a = None
+        rows_a = skipped = 0
+        with trace.span('stream.spill', file=os.path.basename(path_a)) as stage:
+            for soc, voltage, chunk_skipped in _iter_chunks(path_a, chunk_rows):
+                rows_a += len(soc) + chunk_skipped
+                skipped += chunk_skipped
+                if not len(soc):
+                    continue
+                if first_value_a is None:
+                    first_value_a = soc[0]
+                last_value_a = soc[-1]
+                run_writer.add(soc, voltage)
+                bins.add(soc, voltage)
+            stage.set(rows=rows_a)
+        runs_a = len(run_writer.runs)
+
+        if first_value_a is None:
+            raise ColumnError(f"Dataset A has no rows: {path_a}")
+        min_val, max_val = min(first_value_a, last_value_a), max(first_value_a, last_value_a)
+
+        # Dataset B loses every row inside Dataset A's window
+        rows_b = removed = 0
+        with trace.span('stream.filter', file=os.path.basename(path_b)) as stage:
+            for soc, voltage, chunk_skipped in _iter_chunks(path_b, chunk_rows):
+                rows_b += len(soc) + chunk_skipped
+                skipped += chunk_skipped
+                keep = ~((soc >= min_val) & (soc <= max_val))
+                removed += len(soc) - int(np.count_nonzero(keep))
+                run_writer.add(soc[keep], voltage[keep])
+                bins.add(soc[keep], voltage[keep])
+            stage.set(rows=rows_b, removed=removed)
+
+        logger.info("Dataset A range: %.3f to %.3f", min_val, max_val)
+        logger.info("Filtered out %d rows from Dataset B", removed)
+        if skipped:
+            logger.warning("Skipped %d row(s) without a numeric SOC and Voltage", skipped)
+        logger.info("Spilled %d sorted run(s) to %s", len(run_writer.runs), work_dir)
+
+        # Concatenation order of the in-memory merge: Dataset B, then Dataset A
+        runs = run_writer.runs[runs_a:] + run_writer.runs[:runs_a]
+        if sign < 0:
+            runs = runs[::-1]
+        block_rows = max(chunk_rows // max(len(runs), 1), 4096)
+        with trace.span('stream.kway', runs=len(runs)), \
+                open(output_path, 'w', newline='') as handle:
+            handle.write('SOC,Voltage\n')
+            for block in _merge_runs(runs, sign, block_rows):
+                pd.DataFrame(block, columns=['SOC', 'Voltage']).to_csv(
+                    handle, header=False, index=False)
+
+    result = StreamMergeResult(output_path, mode, (min_val, max_val), rows_a, rows_b,
+                               removed, fit_bins(bins, model, degree, smoothing), skipped)
+    logger.info("Final merged dataset: %d rows", result.rows)
+    return result
@@ -0,0 +1,220 @@
+"""
+Stage timing and memory instrumentation.
+
+Pipeline stages are wrapped in ``span()``:
+
+    with trace.span('merge.mask', rows=len(df)) as stage:
+        ...
+        stage.set(kept=kept)
+
+Tracing is off by default, and then a span costs one attribute check.
+When it is on, every finished span records its wall time, the process RSS
+before and after, and its arguments. Each span is
+
+- logged on the ``socmerge.trace`` logger,
+- passed to registered listeners (the GUI Performance pane is one),
+- kept in memory for export as a Chrome trace (``chrome://tracing`` or
+  https://ui.perfetto.dev).
+
+Set ``SOCMERGE_TRACE=/path/trace.json`` to turn tracing on at import and
+write the trace when the process exits.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Events kept in memory; the oldest are dropped beyond this
+DEFAULT_MAX_EVENTS = 100_000
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    """Current resident set size of this process, or the peak where that is all the OS reports."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    return 0
+
+
+class _NullSpan:
+    """Stand-in returned while tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed stage; use as a context manager."""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start_ns', 'rss_start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.rss_start = rss_bytes()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.category, self.start_ns, end_ns,
+                           self.rss_start, rss_bytes(), self.args)
+        return False
+
+    def set(self, **args):
+        """Attach more arguments (row counts, file names, ...) to the span."""
+        self.args.update(args)
+
+
+class Tracer:
+    """Collects finished spans and fans them out to the log and listeners."""
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def span(self, name, category=None, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, category or name.split('.', 1)[0], args)
+
+    def record(self, name, category, start_ns, end_ns, rss_start, rss_end, args):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start_ns / 1000.0,
+            'dur': (end_ns - start_ns) / 1000.0,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': dict(args, rss_mb=round(rss_end / 1024 ** 2, 1),
+                         rss_delta_mb=round((rss_end - rss_start) / 1024 ** 2, 1)),
+        }
+        with self._lock:
+            self.events.append(event)
+            listeners = list(self._listeners)
+
+        logger.info("%s %.1f ms rss %+.1f MB %s", name, event['dur'] / 1000.0,
+                    event['args']['rss_delta_mb'],
+                    ' '.join(f"{k}={v}" for k, v in args.items()))
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Trace listener failed")
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def extend(self, events):
+        """Add events recorded in another process (e.g. a render worker) and notify listeners."""
+        with self._lock:
+            self.events.extend(events)
+            listeners = list(self._listeners)
+        for event in events:
+            for listener in listeners:
+                try:
+                    listener(event)
+                except Exception:
+                    logger.exception("Trace listener failed")
+
+    def drain(self):
+        """Return and forget the recorded events."""
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.events)
+
+
+TRACER = Tracer()
+
+
+def span(name, category=None, **args):
+    """Time a stage on the global tracer (a no-op while tracing is off)."""
+    return TRACER.span(name, category, **args)
+
+
+def enable():
+    TRACER.enabled = True
+    return TRACER
+
+
+def disable():
+    TRACER.enabled = False
+
+
+def is_enabled():
+    return TRACER.enabled
+
+
+def write_chrome_trace(path, events=None):
+    """Write events (default: everything recorded so far) as a Chrome trace JSON file."""
+    events = TRACER.snapshot() if events is None else events
+    with open(path, 'w') as handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+    return path
+
+
+def summarize(events):
+    """Per-stage count, total, mean and max duration in milliseconds, slowest total first."""
+    stages = {}
+    for event in events:
+        stats = stages.setdefault(event['name'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        duration = event['dur'] / 1000.0
+        stats['count'] += 1
+        stats['total_ms'] += duration
+        stats['max_ms'] = max(stats['max_ms'], duration)
+    for stats in stages.values():
+        stats['mean_ms'] = stats['total_ms'] / stats['count']
+    return dict(sorted(stages.items(), key=lambda item: -item[1]['total_ms']))
+
+
+_TRACE_PATH = os.environ.get('SOCMERGE_TRACE')
+if _TRACE_PATH:
+    enable()
+    atexit.register(write_chrome_trace, _TRACE_PATH)
@@ -0,0 +1,357 @@
+"""
+Watch a directory and merge cycler files into per-cell curves as they arrive.
+
+    python -m socmerge watch incoming/ --output-dir merged/
+
+The directory is polled every ``interval`` seconds. A file is picked up once
+its size and modification time have not changed for ``settle`` seconds, so
+files still being written are left alone. Each file name (without its
+extension) is matched against a regular expression whose ``cell`` group
+names the cell it belongs to, e.g. ``cell042_0007.csv`` -> ``cell042`` with
+the default pattern. Files that do not match are ignored.
+
+Every cell keeps its merged SOC/Voltage arrays in memory. A new segment is
+merged into them with the usual overlap-removal rule, ranked by arrival
+order (``precedence='first'``: earlier files win, ``'last'``: the newest
+file wins). Only the new segment is masked and sorted; its survivors are
+then spliced into the sorted arrays with one searchsorted/insert pass
+instead of re-merging every earlier file. The result is identical to a
+batch merge of the cell's files in arrival order. The trend is refitted from
+SOC bins that are updated with the survivors only (see socmerge.fitting).
+
+Files that settle during the same poll are parsed in parallel. A changed
+cell's outputs are ``<cell>_<mode>.csv``, optionally ``<cell>_<mode>.soclut``,
+and its row in ``cells.csv``. They are rewritten when the directory goes
+quiet, and otherwise at most every ``write_interval`` seconds. Rewriting a
+large merged CSV costs far more than merging a new file into it, so under a
+steady stream of arrivals many segments share one rewrite. Outputs are
+replaced atomically, so readers never see a partial file.
+"""
+import csv
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import trace
+from .arrays import ArrayCurve
+from .engine import (ANALYSIS_MODES, PARQUET_EXTENSIONS, PRECEDENCE_RULES, in_windows, load_dataset,
+                     overlap_window)
+from .fitting import DEFAULT_BIN_WIDTH, DEFAULT_SMOOTHING, BinAccumulator, fit_bins
+from .lookup import CurveTable
+
+logger = logging.getLogger(__name__)
+
+# Matched against the file name without its extension; 'cell' names the group
+DEFAULT_PATTERN = r'(?P<cell>.+?)(?:[_-]\d+)?'
+
+WATCH_EXTENSIONS = ('.csv',) + PARQUET_EXTENSIONS
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_SETTLE = 2.0
+DEFAULT_WORKERS = 4
+
+# Longest time a changed cell waits for its outputs while files keep arriving
+DEFAULT_WRITE_INTERVAL = 10.0
+
+CELL_FIELDS = ['cell', 'files', 'rows', 'removed_rows', 'output', 'trend', 'updated']
+
+
+def _atomic_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.tmp")
+
+
+class CellMerge:
+    """Merged curve of one cell, extended one segment at a time."""
+
+    def __init__(self, name, precedence='first', bin_width=DEFAULT_BIN_WIDTH):
+        if precedence not in PRECEDENCE_RULES:
+            raise ValueError(f"Unknown precedence '{precedence}', expected one of {list(PRECEDENCE_RULES)}")
+        self.name = name
+        self.precedence = precedence
+        self.bin_width = bin_width
+        self.files = []
+        self.windows = []
+        self.input_rows = 0
+        self.soc = np.empty(0)
+        self.voltage = np.empty(0)
+        self.bins = BinAccumulator(bin_width)
+
+    def __len__(self):
+        return len(self.soc)
+
+    @property
+    def removed_rows(self):
+        return self.input_rows - len(self.soc)
+
+    @property
+    def window(self):
+        """SOC window of the winning segment, as merge_arrays() reports it."""
+        return self.windows[0] if self.precedence == 'first' else self.windows[-1]
+
+    def add_segment(self, df, path=None):
+        """Merge one more segment (the latest arrival) into the cell's curve."""
+        soc = np.asarray(df['SOC'].to_numpy(), dtype=np.float64)
+        voltage = np.asarray(df['Voltage'].to_numpy(), dtype=np.float64)
+        window = overlap_window(df, 'SOC')
+
+        if self.precedence == 'first':
+            # The newcomer ranks last: it loses its rows inside every earlier window.
+            # Ties go before the existing rows, as the lowest rank does in merge_arrays()
+            keep = ~in_windows(soc, self.windows)
+            soc, voltage = soc[keep], voltage[keep]
+            side = 'left'
+        else:
+            # The newcomer wins: earlier rows inside its window drop out
+            stale = in_windows(self.soc, [window])
+            if stale.any():
+                self.soc, self.voltage = self.soc[~stale], self.voltage[~stale]
+                self.bins = None
+            side = 'right'
+
+        order = np.argsort(soc, kind='stable')
+        soc, voltage = soc[order], voltage[order]
+        positions = np.searchsorted(self.soc, soc, side=side)
+        self.soc = np.insert(self.soc, positions, soc)
+        self.voltage = np.insert(self.voltage, positions, voltage)
+
+        if self.bins is None:
+            # Rows left the curve; bin it again from scratch
+            self.bins = BinAccumulator(self.bin_width)
+            self.bins.add(self.soc, self.voltage)
+        else:
+            self.bins.add(soc, voltage)
+
+        self.files.append(path)
+        self.windows.append(window)
+        self.input_rows += len(df)
+        return len(soc)
+
+    def curve(self, model='poly', degree=2, smoothing=DEFAULT_SMOOTHING):
+        """The merged rows as an ArrayCurve, with the trend refitted from the bins."""
+        trend = fit_bins(self.bins, model, degree, smoothing)
+        return ArrayCurve(self.soc, self.voltage, self.window, self.removed_rows, trend)
+
+
+class DirectoryPoller:
+    """Reports files in a directory once their size and mtime have settled."""
+
+    def __init__(self, directory, extensions=WATCH_EXTENSIONS, settle=DEFAULT_SETTLE,
+                 recursive=False, exclude=()):
+        self.directory = directory
+        self.exclude = {os.path.abspath(path) for path in exclude}
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.settle = settle
+        self.recursive = recursive
+        self._pending = {}  # path -> (size, mtime_ns, first seen unchanged)
+        self._done = {}     # path -> (size, mtime_ns) when it was handed out
+
+    def _scan(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive and os.path.abspath(entry.path) not in self.exclude:
+                            yield from self._scan(entry.path)
+                    elif entry.name.lower().endswith(self.extensions):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        yield entry.path, (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            logger.warning("Watched directory %s does not exist", directory)
+
+    def poll(self, now=None):
+        """Paths that have not changed for ``settle`` seconds, oldest modification first."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, identity in self._scan(self.directory):
+            done = self._done.get(path)
+            if done is not None:
+                if done != identity:
+                    logger.warning("%s changed after it was merged; the change is ignored", path)
+                    self._done[path] = identity
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[:2] != identity:
+                self._pending[path] = identity + (now,)
+            elif now - pending[2] >= self.settle:
+                ready.append((identity[1], path))
+                self._done[path] = identity
+                del self._pending[path]
+        return [path for _, path in sorted(ready)]
+
+
+class WatchMerger:
+    """Routes settled files to their cells and rewrites the outputs of the cells they touch."""
+
+    def __init__(self, output_dir, pattern=DEFAULT_PATTERN, mode='charging', precedence='first',
+                 degree=2, model='poly', bin_width=DEFAULT_BIN_WIDTH, smoothing=DEFAULT_SMOOTHING,
+                 lookup_table=False, workers=DEFAULT_WORKERS, write_interval=DEFAULT_WRITE_INTERVAL):
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Unknown analysis mode '{mode}', expected one of {list(ANALYSIS_MODES)}")
+        if precedence not in PRECEDENCE_RULES:
+            raise ValueError(f"Unknown precedence '{precedence}', expected one of {list(PRECEDENCE_RULES)}")
+        self.pattern = re.compile(pattern)
+        if 'cell' not in self.pattern.groupindex:
+            raise ValueError(f"File pattern {pattern!r} has no (?P<cell>...) group")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.precedence = precedence
+        self.fit_options = {'model': model, 'degree': degree, 'smoothing': smoothing}
+        self.bin_width = bin_width
+        self.lookup_table = lookup_table
+        self.workers = workers
+        self.write_interval = write_interval
+        self.cells = {}
+        self.status = {}
+        self.dirty = set()
+        self._written = {}  # cell -> time.monotonic() of its last output rewrite
+        os.makedirs(output_dir, exist_ok=True)
+
+    def cell_of(self, path):
+        """Cell name for ``path``, or None when the file name does not match the pattern."""
+        stem = os.path.splitext(os.path.basename(path))[0]
+        match = self.pattern.fullmatch(stem)
+        return match.group('cell') if match else None
+
+    def _load(self, path):
+        try:
+            return load_dataset(path), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def ingest(self, paths):
+        """
+        Merge ``paths`` (in arrival order) into their cells and return the names of the updated cells.
+
+        Outputs of cells that have waited ``write_interval`` are rewritten;
+        call flush() to write the rest.
+        """
+        routed = [(path, self.cell_of(path)) for path in paths]
+        for path, cell in routed:
+            if cell is None:
+                logger.debug("%s does not match the file pattern; ignored", path)
+        routed = [(path, cell) for path, cell in routed if cell is not None]
+        if not routed:
+            return []
+
+        with trace.span('watch.load', files=len(routed)):
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                loaded = list(executor.map(self._load, [path for path, _ in routed]))
+
+        touched = []
+        with trace.span('watch.merge', files=len(routed)):
+            for (path, cell), (df, error) in zip(routed, loaded):
+                if df is None or not len(df):
+                    logger.error("%s: %s", path, error or "no rows")
+                    continue
+                merge = self.cells.get(cell)
+                if merge is None:
+                    merge = self.cells[cell] = CellMerge(cell, self.precedence, self.bin_width)
+                kept = merge.add_segment(df, path)
+                logger.info("%s: %s +%d of %d rows, %d total", cell, os.path.basename(path),
+                            kept, len(df), len(merge))
+                if cell not in touched:
+                    touched.append(cell)
+
+        now = time.monotonic()
+        for cell in touched:
+            self.dirty.add(cell)
+            self._written.setdefault(cell, now)
+        self.flush(force=False)
+        return touched
+
+    def flush(self, force=True):
+        """Rewrite the outputs of changed cells (with ``force=False``, only those overdue)."""
+        now = time.monotonic()
+        due = [cell for cell in sorted(self.dirty)
+               if force or now - self._written[cell] >= self.write_interval]
+        for cell in due:
+            self.write_cell(cell)
+            self.dirty.discard(cell)
+            self._written[cell] = time.monotonic()
+        if due:
+            self.write_status()
+        return due
+
+    def write_cell(self, cell):
+        """Rewrite one cell's merged CSV (and lookup table) atomically."""
+        merge = self.cells[cell]
+        output_path = os.path.join(self.output_dir, f"{cell}_{self.mode}.csv")
+        with trace.span('watch.write', cell=cell, rows=len(merge)):
+            try:
+                curve = merge.curve(**self.fit_options)
+                curve.write_csv(_atomic_path(output_path), ascending=ANALYSIS_MODES[self.mode])
+                os.replace(_atomic_path(output_path), output_path)
+                if self.lookup_table:
+                    table_path = os.path.splitext(output_path)[0] + '.soclut'
+                    CurveTable.from_curve(curve).save(_atomic_path(table_path))
+                    os.replace(_atomic_path(table_path), table_path)
+                trend = curve.trend.describe()
+            except Exception as e:
+                logger.error("%s: writing outputs failed: %s", cell, e)
+                output_path, trend = '', f"{type(e).__name__}: {e}"
+        self.status[cell] = {
+            'cell': cell,
+            'files': len(merge.files),
+            'rows': len(merge),
+            'removed_rows': merge.removed_rows,
+            'output': output_path,
+            'trend': trend,
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    def write_status(self):
+        """Rewrite cells.csv with one row per cell."""
+        path = os.path.join(self.output_dir, 'cells.csv')
+        with open(_atomic_path(path), 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=CELL_FIELDS)
+            writer.writeheader()
+            for cell in sorted(self.status):
+                writer.writerow(self.status[cell])
+        os.replace(_atomic_path(path), path)
+
+
+def watch(directory, merger, interval=DEFAULT_INTERVAL, settle=DEFAULT_SETTLE, recursive=False,
+          once=False, stop=None):
+    """
+    Poll ``directory`` and feed settled files to ``merger`` until ``stop()`` is true.
+
+    With ``once`` every file already present is merged and the function
+    returns without waiting for more.
+    """
+    if os.path.abspath(directory) == os.path.abspath(merger.output_dir):
+        raise ValueError("The output directory must not be the watched directory")
+    poller = DirectoryPoller(directory, settle=0.0 if once else settle, recursive=recursive,
+                             exclude=[merger.output_dir])
+    if once:
+        # A zero settle time still needs two looks at each file
+        poller.poll()
+        merger.ingest(poller.poll())
+        merger.flush()
+        return merger
+
+    logger.info("Watching %s (every %.1fs, settle %.1fs)", directory, interval, settle)
+    try:
+        while stop is None or not stop():
+            start = time.monotonic()
+            paths = poller.poll(start)
+            if paths:
+                cells = merger.ingest(paths)
+                logger.info("Merged %d file(s) into %d cell(s) in %.2fs", len(paths), len(cells),
+                            time.monotonic() - start)
+            elif merger.dirty:
+                # Nothing new arrived: bring every output up to date
+                merger.flush()
+            time.sleep(max(interval - (time.monotonic() - start), 0.0))
+    finally:
+        merger.flush()
+    return merger
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge.cache import DatasetCache, load_cached
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / 'cell.csv'
+    pd.DataFrame({'SOC': [10.0, 20.0, np.nan, 40.0], 'Voltage': [3.5, 3.6, 3.7, 3.8]}).to_csv(
+        path, index=False)
+    return str(path)
+
+
+def _cache(tmp_path):
+    return DatasetCache(str(tmp_path / 'cache'))
+
+
+def test_hit_returns_the_stored_frame(tmp_path, dataset):
+    cache = _cache(tmp_path)
+    first = cache.load(dataset)
+    second = cache.get(dataset)
+    assert second is not None
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_mtime_change_invalidates_entry(tmp_path, dataset):
+    cache = _cache(tmp_path)
+    cache.load(dataset)
+    stale = cache.entry_path(dataset)
+
+    stat = os.stat(dataset)
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert cache.get(dataset) is None
+    assert not os.path.exists(stale)
+
+
+def test_size_change_invalidates_entry(tmp_path, dataset):
+    cache = _cache(tmp_path)
+    cache.load(dataset)
+    stat = os.stat(dataset)
+    with open(dataset, 'a') as handle:
+        handle.write('50,3.9\n')
+    # Same mtime, so only the size tells the versions apart
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert cache.get(dataset) is None
+    reloaded = cache.load(dataset)
+    assert reloaded['SOC'].iloc[-1] == 50.0
+    assert cache.get(dataset) is not None
+
+
+def test_cleaned_variant_is_invalidated_with_the_file(tmp_path, dataset):
+    cache = _cache(tmp_path)
+    load_cached(dataset, cache, clean={})
+    stat = os.stat(dataset)
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert cache.get(dataset) is None
+    assert not os.listdir(cache.cache_dir)
+
+
+def test_cached_numeric_columns_are_not_copied(tmp_path, dataset):
+    cache = _cache(tmp_path)
+    cache.load(dataset)
+    df = cache.get(dataset)
+    soc = df['SOC'].to_numpy()
+    # Read-only views of the memory-mapped file, with NaN kept as a value
+    assert not soc.flags.writeable
+    assert np.isnan(soc[2])
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from socmerge.differential import differential_curves, savgol_coeffs, savgol_filter
+
+CUBIC = [4e-6, -6e-4, 0.035, 3.2]
+
+
+def test_first_derivative_of_a_cubic_is_exact_including_the_edges():
+    x = np.linspace(0, 100, 401)
+    delta = x[1] - x[0]
+    derivative = savgol_filter(np.polyval(CUBIC, x), 15, 3, deriv=1, delta=delta)
+    np.testing.assert_allclose(derivative, np.polyval(np.polyder(CUBIC), x), atol=1e-9)
+
+
+def test_derivative_of_a_sine_is_close_to_its_cosine():
+    x = np.linspace(0, 4 * np.pi, 2_000)
+    delta = x[1] - x[0]
+    derivative = savgol_filter(np.sin(x), 15, 3, deriv=1, delta=delta)
+    np.testing.assert_allclose(derivative, np.cos(x), atol=1e-4)
+
+
+def test_smoothing_keeps_a_polynomial_and_averages_noise_away():
+    x = np.arange(500.0)
+    line = 0.01 * x + 3.0
+    np.testing.assert_allclose(savgol_filter(line, 11, 2), line)
+    noisy = line + np.random.default_rng(2).normal(0, 0.01, len(x))
+    assert np.std(savgol_filter(noisy, 31, 2) - line) < 0.5 * np.std(noisy - line)
+
+
+def test_coefficients_reject_bad_windows():
+    with pytest.raises(ValueError, match='odd'):
+        savgol_coeffs(10, 3)
+    with pytest.raises(ValueError, match='polyorder'):
+        savgol_coeffs(5, 5)
+
+
+def test_short_series_use_the_largest_window_that_fits():
+    x = np.arange(6.0)
+    np.testing.assert_allclose(savgol_filter(2.0 * x + 1.0, 15, 3, deriv=1), np.full(6, 2.0))
+
+
+def test_differential_curves_recover_the_analytic_slopes():
+    soc = np.random.default_rng(4).uniform(0, 100, 200_000)
+    voltage = np.polyval(CUBIC, soc)
+    curves = differential_curves(soc, voltage)
+
+    # Random rows fill each bin unevenly, so its mean sits slightly off the bin centre
+    np.testing.assert_allclose(curves.dv_dsoc, np.polyval(np.polyder(CUBIC), curves.soc), rtol=0.01)
+    # dQ/dV is the reciprocal slope at the SOC where the curve reaches each voltage
+    soc_at = np.interp(curves.voltage, np.polyval(CUBIC, np.linspace(0, 100, 10_001)),
+                       np.linspace(0, 100, 10_001))
+    np.testing.assert_allclose(curves.dq_dv, 1 / np.polyval(np.polyder(CUBIC), soc_at), rtol=0.02)
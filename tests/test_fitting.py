@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge import engine
+from socmerge.fitting import BinAccumulator, _pool_sequential, fit_bins, pava_blocks
+
+COEFFS = [2e-5, -1e-3, 0.02, 3.1]
+
+
+def _curve(rows=20_000, seed=0):
+    soc = np.random.default_rng(seed).uniform(0, 100, rows)
+    return soc, np.polyval(COEFFS, soc)
+
+
+def test_bins_add_up_in_any_chunk_order():
+    soc, voltage = _curve()
+    whole = BinAccumulator(0.5)
+    whole.add(soc, voltage)
+    chunked = BinAccumulator(0.5)
+    for start in (15_000, 0, 5_000, 10_000):
+        chunked.add(soc[start:start + 5_000], voltage[start:start + 5_000])
+
+    assert chunked.rows == whole.rows == len(soc)
+    assert chunked.first_bin == whole.first_bin
+    np.testing.assert_array_equal(chunked.counts, whole.counts)
+    np.testing.assert_allclose(chunked.voltage_sums, whole.voltage_sums)
+
+
+def test_bins_skip_nan_rows():
+    bins = BinAccumulator(1.0)
+    bins.add([0.5, np.nan, 1.5, 2.5], [3.0, 3.1, np.nan, 3.3])
+    soc, voltage, counts = bins.means()
+    np.testing.assert_array_equal(soc, [0.5, 2.5])
+    np.testing.assert_array_equal(voltage, [3.0, 3.3])
+    np.testing.assert_array_equal(counts, [1, 1])
+
+
+def test_bins_reject_a_range_that_is_too_wide():
+    bins = BinAccumulator(1e-6)
+    with pytest.raises(ValueError, match='bin width'):
+        bins.add([0.0, 100.0], [3.0, 4.0])
+
+
+def test_poly_fit_recovers_a_known_polynomial():
+    soc, voltage = _curve()
+    bins = BinAccumulator()
+    bins.add(soc, voltage)
+
+    trend = fit_bins(bins, 'poly', degree=3)
+
+    # Bin means of a curved function sit slightly off it, by about f'' * width**2 / 24
+    np.testing.assert_allclose(trend.coeffs, COEFFS, rtol=1e-3)
+    np.testing.assert_allclose(trend(soc[:100]), voltage[:100], atol=1e-5)
+
+
+def test_fit_weighs_bins_not_rows():
+    # Ten times as many rows in the first half must not pull the line towards it
+    dense = np.linspace(0, 50, 50_000)
+    sparse = np.linspace(50, 100, 5_000)
+    soc = np.concatenate((dense, sparse))
+    bins = BinAccumulator(1.0)
+    bins.add(soc, 3.0 + 0.01 * soc)
+    np.testing.assert_allclose(fit_bins(bins, 'poly', degree=1).coeffs, [0.01, 3.0], atol=1e-9)
+
+
+@pytest.mark.parametrize('model', ['monotone', 'spline'])
+def test_shape_models_follow_a_monotone_curve(model):
+    soc, voltage = _curve()
+    bins = BinAccumulator()
+    bins.add(soc, voltage)
+
+    trend = fit_bins(bins, model)
+
+    grid_soc, grid_voltage = trend.grid()
+    assert np.all(np.diff(grid_voltage) >= -1e-9)
+    # The spline sits on bin centres, not on each bin's mean SOC, hence the looser match
+    np.testing.assert_allclose(grid_voltage, np.polyval(COEFFS, grid_soc), rtol=5e-3)
+
+
+def test_engine_fit_trend_uses_the_binned_fit():
+    soc, voltage = _curve()
+    bins = BinAccumulator()
+    bins.add(soc, voltage)
+    trend = engine.fit_trend(pd.DataFrame({'SOC': soc, 'Voltage': voltage}), degree=3)
+    np.testing.assert_allclose(trend.coeffs, fit_bins(bins, 'poly', 3).coeffs)
+
+
+@pytest.mark.parametrize('case', ['noisy', 'cascade', 'flat', 'sorted'])
+def test_vectorized_pava_matches_the_sequential_pooling(case):
+    rng = np.random.default_rng(5)
+    y = {
+        'noisy': np.linspace(0, 1, 20_000) + rng.normal(0, 0.05, 20_000),
+        'cascade': np.append(np.arange(5_000.0), -1.0),
+        'flat': rng.normal(0, 1, 20_000),
+        'sorted': np.arange(1_000.0),
+    }[case]
+    weights = rng.integers(1, 5, len(y)).astype(np.float64)
+
+    values, block_weights, sizes = pava_blocks(y, weights)
+    expected = _pool_sequential(y, weights, np.ones(len(y), dtype=np.int64))
+
+    np.testing.assert_allclose(values, expected[0])
+    np.testing.assert_allclose(block_weights, expected[1])
+    np.testing.assert_array_equal(sizes, expected[2])
+    assert np.all(np.diff(values) > 0)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from socmerge.lookup import CurveTable
+
+
+def _curve(rows=5000, noise=0.002, seed=3):
+    rng = np.random.default_rng(seed)
+    soc = np.sort(rng.uniform(0, 100, rows))
+    return soc, 3.2 + 0.009 * soc + rng.normal(0, noise, rows)
+
+
+def test_forward_lookup_interpolates_a_clean_line():
+    soc = np.linspace(0, 100, 101)
+    table = CurveTable.from_arrays(soc, 3.0 + 0.01 * soc)
+    np.testing.assert_allclose(table.voltage_at([12.5, 50.0, 99.9]), [3.125, 3.5, 3.999])
+    np.testing.assert_allclose(table.voltage_at([12.5, 50.0], method='pchip'), [3.125, 3.5])
+    assert table.voltage_at(50.0) == pytest.approx(3.5)
+
+
+def test_inverse_lookup_inverts_a_monotone_curve():
+    soc = np.linspace(0, 100, 101)
+    table = CurveTable.from_arrays(soc, 3.0 + 0.01 * soc)
+    np.testing.assert_allclose(table.soc_at([3.1, 3.55, 3.9]), [10.0, 55.0, 90.0])
+
+
+def test_inverse_of_a_noisy_curve_is_monotone_and_close():
+    soc, voltage = _curve()
+    table = CurveTable.from_arrays(soc, voltage)
+    assert np.all(np.diff(table.inv_voltage) > 0)
+    queries = np.linspace(3.4, 3.9, 50)
+    np.testing.assert_allclose(table.soc_at(queries), (queries - 3.2) / 0.009, atol=1.0)
+
+
+def test_falling_curves_invert_too():
+    soc = np.linspace(0, 100, 101)
+    table = CurveTable.from_arrays(soc, 4.0 - 0.01 * soc)
+    np.testing.assert_allclose(table.soc_at([3.9, 3.5]), [10.0, 50.0])
+
+
+def test_duplicate_soc_rows_are_averaged_and_nan_rows_ignored():
+    table = CurveTable.from_arrays([20.0, 10.0, 10.0, np.nan, 30.0],
+                                   [3.6, 3.4, 3.6, 3.0, np.nan])
+    np.testing.assert_array_equal(table.soc, [10.0, 20.0])
+    np.testing.assert_allclose(table.voltage, [3.5, 3.6])
+
+
+def test_clip_false_returns_nan_outside_the_table():
+    soc = np.linspace(10, 90, 81)
+    table = CurveTable.from_arrays(soc, 3.0 + 0.01 * soc)
+    assert table.voltage_at(0.0) == pytest.approx(3.1)
+    assert np.isnan(table.voltage_at(0.0, clip=False))
+    assert np.isnan(table.soc_at(5.0, clip=False))
+    assert np.isnan(table.voltage_at(np.nan))
+
+
+def test_large_unsorted_batches_match_element_wise_answers():
+    soc, voltage = _curve()
+    table = CurveTable.from_arrays(soc, voltage)
+    queries = np.random.default_rng(1).uniform(-5, 105, 70_000)
+    for method in ('linear', 'pchip'):
+        batch = table.voltage_at(queries, method=method)
+        single = np.array([table.voltage_at(q, method=method) for q in queries[:200]])
+        np.testing.assert_allclose(batch[:200], single)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_binary_round_trip(tmp_path, mmap):
+    soc, voltage = _curve()
+    table = CurveTable.from_arrays(soc, voltage)
+    path = str(tmp_path / 'cell.soclut')
+    table.save(path)
+
+    loaded = CurveTable.load(path, mmap=mmap)
+
+    for name in ('soc', 'voltage', 'soc_slopes', 'inv_voltage', 'inv_soc', 'inv_slopes'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(table, name))
+    queries = np.linspace(3.3, 4.0, 25)
+    np.testing.assert_array_equal(loaded.soc_at(queries, method='pchip'),
+                                  table.soc_at(queries, method='pchip'))
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.soclut'
+    path.write_bytes(b'not a table at all, but long enough for a header')
+    with pytest.raises(ValueError, match='not a SOC lookup table'):
+        CurveTable.load(str(path))
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge import engine
+from socmerge.arrays import merge_arrays, merge_curve_arrays
+
+
+def _segment(rng, low, high, rows, step=None):
+    soc = rng.uniform(low, high, rows)
+    if step:
+        # Repeated SOC values, so the tie order of the two merges is compared too
+        soc = np.round(soc / step) * step
+    return pd.DataFrame({'SOC': soc, 'Voltage': rng.normal(3.7, 0.2, rows)})
+
+
+@pytest.fixture
+def segments():
+    rng = np.random.default_rng(11)
+    parts = [_segment(rng, 20, 55, 400, step=0.5), _segment(rng, 0, 100, 900, step=0.5),
+             _segment(rng, 50, 90, 600, step=0.5)]
+    # A NaN SOC row must end up last in either direction
+    parts[1].loc[5, 'SOC'] = np.nan
+    return parts
+
+
+@pytest.mark.parametrize('precedence', engine.PRECEDENCE_RULES)
+@pytest.mark.parametrize('window_method', engine.WINDOW_METHODS)
+def test_merge_arrays_matches_merge_segments(segments, precedence, window_method):
+    merged = engine.merge_segments(segments, precedence, window_method=window_method)
+    soc, voltage, window, removed = merge_arrays(segments, precedence, mmap=False,
+                                                 window_method=window_method)
+
+    expected = engine.sort_merged(merged)
+    np.testing.assert_array_equal(soc, expected['SOC'].to_numpy())
+    np.testing.assert_array_equal(voltage, expected['Voltage'].to_numpy())
+    assert removed == sum(len(segment) for segment in segments) - len(merged)
+    top = segments[0] if precedence == 'first' else segments[-1]
+    assert window == engine.overlap_window(top, 'SOC', window_method)
+
+
+@pytest.mark.parametrize('mode', list(engine.ANALYSIS_MODES))
+@pytest.mark.parametrize('precedence', engine.PRECEDENCE_RULES)
+def test_curve_views_match_a_stable_sort_of_the_concatenation(segments, mode, precedence):
+    curve = merge_curve_arrays(segments, precedence=precedence, mmap=False)
+    soc, voltage = curve.columns(engine.ANALYSIS_MODES[mode])
+
+    merged = engine.merge_segments(segments, precedence)
+    valid = merged[merged['SOC'].notna()]
+    ordered = valid.iloc[np.argsort(valid['SOC'].to_numpy(), kind='stable')]
+    if mode == 'discharging':
+        # Descending is ascending read backwards, ties included
+        ordered = ordered.iloc[::-1]
+    ordered = pd.concat([ordered, merged[merged['SOC'].isna()]])
+
+    np.testing.assert_array_equal(soc, ordered['SOC'].to_numpy())
+    np.testing.assert_array_equal(voltage, ordered['Voltage'].to_numpy())
+
+    # The DataFrame path gives the same rows in the same order
+    expected = engine.sort_merged(merged, engine.ANALYSIS_MODES[mode])
+    np.testing.assert_array_equal(soc, expected['SOC'].to_numpy())
+    np.testing.assert_array_equal(voltage, expected['Voltage'].to_numpy())
+
+
+def test_memory_mapped_merge_matches_in_memory(tmp_path, segments):
+    in_memory = merge_arrays(segments, mmap=False)
+    mapped = merge_arrays(segments, mmap=True, tmp_dir=str(tmp_path))
+    assert isinstance(mapped[0], np.memmap)
+    np.testing.assert_array_equal(mapped[0], in_memory[0])
+    np.testing.assert_array_equal(mapped[1], in_memory[1])
+
+
+def test_time_order_keeps_the_overlap_rule(segments):
+    timed = [segment.assign(Time=np.arange(len(segment)) + 1000.0 * number)
+             for number, segment in enumerate(segments)]
+    merged = engine.merge_segments(timed)
+    soc, voltage, _, _ = merge_arrays(timed, mmap=False, order_column='Time')
+
+    expected = merged.sort_values('Time', kind='stable')
+    np.testing.assert_array_equal(soc, expected['SOC'].to_numpy())
+    np.testing.assert_array_equal(voltage, expected['Voltage'].to_numpy())
+
+
+def test_merge_rejects_unknown_precedence(segments):
+    with pytest.raises(ValueError, match='precedence'):
+        merge_arrays(segments, precedence='middle')
+    with pytest.raises(ValueError, match='precedence'):
+        engine.merge_segments(segments, precedence='middle')
@@ -0,0 +1,108 @@
+import http.client
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge.server import DatasetChanged, MergeServer, MergeService, WorkerLost
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    paths = []
+    for name, (low, high) in {'a.csv': (30, 60), 'b.csv': (0, 100)}.items():
+        soc = np.linspace(low, high, 200)
+        path = tmp_path / name
+        pd.DataFrame({'SOC': soc, 'Voltage': 3.0 + 0.01 * soc}).to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = MergeService(workers=1, work_dir=str(tmp_path / 'work'))
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def server(service):
+    server = MergeServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, body, headers):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+    connection.putrequest('POST', '/merge')
+    for name, value in headers.items():
+        connection.putheader(name, value)
+    connection.endheaders(body)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_json_request_merges_the_named_files(server, datasets):
+    body = json.dumps({'datasets': datasets}).encode()
+    status, reply = _post(server, body, {'Content-Type': 'application/json',
+                                         'Content-Length': str(len(body))})
+    assert status == 200
+    assert reply['rows'] == 200 + 140
+    assert reply['window'] == [30.0, 60.0]
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1e3'])
+def test_bad_content_length_is_a_bad_request(server, length):
+    status, reply = _post(server, b'{}', {'Content-Type': 'application/json',
+                                          'Content-Length': length})
+    assert status == 400
+    assert 'Content-Length' in reply['error']
+
+
+def test_worker_merges_only_the_hashed_bytes(service, datasets):
+    digests = [service.file_digest(path) for path in datasets]
+    # The file changes after the request was hashed but before the worker reads it
+    with open(datasets[1], 'a') as handle:
+        handle.write('150,9.9\n')
+
+    with pytest.raises(DatasetChanged):
+        service.merge(datasets, digests)
+    assert not service.cache.get(service.request_key(digests, 'charging', 2, 'first'))
+    assert service.pending == 0
+    assert not os.listdir(service.upload_dir)
+
+
+def test_digests_follow_file_changes(service, datasets):
+    first = service.file_digest(datasets[0])
+    assert service.file_digest(datasets[0]) == first
+    with open(datasets[0], 'a') as handle:
+        handle.write('61,3.61\n')
+    assert service.file_digest(datasets[0]) != first
+
+
+def _worker_dies(*args):
+    os._exit(1)
+
+
+def test_a_dead_worker_fails_only_its_own_merge(service, datasets, monkeypatch):
+    digests = [service.file_digest(path) for path in datasets]
+    with monkeypatch.context() as patch:
+        patch.setattr('socmerge.server.merge_job', _worker_dies)
+        with pytest.raises(WorkerLost):
+            service.merge(datasets, digests)
+
+    key, details, cached = service.merge(datasets, digests)
+    assert details['rows'] == 200 + 140
+    assert not cached
+
+
+def test_pool_broken_between_merges_is_replaced(service, datasets):
+    service.executor.submit(os._exit, 1).exception()
+    digests = [service.file_digest(path) for path in datasets]
+    assert service.merge(datasets, digests)[1]['rows'] == 200 + 140
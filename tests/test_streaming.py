@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge.arrays import merge_arrays
+from socmerge.streaming import _merge_runs, stream_merge
+
+
+def _write(path, soc, voltage):
+    pd.DataFrame({'SOC': soc, 'Voltage': voltage}).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def tied_pair(tmp_path):
+    """Two datasets with many repeated SOC values inside and across files."""
+    rng = np.random.default_rng(4)
+    soc_a = np.round(rng.uniform(30, 60, 3000), 0)
+    soc_b = np.round(rng.uniform(0, 100, 5000), 0)
+    # Voltage doubles as a row id, so any change in tie order shows up
+    path_a = _write(tmp_path / 'a.csv', soc_a, np.arange(len(soc_a)) + 0.5)
+    path_b = _write(tmp_path / 'b.csv', soc_b, -np.arange(len(soc_b)) - 0.5)
+    return path_a, path_b
+
+
+@pytest.mark.parametrize('mode', ['charging', 'discharging'])
+def test_stream_merge_matches_in_memory_order(tmp_path, tied_pair, mode):
+    path_a, path_b = tied_pair
+    output = tmp_path / f'{mode}.csv'
+    # Small chunks and blocks force many runs and tie drains across blocks
+    result = stream_merge(path_a, path_b, str(output), mode=mode, chunk_rows=700)
+
+    segments = [pd.read_csv(path_a), pd.read_csv(path_b)]
+    soc, voltage, window, removed = merge_arrays(segments, mmap=False)
+    if mode == 'discharging':
+        soc, voltage = soc[::-1], voltage[::-1]
+
+    streamed = pd.read_csv(output)
+    assert result.rows == len(streamed) == len(soc)
+    assert result.removed_rows == removed
+    assert result.window == window
+    np.testing.assert_array_equal(streamed['SOC'].to_numpy(), soc)
+    np.testing.assert_array_equal(streamed['Voltage'].to_numpy(), voltage)
+
+
+def test_stream_merge_skips_non_numeric_cells(tmp_path):
+    path_a = tmp_path / 'a.csv'
+    path_a.write_text('SOC,Voltage\n10,3.5\noops,3.6\n20,\n30,3.7\n')
+    path_b = _write(tmp_path / 'b.csv', [0.0, 5.0, 40.0], [3.0, 3.2, 3.9])
+
+    result = stream_merge(str(path_a), path_b, str(tmp_path / 'out.csv'))
+
+    merged = pd.read_csv(tmp_path / 'out.csv')
+    assert result.skipped_rows == 2
+    assert result.window == (10.0, 30.0)
+    assert merged['SOC'].tolist() == [0.0, 5.0, 10.0, 30.0, 40.0]
+    assert result.rows == len(merged)
+
+
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_merge_runs_breaks_ties_by_run_across_blocks(tmp_path, sign):
+    rng = np.random.default_rng(9)
+    runs, rows = [], []
+    for number in range(5):
+        soc = np.sort(rng.integers(0, 4, 40).astype(np.float64))[::int(sign)]
+        run = np.column_stack((soc, number * 100 + np.arange(len(soc))))
+        path = tmp_path / f'run{number}.npy'
+        np.save(path, run)
+        runs.append(str(path))
+        rows.append(run)
+
+    merged = np.concatenate(list(_merge_runs(runs, sign, block_rows=3)))
+
+    expected = np.concatenate(rows)
+    expected = expected[np.argsort(expected[:, 0] * sign, kind='stable')]
+    np.testing.assert_array_equal(merged, expected)
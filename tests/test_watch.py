@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from socmerge.arrays import merge_curve_arrays
+from socmerge.watch import CellMerge
+
+
+def _segments():
+    rng = np.random.default_rng(11)
+    segments = []
+    for low, high in [(20, 60), (0, 100), (40, 80), (55, 95), (10, 30)]:
+        # Rounded SOC so the segments share values at and inside the window edges
+        soc = np.round(rng.uniform(low, high, 3_000), 1)
+        soc[:2] = low, high
+        segments.append(pd.DataFrame({'SOC': soc, 'Voltage': rng.normal(3.6, 0.1, len(soc))}))
+    return segments
+
+
+@pytest.mark.parametrize('precedence', ['first', 'last'])
+@pytest.mark.parametrize('model', ['poly', 'spline'])
+def test_incremental_merge_matches_the_batch_merge(precedence, model):
+    segments = _segments()
+    cell = CellMerge('cell', precedence)
+    for index, segment in enumerate(segments):
+        cell.add_segment(segment, f"cell_{index}.csv")
+
+        curve = cell.curve(model)
+        batch = merge_curve_arrays(segments[:index + 1], precedence=precedence, model=model)
+
+        for ascending in (True, False):
+            for ours, theirs in zip(curve.columns(ascending), batch.columns(ascending)):
+                np.testing.assert_array_equal(ours, theirs)
+        assert curve.window == batch.window
+        assert curve.removed_rows == batch.removed_rows
+        np.testing.assert_allclose(curve.trend.voltage, batch.trend.voltage, rtol=1e-9)
+        np.testing.assert_allclose(curve.trend.coeffs, batch.trend.coeffs, rtol=1e-9)
+
+
+def test_unknown_precedence_is_rejected():
+    with pytest.raises(ValueError, match='precedence'):
+        CellMerge('cell', 'newest')
@@ -1,25 +1,292 @@
+import os
 import sys
-import pandas as pd
-import numpy as np
+import logging
+import importlib
+import threading
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QWidget, QFileDialog, QMessageBox, 
-                             QLabel, QGroupBox, QGridLayout, QTextEdit, QSplitter)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QPalette, QColor
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-import matplotlib.style as style
+                             QLabel, QGroupBox, QGridLayout, QTextEdit, QSplitter,
+                             QProgressBar, QCheckBox, QComboBox)
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QFont
+
+# numpy, pandas, matplotlib and the rest of socmerge are imported where they are
+# first used, so the window appears before they have loaded
+from socmerge import trace
+
+# Dataset numbers from here on are additional merge segments
+FIRST_EXTRA_DATASET = 3
+
+# Marker cycle for overlaid datasets
+DATASET_MARKERS = ['o', 's', '^', 'D', 'v', 'P', 'X', '*']
+
+# Stages slower than this are flagged in the Performance pane
+STALL_MS = 500
+
+# Lines kept in the Performance pane
+PERFORMANCE_LINES = 500
+
+# Trend models offered in the Merge & Analysis group, in socmerge.fitting.FIT_MODELS order
+FIT_LABELS = {
+    'poly': 'Polynomial (degree 2)',
+    'monotone': 'Monotone piecewise-linear',
+    'spline': 'Smoothing spline',
+}
+
+# Overlap windows offered in the Merge & Analysis group, in socmerge.engine.WINDOW_METHODS order
+WINDOW_LABELS = {
+    'endpoints': 'First and last rows',
+    'quantile': 'Robust SOC quantiles',
+}
+
+# Row orders offered in the Merge & Analysis group, in socmerge.phases.ROW_ORDERS order
+ROW_ORDER_LABELS = {
+    'soc': 'SOC',
+    'time': 'Time',
+}
+
+# Imported on a background thread once the window is up, so the first load,
+# plot or save does not wait for them
+PRELOAD_MODULES = (
+    'socmerge.arrays',
+    'socmerge.cache',
+    'socmerge.clean',
+    'socmerge.differential',
+    'socmerge.export',
+    'socmerge.render',
+    'matplotlib.figure',
+    'matplotlib.backends.backend_qt5agg',
+)
+
+# Save-dialog filters of Export Merged Data and the format each one writes
+EXPORT_FILTERS = {
+    "CSV Files (*.csv)": 'csv',
+    "Parquet Files (*.parquet)": 'parquet',
+    "Feather Files (*.feather)": 'feather',
+    "HDF5 Files (*.h5)": 'hdf5',
+}
+
+class DatasetLoadWorker(QObject):
+    """Parse (or fetch from the cache), clean, validate and summarize a CSV dataset off the UI thread."""
+    progress = pyqtSignal(int, int)              # dataset number, percent
+    loaded = pyqtSignal(int, object, object)     # dataset number, DataFrame, summary
+    failed = pyqtSignal(int, str, str)           # dataset number, title, message
+    cancelled = pyqtSignal(int)                  # dataset number
+    finished = pyqtSignal()
+    
+    def __init__(self, dataset_num, file_path, cache=None, clean=None):
+        super().__init__()
+        self.dataset_num = dataset_num
+        self.file_path = file_path
+        self.cache = cache
+        # clean_dataset() options, or None to keep the rows as parsed
+        self.clean = clean
+        self._cancel_event = threading.Event()
+    
+    def cancel(self):
+        """Request cancellation; takes effect at the next chunk boundary."""
+        self._cancel_event.set()
+    
+    def run(self):
+        from socmerge.cache import load_cached
+        from socmerge.engine import ColumnError, LoadCancelled, summarize_dataset
+        try:
+            df = load_cached(
+                self.file_path, self.cache,
+                progress=lambda fraction: self.progress.emit(self.dataset_num, int(fraction * 100)),
+                is_cancelled=self._cancel_event.is_set,
+                clean=self.clean
+            )
+            summary = summarize_dataset(df)
+            summary['cleaning'] = df.attrs.get('cleaning')
+            if 'Current' in df.columns:
+                from socmerge.phases import phase_counts
+                summary['phases'] = phase_counts(df)
+            self.loaded.emit(self.dataset_num, df, summary)
+        except LoadCancelled:
+            self.cancelled.emit(self.dataset_num)
+        except ColumnError as e:
+            self.failed.emit(self.dataset_num, "Column Error", str(e))
+        except Exception as e:
+            self.failed.emit(self.dataset_num, "Loading Error",
+                             f"Error loading dataset {self.dataset_num}:\n{str(e)}")
+        finally:
+            self.finished.emit()
+
+
+class ExportWorker(QObject):
+    """Write a merged curve to disk off the UI thread."""
+    succeeded = pyqtSignal(str, str)             # file path, format
+    failed = pyqtSignal(str)                     # message
+    finished = pyqtSignal()
+    
+    def __init__(self, curve, ascending, file_path, fmt, mode):
+        super().__init__()
+        self.curve = curve
+        self.ascending = ascending
+        self.file_path = file_path
+        self.fmt = fmt
+        self.mode = mode
+    
+    def run(self):
+        try:
+            from socmerge.export import write_curve
+            write_curve(self.curve, self.file_path, self.fmt, self.ascending, mode=self.mode)
+            self.succeeded.emit(self.file_path, self.fmt)
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
+
+
+class DecimatedAxes:
+    """
+    Keep full-resolution series behind an axes but draw only about one point
+    per pixel column. The visible range is re-decimated whenever the x limits
+    change, so detail comes back as you zoom in.
+    """
+    
+    def __init__(self, ax, method='minmax', points_per_pixel=1.0):
+        self.ax = ax
+        self.method = method
+        self.points_per_pixel = points_per_pixel
+        self.series = []  # (line, x, y) with the full-resolution arrays
+        self._full_resolution = False
+        ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+    
+    def target_points(self):
+        return max(int(self.ax.bbox.width * self.points_per_pixel), 100)
+    
+    def decimate(self, x, y, xlim=None):
+        """Return the (x, y) points to draw for the given visible x range."""
+        import numpy as np
+        from socmerge.decimate import decimate_indices
+        if xlim is not None:
+            lo, hi = sorted(xlim)
+            visible = np.flatnonzero((x >= lo) & (x <= hi))
+            if len(visible) < len(x):
+                idx = visible[decimate_indices(x[visible], y[visible], self.target_points(), self.method)]
+                return x[idx], y[idx]
+        idx = decimate_indices(x, y, self.target_points(), self.method)
+        return x[idx], y[idx]
+    
+    def plot(self, x, y, *args, **kwargs):
+        """Plot a series like Axes.plot, drawing a decimated copy."""
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        line, = self.ax.plot(*self.decimate(x, y), *args, **kwargs)
+        self.series.append((line, x, y))
+        
+        # Autoscale to the full data, not just the decimated points
+        finite = np.isfinite(x) & np.isfinite(y)
+        if finite.any():
+            self.ax.update_datalim([(x[finite].min(), y[finite].min()),
+                                    (x[finite].max(), y[finite].max())])
+            self.ax.autoscale_view()
+        return line
+    
+    def set_series(self, line, x, y):
+        """Replace the full-resolution data behind an existing line."""
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        for i, (series_line, _, _) in enumerate(self.series):
+            if series_line is line:
+                self.series[i] = (line, x, y)
+                break
+        if self._full_resolution:
+            line.set_data(x, y)
+        else:
+            line.set_data(*self.decimate(x, y, self.ax.get_xlim()))
+    
+    def is_decimated(self):
+        return any(len(line.get_xdata()) < len(x) for line, x, _ in self.series)
+    
+    def on_xlim_changed(self, ax):
+        if self._full_resolution:
+            return
+        for line, x, y in self.series:
+            line.set_data(*self.decimate(x, y, ax.get_xlim()))
+    
+    def set_full_resolution(self, full):
+        """Draw every point (e.g. for export) or go back to decimated lines."""
+        self._full_resolution = full
+        if full:
+            for line, x, y in self.series:
+                line.set_data(x, y)
+        else:
+            self.on_xlim_changed(self.ax)
+
+
+def create_traced_canvas(figure):
+    """Qt canvas that times every render, including deferred draw_idle() ones."""
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+    
+    class TracedCanvas(FigureCanvas):
+        def draw(self):
+            with trace.span('plot.draw'):
+                super().draw()
+    
+    return TracedCanvas(figure)
+
+
+def preload_modules():
+    """Import PRELOAD_MODULES ahead of first use; failures surface later where they are used."""
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logging.getLogger(__name__).debug("Could not preload %s: %s", name, e)
+
+
+class TraceBridge(QObject):
+    """Carries trace spans from any thread to the GUI thread."""
+    span_recorded = pyqtSignal(object)
+
+
+class RenderBridge(QObject):
+    """Carries finished plot renders from the renderer's callback thread to the GUI thread."""
+    render_finished = pyqtSignal(str, object)    # file path, Future
 
-# Set matplotlib style
-style.use('seaborn-v0_8')
 
 class VoltageSOCAnalyzer(QMainWindow):
     def __init__(self):
         super().__init__()
         self.dataset1 = None
         self.dataset2 = None
-        self.merged_data = None
+        # Additional segments keyed by dataset number (3, 4, ...)
+        self.extra_datasets = {}
+        self.dataset_summaries = {}
+        # (ArrayCurve, ascending) of the last analysis, for export
+        self.merged_result = None
+        self.plot_view = None
+        # Merges of the current datasets: None -> the curve shared by both analysis
+        # directions, or analysis mode -> its own curve when split by current
+        self._merged_curves = {}
+        self._merged_inputs = ()
+        # (plot_view, data_line, trend_line) of the analysis plot on screen
+        self._analysis_view = None
+        # Columnar copies of loaded CSVs make reloads skip text parsing (created on first load)
+        self.dataset_cache = None
+        # Background loaders keyed by dataset number: (thread, worker)
+        self._loaders = {}
+        # Numbers of running loads whose result is no longer wanted (cleared additional datasets)
+        self._discarded_loads = set()
+        # (thread, worker) of a running Export Merged Data, if any
+        self._exporter = None
+        # Plots are saved by an off-screen renderer in a worker process (created on first save)
+        self.renderer = None
+        self.render_bridge = RenderBridge()
+        self.render_bridge.render_finished.connect(self.on_plot_saved)
+        self._pending_plots = 0
+        # The matplotlib figure and canvas are created when something is first plotted
+        self.figure = None
+        self.canvas = None
+        # Stage timings for the Performance pane, delivered on the GUI thread
+        self.trace_bridge = TraceBridge()
+        self.trace_bridge.span_recorded.connect(self.on_span_recorded)
+        trace.TRACER.add_listener(self.trace_bridge.span_recorded.emit)
         self.init_ui()
         
     def init_ui(self):
@@ -104,10 +371,20 @@ class VoltageSOCAnalyzer(QMainWindow):
         dataset_group = QGroupBox("Dataset Loading")
         dataset_layout = QVBoxLayout(dataset_group)
         
+        # Cleaned once in the loader thread; analyses then reuse the cleaned rows
+        self.clean_checkbox = QCheckBox("Clean data on load")
+        self.clean_checkbox.setChecked(False)
+        self.clean_checkbox.setToolTip(
+            "Drop non-numeric, NaN/inf and outlying rows, clip SOC to 0-100 and average "
+            "rows with equal SOC. Applies to datasets loaded afterwards.")
+        dataset_layout.addWidget(self.clean_checkbox)
+        
         self.load_dataset1_btn = QPushButton("Load Dataset 1")
         self.load_dataset1_btn.clicked.connect(lambda: self.load_dataset(1))
         dataset_layout.addWidget(self.load_dataset1_btn)
         
+        self.dataset1_progress, self.cancel_load1_btn = self.create_load_progress(1, dataset_layout)
+        
         self.dataset1_info = QLabel("No dataset loaded")
         self.dataset1_info.setWordWrap(True)
         dataset_layout.addWidget(self.dataset1_info)
@@ -116,10 +393,29 @@ class VoltageSOCAnalyzer(QMainWindow):
         self.load_dataset2_btn.clicked.connect(lambda: self.load_dataset(2))
         dataset_layout.addWidget(self.load_dataset2_btn)
         
+        self.dataset2_progress, self.cancel_load2_btn = self.create_load_progress(2, dataset_layout)
+        
         self.dataset2_info = QLabel("No dataset loaded")
         self.dataset2_info.setWordWrap(True)
         dataset_layout.addWidget(self.dataset2_info)
         
+        # Any number of further segments, ranked after Dataset 1 and 2 in the merge
+        self.load_extra_btn = QPushButton("Load Additional Dataset")
+        self.load_extra_btn.clicked.connect(self.load_additional_dataset)
+        dataset_layout.addWidget(self.load_extra_btn)
+        
+        self.extra_progress, self.cancel_load_extra_btn = self.create_load_progress(
+            FIRST_EXTRA_DATASET, dataset_layout)
+        
+        self.extra_info = QLabel("No additional datasets")
+        self.extra_info.setWordWrap(True)
+        dataset_layout.addWidget(self.extra_info)
+        
+        self.clear_extra_btn = QPushButton("Clear Additional Datasets")
+        self.clear_extra_btn.clicked.connect(self.clear_additional_datasets)
+        self.clear_extra_btn.setEnabled(False)
+        dataset_layout.addWidget(self.clear_extra_btn)
+        
         control_layout.addWidget(dataset_group)
         
         # Individual plotting section
@@ -147,6 +443,40 @@ class VoltageSOCAnalyzer(QMainWindow):
         analysis_group = QGroupBox("Merge & Analysis")
         analysis_layout = QVBoxLayout(analysis_group)
         
+        fit_layout = QHBoxLayout()
+        fit_layout.addWidget(QLabel("Trend fit:"))
+        self.fit_combo = QComboBox()
+        for model, label in FIT_LABELS.items():
+            self.fit_combo.addItem(label, model)
+        self.fit_combo.currentIndexChanged.connect(self.refit_trend)
+        fit_layout.addWidget(self.fit_combo, 1)
+        analysis_layout.addLayout(fit_layout)
+        
+        window_layout = QHBoxLayout()
+        window_layout.addWidget(QLabel("Overlap window:"))
+        self.window_combo = QComboBox()
+        for method, label in WINDOW_LABELS.items():
+            self.window_combo.addItem(label, method)
+        self.window_combo.currentIndexChanged.connect(self.on_merge_options_changed)
+        window_layout.addWidget(self.window_combo, 1)
+        analysis_layout.addLayout(window_layout)
+        
+        order_layout = QHBoxLayout()
+        order_layout.addWidget(QLabel("Order rows by:"))
+        self.order_combo = QComboBox()
+        for order, label in ROW_ORDER_LABELS.items():
+            self.order_combo.addItem(label, order)
+        self.order_combo.currentIndexChanged.connect(self.on_merge_options_changed)
+        order_layout.addWidget(self.order_combo, 1)
+        analysis_layout.addLayout(order_layout)
+        
+        self.phase_checkbox = QCheckBox("Split charge/discharge by current")
+        self.phase_checkbox.setToolTip(
+            "Merge charging analyses from rows with charging current only and discharging "
+            "analyses from discharging rows only. Needs a Current column.")
+        self.phase_checkbox.toggled.connect(self.on_merge_options_changed)
+        analysis_layout.addWidget(self.phase_checkbox)
+        
         self.charging_btn = QPushButton("Charging Analysis")
         self.charging_btn.setStyleSheet("QPushButton { background-color: #2196F3; }")
         self.charging_btn.clicked.connect(self.charging_analysis)
@@ -161,6 +491,22 @@ class VoltageSOCAnalyzer(QMainWindow):
         
         control_layout.addWidget(analysis_group)
         
+        # Differential analysis of the merged curve on screen
+        differential_group = QGroupBox("Differential Analysis")
+        differential_layout = QVBoxLayout(differential_group)
+        
+        self.dva_btn = QPushButton("dV/dSOC (DVA)")
+        self.dva_btn.clicked.connect(lambda: self.differential_analysis('dva'))
+        self.dva_btn.setEnabled(False)
+        differential_layout.addWidget(self.dva_btn)
+        
+        self.ica_btn = QPushButton("dQ/dV (ICA)")
+        self.ica_btn.clicked.connect(lambda: self.differential_analysis('ica'))
+        self.ica_btn.setEnabled(False)
+        differential_layout.addWidget(self.ica_btn)
+        
+        control_layout.addWidget(differential_group)
+        
         # Export section
         export_group = QGroupBox("Export")
         export_layout = QVBoxLayout(export_group)
@@ -174,6 +520,11 @@ class VoltageSOCAnalyzer(QMainWindow):
         self.export_data_btn.setEnabled(False)
         export_layout.addWidget(self.export_data_btn)
         
+        self.export_lookup_btn = QPushButton("Export Lookup Table")
+        self.export_lookup_btn.clicked.connect(self.export_lookup_table)
+        self.export_lookup_btn.setEnabled(False)
+        export_layout.addWidget(self.export_lookup_btn)
+        
         control_layout.addWidget(export_group)
         
         # Info section
@@ -188,29 +539,98 @@ class VoltageSOCAnalyzer(QMainWindow):
         
         control_layout.addWidget(info_group)
         
+        # Performance section
+        perf_group = QGroupBox("Performance")
+        perf_layout = QVBoxLayout(perf_group)
+        
+        self.trace_checkbox = QCheckBox("Record stage timings")
+        self.trace_checkbox.setChecked(trace.is_enabled())
+        self.trace_checkbox.toggled.connect(self.toggle_tracing)
+        perf_layout.addWidget(self.trace_checkbox)
+        
+        self.perf_text = QTextEdit()
+        self.perf_text.setMaximumHeight(150)
+        self.perf_text.setReadOnly(True)
+        self.perf_text.setFont(QFont("Courier", 9))
+        self.perf_text.document().setMaximumBlockCount(PERFORMANCE_LINES)
+        self.perf_text.setPlaceholderText("Enable recording to time each stage...")
+        perf_layout.addWidget(self.perf_text)
+        
+        perf_buttons = QHBoxLayout()
+        self.save_trace_btn = QPushButton("Save Trace")
+        self.save_trace_btn.clicked.connect(self.save_trace)
+        perf_buttons.addWidget(self.save_trace_btn)
+        
+        clear_trace_btn = QPushButton("Clear")
+        clear_trace_btn.clicked.connect(self.clear_trace)
+        perf_buttons.addWidget(clear_trace_btn)
+        perf_layout.addLayout(perf_buttons)
+        
+        control_layout.addWidget(perf_group)
+        
         # Add stretch to push everything to top
         control_layout.addStretch()
         
         return control_widget
     
+    def create_load_progress(self, dataset_num, layout):
+        """Create the hidden progress bar and cancel button shown while a dataset loads."""
+        row = QHBoxLayout()
+        
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, 100)
+        progress_bar.setVisible(False)
+        row.addWidget(progress_bar)
+        
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setStyleSheet("QPushButton { background-color: #f44336; padding: 4px; }")
+        cancel_btn.clicked.connect(lambda: self.cancel_load(dataset_num, all_extra=True))
+        cancel_btn.setVisible(False)
+        row.addWidget(cancel_btn)
+        
+        layout.addLayout(row)
+        return progress_bar, cancel_btn
+    
     def create_plot_panel(self):
         """Create the plotting panel."""
-        plot_widget = QWidget()
-        plot_layout = QVBoxLayout(plot_widget)
-        
-        # Create matplotlib figure and canvas
-        self.figure = Figure(figsize=(12, 8))
-        self.canvas = FigureCanvas(self.figure)
-        plot_layout.addWidget(self.canvas)
+        self.plot_widget = QWidget()
+        self.plot_layout = QVBoxLayout(self.plot_widget)
         
-        # Initialize with welcome plot
-        self.show_welcome_plot()
+        # A plain label stands in for the welcome plot until matplotlib is needed
+        self.welcome_label = QLabel("Welcome to Voltage vs SOC Analyzer\n\n"
+                                    "Load your datasets to begin analysis")
+        self.welcome_label.setAlignment(Qt.AlignCenter)
+        self.welcome_label.setStyleSheet(
+            "background-color: rgba(173, 216, 230, 204); border-radius: 8px; padding: 12px; "
+            "font-size: 16pt;")
+        self.plot_layout.addWidget(self.welcome_label, 1, Qt.AlignCenter)
         
-        return plot_widget
+        return self.plot_widget
+    
+    def ensure_canvas(self):
+        """Create the matplotlib figure and canvas on first use, replacing the welcome label."""
+        if self.canvas is not None:
+            return
+        with trace.span('gui.canvas'):
+            import matplotlib
+            from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+            from matplotlib.figure import Figure
+            from socmerge.render import PLOT_STYLE, style_params
+            
+            # Only the one style file is read, not matplotlib's whole style library
+            matplotlib.rcParams.update(style_params(PLOT_STYLE))
+            self.figure = Figure(figsize=(12, 8))
+            self.canvas = create_traced_canvas(self.figure)
+            self.plot_layout.removeWidget(self.welcome_label)
+            self.welcome_label.deleteLater()
+            self.plot_layout.addWidget(NavigationToolbar(self.canvas, self.plot_widget))
+            self.plot_layout.addWidget(self.canvas)
     
     def show_welcome_plot(self):
-        """Show a welcome message on the plot area."""
+        """Draw the welcome message on the plot canvas."""
+        self.ensure_canvas()
         self.figure.clear()
+        self.plot_view = None
         ax = self.figure.add_subplot(111)
         ax.text(0.5, 0.5, 'Welcome to Voltage vs SOC Analyzer\n\nLoad your datasets to begin analysis',
                 horizontalalignment='center', verticalalignment='center',
@@ -221,67 +641,46 @@ class VoltageSOCAnalyzer(QMainWindow):
         ax.axis('off')
         self.canvas.draw()
     
+    def new_plot_axes(self):
+        """Clear the figure and return a fresh axes whose series are decimated for drawing."""
+        self.ensure_canvas()
+        self.figure.clear()
+        ax = self.figure.add_subplot(111)
+        self.plot_view = DecimatedAxes(ax)
+        return ax
+    
     def load_dataset(self, dataset_num):
-        """Load a CSV dataset."""
+        """Pick a CSV or Parquet dataset and load it on a background thread."""
         try:
             file_path, _ = QFileDialog.getOpenFileName(
                 self, f"Select Dataset {dataset_num}", "", 
-                "CSV Files (*.csv);;All Files (*)"
+                "Datasets (*.csv *.parquet *.pq);;CSV Files (*.csv);;"
+                "Parquet Files (*.parquet *.pq);;All Files (*)"
             )
             
             if not file_path:
                 return
             
-            # Read the CSV file
-            df = pd.read_csv(file_path)
-            
-            # Validate required columns
-            required_columns = ['SOC', 'Voltage']
-            if not all(col in df.columns for col in required_columns):
-                # Check for alternative column names
-                alternative_names = {
-                    'SOC': ['soc', 'State_of_Charge', 'StateOfCharge', 'SoC'],
-                    'Voltage': ['voltage', 'V', 'Volt', 'Volts']
-                }
-                
-                column_mapping = {}
-                for req_col in required_columns:
-                    found = False
-                    for col in df.columns:
-                        if col in alternative_names[req_col] or req_col.lower() in col.lower():
-                            column_mapping[col] = req_col
-                            found = True
-                            break
-                    if not found:
-                        QMessageBox.critical(
-                            self, "Column Error",
-                            f"Dataset must contain '{req_col}' column.\n"
-                            f"Available columns: {list(df.columns)}"
-                        )
-                        return
-                
-                # Rename columns
-                df = df.rename(columns=column_mapping)
-            
-            # Store dataset
-            if dataset_num == 1:
-                self.dataset1 = df
-                self.dataset1_info.setText(f"Dataset 1: {len(df)} rows, {len(df.columns)} columns")
-                self.plot_dataset1_btn.setEnabled(True)
-            else:
-                self.dataset2 = df
-                self.dataset2_info.setText(f"Dataset 2: {len(df)} rows, {len(df.columns)} columns")
-                self.plot_dataset2_btn.setEnabled(True)
-            
-            # Update info and enable buttons
-            self.update_info_panel()
-            self.update_button_states()
-            
-            QMessageBox.information(
-                self, "Success", 
-                f"Dataset {dataset_num} loaded successfully!\n"
-                f"Rows: {len(df)}, Columns: {len(df.columns)}"
-            )
+            # Parse, validate and summarize off the UI thread
+            thread = QThread(self)
+            if self.dataset_cache is None:
+                from socmerge.cache import DatasetCache
+                self.dataset_cache = DatasetCache()
+            worker = DatasetLoadWorker(dataset_num, file_path, self.dataset_cache,
+                                       {} if self.clean_checkbox.isChecked() else None)
+            worker.moveToThread(thread)
+            
+            thread.started.connect(worker.run)
+            worker.progress.connect(self.on_load_progress)
+            worker.loaded.connect(self.on_dataset_loaded)
+            worker.failed.connect(self.on_load_failed)
+            worker.cancelled.connect(self.on_load_cancelled)
+            worker.finished.connect(thread.quit)
+            thread.finished.connect(lambda: self.on_loader_finished(dataset_num))
+            
+            self._loaders[dataset_num] = (thread, worker)
+            self.set_loading_state(dataset_num, True)
+            thread.start()
             
         except Exception as e:
             QMessageBox.critical(
@@ -289,25 +688,158 @@ class VoltageSOCAnalyzer(QMainWindow):
                 f"Error loading dataset {dataset_num}:\n{str(e)}"
             )
     
-    def update_info_panel(self):
-        """Update the information panel with dataset details."""
-        info_text = "Dataset Information:\n\n"
+    def load_additional_dataset(self):
+        """Load one more segment after Dataset 1, Dataset 2 and any earlier additions."""
+        # Loads still running keep their numbers, so a new one never takes over a discarded number
+        self.load_dataset(max([FIRST_EXTRA_DATASET - 1, *self.extra_datasets, *self._loaders]) + 1)
+    
+    def clear_additional_datasets(self):
+        """Drop every additional segment, cancel any still loading, and go back to a two-dataset merge."""
+        # A cancelled load may already have queued its result; it is ignored on arrival
+        self._discarded_loads.update(num for num in self._loaders if num >= FIRST_EXTRA_DATASET)
+        self.cancel_load(FIRST_EXTRA_DATASET, all_extra=True)
+        for dataset_num in list(self.extra_datasets):
+            self.dataset_summaries.pop(dataset_num, None)
+        self.extra_datasets = {}
+        self._merged_curves = {}
+        self._merged_inputs = ()
+        self.extra_info.setText("No additional datasets")
+        self.clear_extra_btn.setEnabled(False)
+        self.update_info_panel()
+    
+    def all_datasets(self):
+        """Loaded datasets in merge precedence order: 1, 2, then additional segments."""
+        datasets = [self.dataset1, self.dataset2]
+        datasets += [self.extra_datasets[num] for num in sorted(self.extra_datasets)]
+        return [df for df in datasets if df is not None]
+    
+    def cancel_load(self, dataset_num, all_extra=False):
+        """Cancel the background load of a dataset, if one is running."""
+        for num, (thread, worker) in self._loaders.items():
+            if num == dataset_num or (all_extra and dataset_num >= FIRST_EXTRA_DATASET
+                                      and num >= FIRST_EXTRA_DATASET):
+                worker.cancel()
+    
+    def load_widgets(self, dataset_num):
+        """(load button, progress bar, cancel button, info label) of a dataset."""
+        if dataset_num == 1:
+            return (self.load_dataset1_btn, self.dataset1_progress, self.cancel_load1_btn,
+                    self.dataset1_info)
+        if dataset_num == 2:
+            return (self.load_dataset2_btn, self.dataset2_progress, self.cancel_load2_btn,
+                    self.dataset2_info)
+        return self.load_extra_btn, self.extra_progress, self.cancel_load_extra_btn, self.extra_info
+    
+    def set_loading_state(self, dataset_num, loading):
+        """Show or hide the progress widgets of a dataset."""
+        load_btn, progress_bar, cancel_btn, _ = self.load_widgets(dataset_num)
+        
+        load_btn.setEnabled(not loading)
+        progress_bar.setValue(0)
+        progress_bar.setVisible(loading)
+        cancel_btn.setVisible(loading)
+    
+    def on_load_progress(self, dataset_num, percent):
+        """Advance the progress bar of a loading dataset."""
+        self.load_widgets(dataset_num)[1].setValue(percent)
+    
+    def on_dataset_loaded(self, dataset_num, df, summary):
+        """Store a dataset parsed by the background loader."""
+        if dataset_num in self._discarded_loads:
+            return
+        self.dataset_summaries[dataset_num] = summary
+        # A new dataset invalidates the cached merge
+        self._merged_curves = {}
+        self._merged_inputs = ()
         
-        if self.dataset1 is not None:
-            info_text += f"Dataset 1:\n"
-            info_text += f"  Rows: {len(self.dataset1)}\n"
-            info_text += f"  Columns: {list(self.dataset1.columns)}\n"
-            info_text += f"  SOC range: {self.dataset1['SOC'].min():.2f} - {self.dataset1['SOC'].max():.2f}\n"
-            info_text += f"  Voltage range: {self.dataset1['Voltage'].min():.3f} - {self.dataset1['Voltage'].max():.3f}\n\n"
+        # Store dataset
+        if dataset_num == 1:
+            self.dataset1 = df
+            self.dataset1_info.setText(f"Dataset 1: {len(df)} rows, {len(df.columns)} columns")
+            self.plot_dataset1_btn.setEnabled(True)
+        elif dataset_num == 2:
+            self.dataset2 = df
+            self.dataset2_info.setText(f"Dataset 2: {len(df)} rows, {len(df.columns)} columns")
+            self.plot_dataset2_btn.setEnabled(True)
+        else:
+            self.extra_datasets[dataset_num] = df
+            extra_rows = sum(len(extra) for extra in self.extra_datasets.values())
+            self.extra_info.setText(f"{len(self.extra_datasets)} additional dataset(s), "
+                                    f"{extra_rows} rows")
+            self.clear_extra_btn.setEnabled(True)
         
-        if self.dataset2 is not None:
-            info_text += f"Dataset 2:\n"
-            info_text += f"  Rows: {len(self.dataset2)}\n"
-            info_text += f"  Columns: {list(self.dataset2.columns)}\n"
-            info_text += f"  SOC range: {self.dataset2['SOC'].min():.2f} - {self.dataset2['SOC'].max():.2f}\n"
-            info_text += f"  Voltage range: {self.dataset2['Voltage'].min():.3f} - {self.dataset2['Voltage'].max():.3f}\n\n"
+        # Update info and enable buttons
+        self.update_info_panel()
+        self.update_button_states()
         
-        self.info_text.setText(info_text)
+        QMessageBox.information(
+            self, "Success", 
+            f"Dataset {dataset_num} loaded successfully!\n"
+            f"Rows: {len(df)}, Columns: {len(df.columns)}"
+        )
+    
+    def on_load_failed(self, dataset_num, title, message):
+        """Report a dataset that could not be loaded."""
+        if dataset_num in self._discarded_loads:
+            return
+        QMessageBox.critical(self, title, message)
+    
+    def on_load_cancelled(self, dataset_num):
+        """Leave the previously loaded dataset in place after a cancel."""
+        if dataset_num == 1 and self.dataset1 is None:
+            self.dataset1_info.setText("Loading cancelled")
+        elif dataset_num == 2 and self.dataset2 is None:
+            self.dataset2_info.setText("Loading cancelled")
+    
+    def on_loader_finished(self, dataset_num):
+        """Tear down the loader thread once its worker is done."""
+        thread, worker = self._loaders.pop(dataset_num)
+        self._discarded_loads.discard(dataset_num)
+        worker.deleteLater()
+        thread.deleteLater()
+        # Additional datasets share one progress bar; keep it while another of them loads
+        if dataset_num < FIRST_EXTRA_DATASET or not any(
+                num >= FIRST_EXTRA_DATASET for num in self._loaders):
+            self.set_loading_state(dataset_num, False)
+    
+    def closeEvent(self, event):
+        """Stop any background loads before the window goes away."""
+        for thread, worker in list(self._loaders.values()):
+            worker.cancel()
+            thread.quit()
+            thread.wait()
+        if self._exporter is not None:
+            # Let a running export finish its file rather than leave it truncated
+            self._exporter[0].wait()
+        # Queued plot saves are finished before the worker stops
+        if self.renderer is not None:
+            self.renderer.close()
+        trace.TRACER.remove_listener(self.trace_bridge.span_recorded.emit)
+        super().closeEvent(event)
+    
+    def update_info_panel(self):
+        """Update the information panel with dataset details."""
+        with trace.span('gui.info_panel', datasets=len(self.dataset_summaries)):
+            info_text = "Dataset Information:\n\n"
+            
+            # Statistics were computed once by the loader thread
+            for dataset_num in sorted(self.dataset_summaries):
+                summary = self.dataset_summaries[dataset_num]
+                info_text += f"Dataset {dataset_num}:\n"
+                info_text += f"  Rows: {summary['rows']}\n"
+                info_text += f"  Columns: {summary['columns']}\n"
+                info_text += f"  SOC range: {summary['soc_min']:.2f} - {summary['soc_max']:.2f}\n"
+                info_text += f"  Voltage range: {summary['voltage_min']:.3f} - {summary['voltage_max']:.3f}\n"
+                if summary.get('phases'):
+                    phases = summary['phases']
+                    info_text += (f"  Phases: {phases['charge']} charge, {phases['discharge']} discharge, "
+                                  f"{phases['rest']} rest rows\n")
+                if summary.get('cleaning'):
+                    from socmerge.clean import describe_cleaning
+                    info_text += f"  Cleaned: {describe_cleaning(summary['cleaning'])}\n"
+                info_text += "\n"
+            
+            self.info_text.setText(info_text)
     
     def update_button_states(self):
         """Update button enabled states based on loaded datasets."""
@@ -322,242 +854,461 @@ class VoltageSOCAnalyzer(QMainWindow):
         try:
             dataset = self.dataset1 if dataset_num == 1 else self.dataset2
             
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
+            with trace.span('plot.rebuild', plot=f'dataset {dataset_num}'):
+                ax = self.new_plot_axes()
             
-            ax.plot(dataset['SOC'], dataset['Voltage'], 'o-', markersize=4, linewidth=2,
-                   label=f'Dataset {dataset_num}')
-            ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
-            ax.set_ylabel('Voltage [V]', fontsize=12)
-            ax.set_title(f'Voltage vs SOC - Dataset {dataset_num}', fontsize=14, fontweight='bold')
-            ax.grid(True, alpha=0.3)
-            ax.legend()
+                self.plot_view.plot(dataset['SOC'], dataset['Voltage'], 'o-', markersize=4, linewidth=2,
+                       label=f'Dataset {dataset_num}')
+                ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
+                ax.set_ylabel('Voltage [V]', fontsize=12)
+                ax.set_title(f'Voltage vs SOC - Dataset {dataset_num}', fontsize=14, fontweight='bold')
+                ax.grid(True, alpha=0.3)
+                ax.legend()
             
-            self.figure.tight_layout()
+                self.figure.tight_layout()
             self.canvas.draw()
             
         except Exception as e:
             QMessageBox.critical(self, "Plotting Error", f"Error plotting dataset {dataset_num}:\n{str(e)}")
     
     def plot_both_datasets(self):
-        """Plot both datasets on the same graph."""
+        """Plot both datasets (and any additional segments) on the same graph."""
         try:
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
+            datasets = [(1, self.dataset1), (2, self.dataset2)]
+            datasets += [(num, self.extra_datasets[num]) for num in sorted(self.extra_datasets)]
+            with trace.span('plot.rebuild', plot='datasets', series=len(datasets)):
+                ax = self.new_plot_axes()
             
-            ax.plot(self.dataset1['SOC'], self.dataset1['Voltage'], 'o-', 
-                   markersize=4, linewidth=2, label='Dataset 1', alpha=0.8)
-            ax.plot(self.dataset2['SOC'], self.dataset2['Voltage'], 's-', 
-                   markersize=4, linewidth=2, label='Dataset 2', alpha=0.8)
+                for i, (dataset_num, dataset) in enumerate(datasets):
+                    marker = DATASET_MARKERS[i % len(DATASET_MARKERS)]
+                    self.plot_view.plot(dataset['SOC'], dataset['Voltage'], f'{marker}-', 
+                           markersize=4, linewidth=2, label=f'Dataset {dataset_num}', alpha=0.8)
             
-            ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
-            ax.set_ylabel('Voltage [V]', fontsize=12)
-            ax.set_title('Voltage vs SOC - Both Datasets Comparison', fontsize=14, fontweight='bold')
-            ax.grid(True, alpha=0.3)
-            ax.legend()
+                ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
+                ax.set_ylabel('Voltage [V]', fontsize=12)
+                title = 'Both Datasets' if len(datasets) == 2 else f'All {len(datasets)} Datasets'
+                ax.set_title(f'Voltage vs SOC - {title} Comparison', fontsize=14, fontweight='bold')
+                ax.grid(True, alpha=0.3)
+                ax.legend()
             
-            self.figure.tight_layout()
+                self.figure.tight_layout()
             self.canvas.draw()
             
         except Exception as e:
             QMessageBox.critical(self, "Plotting Error", f"Error plotting both datasets:\n{str(e)}")
     
-    def merge_datasets_with_overlap_removal(self, df_a, df_b, sensor_column='SOC'):
+    def merge_datasets_with_overlap_removal(self, segments, sensor_column='SOC'):
         """
-        Merge datasets using the specific logic:
-        1. Get first and last values from Dataset A
-        2. Remove overlapping range from Dataset B
-        3. Concatenate remaining Dataset B with Dataset A
+        Merge datasets with overlap removal (earlier datasets win), reporting errors in a dialog.
+        
+        Returns the merged (sensor, voltage) arrays in ascending order with the
+        Dataset A window and the removed row count, or None on failure.
         """
         try:
-            # Step 1: Get first and last values of sensor column from Dataset A
-            first_value_a = df_a[sensor_column].iloc[0]
-            last_value_a = df_a[sensor_column].iloc[-1]
-            
-            # Ensure we have min and max values (in case data is not sorted)
-            min_val = min(first_value_a, last_value_a)
-            max_val = max(first_value_a, last_value_a)
-            
-            # Step 2: Filter rows in Dataset B where sensor column is between first and last values from Dataset A
-            filtered_b = df_b[(df_b[sensor_column] >= min_val) & 
-                             (df_b[sensor_column] <= max_val)]
-            
-            # Step 3: Remove rows in Dataset B where sensor column falls within that range
-            remaining_b = df_b[~((df_b[sensor_column] >= min_val) & 
-                               (df_b[sensor_column] <= max_val))]
-            
-            # Step 4: Merge Dataset A into the space left by deleting rows in Dataset B
-            merged_df = pd.concat([remaining_b, df_a], ignore_index=True)
-            
-            # Log merge information
-            print(f"Dataset A range: {min_val:.3f} to {max_val:.3f}")
-            print(f"Filtered out {len(filtered_b)} rows from Dataset B")
-            print(f"Remaining Dataset B rows: {len(remaining_b)}")
-            print(f"Final merged dataset: {len(merged_df)} rows")
-            
-            return merged_df
+            from socmerge.arrays import merge_arrays
+            order = self.order_combo.currentData()
+            return merge_arrays(segments, 'first', sensor_column,
+                                window_method=self.window_combo.currentData(),
+                                order_column='Time' if order == 'time' else None)
             
         except Exception as e:
             QMessageBox.critical(self, "Merge Error", f"Error merging datasets with overlap removal:\n{str(e)}")
             return None
     
-    def charging_analysis(self):
-        """Perform charging analysis (ascending SOC order) with overlap removal."""
+    def merge_phases(self, segments):
+        """
+        Merge each analysis mode from its own current phase, reporting errors in a dialog.
+        
+        Returns {mode: ArrayCurve} for both modes, split in one pass, or None on failure.
+        """
         try:
+            from socmerge.phases import merge_phase_curves
+            return merge_phase_curves(segments, order=self.order_combo.currentData(),
+                                      window_method=self.window_combo.currentData(),
+                                      model=self.fit_combo.currentData())
+            
+        except Exception as e:
+            QMessageBox.critical(self, "Merge Error", f"Error merging charge and discharge phases:\n{str(e)}")
+            return None
+    
+    def get_merged_curve(self, mode):
+        """Merge the loaded datasets once; later analyses of the same datasets reuse it."""
+        segments = self.all_datasets()
+        if not (len(self._merged_inputs) == len(segments)
+                and all(a is b for a, b in zip(self._merged_inputs, segments))):
+            self._merged_curves = {}
+        key = mode if self.phase_checkbox.isChecked() else None
+        if key in self._merged_curves:
+            return self._merged_curves[key]
+        
+        if key is not None:
+            curves = self.merge_phases(segments)
+            if curves is None:
+                return None
+            self._merged_curves.update(curves)
+        else:
             # Use the specific merge logic with overlap removal
-            merged_data = self.merge_datasets_with_overlap_removal(
-                self.dataset1, self.dataset2, 'SOC'
-            )
-            if merged_data is None:
-                return
+            merged = self.merge_datasets_with_overlap_removal(segments, 'SOC')
+            if merged is None:
+                return None
             
-            # Sort in ascending order for charging
-            merged_data = merged_data.sort_values('SOC', ascending=True).reset_index(drop=True)
-            self.merged_data = merged_data
+            from socmerge.arrays import ArrayCurve
+            soc, voltage, window, removed_rows = merged
+            self._merged_curves[None] = ArrayCurve(soc, voltage, window, removed_rows,
+                                                   trend=self.fit_trend(soc, voltage),
+                                                   ordered_by=self.order_combo.currentData())
+        self._merged_inputs = tuple(segments)
+        self._analysis_view = None
+        return self._merged_curves[key]
+    
+    def on_merge_options_changed(self):
+        """Merge again with the newly selected window, order or phase split on the next analysis."""
+        self._merged_curves = {}
+        self._merged_inputs = ()
+    
+    def fit_trend(self, soc, voltage):
+        """Fit the trend model selected in the Merge & Analysis group."""
+        from socmerge.arrays import fit_trend_arrays
+        return fit_trend_arrays(soc, voltage, 2, model=self.fit_combo.currentData())
+    
+    def refit_trend(self):
+        """Refit the merged curves with the newly selected model and redraw the trend line."""
+        if not self._merged_curves:
+            return
+        try:
+            for curve in self._merged_curves.values():
+                curve.set_trend(self.fit_trend(curve.soc, curve.voltage))
             
-            # Plot the merged and sorted data
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
+            view = self._analysis_view
+            if view is not None and view[0] is self.plot_view:
+                curve, ascending = self.merged_result
+                self.plot_view.set_series(view[2], *curve.trend.grid(ascending))
+                self.canvas.draw_idle()
+        except Exception as e:
+            QMessageBox.critical(self, "Fit Error", f"Error fitting the trend:\n{str(e)}")
+    
+    def show_analysis(self, mode):
+        """Plot the merged data in charging (ascending) or discharging (descending) SOC order."""
+        from socmerge.engine import ANALYSIS_MODES
+        from socmerge.render import ANALYSIS_STYLES
+        style = ANALYSIS_STYLES[mode]
+        curve = self.get_merged_curve(mode)
+        if curve is None:
+            return
+        
+        # The merge is stored in ascending order; discharging reads it back to front
+        ascending = ANALYSIS_MODES[mode]
+        self.merged_result = (curve, ascending)
+        soc, voltage = curve.columns(ascending)
+        # The trend is drawn from its fixed SOC grid, not evaluated at every row
+        trend_soc, trend = curve.trend.grid(ascending)
+        
+        view = self._analysis_view
+        if view is not None and view[0] is self.plot_view and view[3] is curve:
+            with trace.span('plot.update', plot=mode):
+                # Same curve already on screen: swap the line data instead of rebuilding the figure.
+                # Phase curves hold different rows, so they rebuild to get their own limits.
+                _, data_line, trend_line, _ = view
+                ax = self.plot_view.ax
+                self.plot_view.set_series(data_line, soc, voltage)
+                self.plot_view.set_series(trend_line, trend_soc, trend)
+                data_line.set_color(style['color'])
+                data_line.set_label(style['label'])
+                ax.set_title(style['title'], fontsize=14, fontweight='bold')
+                ax.legend()
+            self.canvas.draw_idle()
+        else:
+            with trace.span('plot.rebuild', plot=mode):
+                # Plot the merged and sorted data
+                ax = self.new_plot_axes()
             
-            ax.plot(merged_data['SOC'], merged_data['Voltage'], 'o-', 
-                   markersize=5, linewidth=2, color='blue', label='Charging Curve')
+                data_line = self.plot_view.plot(soc, voltage, 'o-', markersize=5, linewidth=2,
+                                                color=style['color'], label=style['label'])
             
-            ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
-            ax.set_ylabel('Voltage [V]', fontsize=12)
-            ax.set_title('Charging Analysis - Voltage vs SOC (Ascending Order)', 
-                        fontsize=14, fontweight='bold')
-            ax.grid(True, alpha=0.3)
-            ax.legend()
+                ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
+                ax.set_ylabel('Voltage [V]', fontsize=12)
+                ax.set_title(style['title'], fontsize=14, fontweight='bold')
+                ax.grid(True, alpha=0.3)
             
-            # Add trend line
-            z = np.polyfit(merged_data['SOC'], merged_data['Voltage'], 2)
-            p = np.poly1d(z)
-            ax.plot(merged_data['SOC'], p(merged_data['SOC']), '--', 
-                   alpha=0.8, color='red', label='Trend')
-            ax.legend()
+                # Add trend line
+                trend_line = self.plot_view.plot(trend_soc, trend, '--', alpha=0.8, color='red', label='Trend')
+                ax.legend()
             
-            self.figure.tight_layout()
+                self.figure.tight_layout()
             self.canvas.draw()
-            
-            # Enable export button
-            self.export_data_btn.setEnabled(True)
-            
-            # Show detailed merge information
-            first_val = self.dataset1['SOC'].iloc[0]
-            last_val = self.dataset1['SOC'].iloc[-1]
-            min_val = min(first_val, last_val)
-            max_val = max(first_val, last_val)
-            
-            QMessageBox.information(
-                self, "Charging Analysis Complete",
-                f"Merge Details:\n"
-                f"• Dataset A SOC range: {min_val:.2f}% to {max_val:.2f}%\n"
-                f"• Removed overlapping data from Dataset B\n"
-                f"• Final merged dataset: {len(merged_data)} data points\n"
-                f"• Sorted in ascending SOC order for charging analysis"
-            )
-            
+            self._analysis_view = (self.plot_view, data_line, trend_line, curve)
+        
+        # Enable export and differential buttons
+        self.export_data_btn.setEnabled(True)
+        self.export_lookup_btn.setEnabled(True)
+        self.dva_btn.setEnabled(True)
+        self.ica_btn.setEnabled(True)
+        
+        # Show detailed merge information
+        min_val, max_val = curve.window
+        segment_count = len(self._merged_inputs)
+        removed_from = "Dataset B" if segment_count == 2 else f"Datasets 2-{segment_count}"
+        if curve.ordered_by == 'time':
+            order_text = f"• Kept in time order for {mode} analysis"
+        else:
+            order_text = f"• Sorted in {style['order']} SOC order for {mode} analysis"
+        if self.phase_checkbox.isChecked():
+            from socmerge.phases import MODE_PHASES
+            order_text += f"\n• Merged from {MODE_PHASES[mode]} rows only (split by current)"
+        
+        QMessageBox.information(
+            self, f"{mode.capitalize()} Analysis Complete",
+            f"Merge Details:\n"
+            f"• Dataset A SOC range: {min_val:.2f}% to {max_val:.2f}%\n"
+            f"• Removed overlapping data from {removed_from}\n"
+            f"• Final merged dataset: {len(curve)} data points\n"
+            f"{order_text}"
+        )
+    
+    def charging_analysis(self):
+        """Perform charging analysis (ascending SOC order) with overlap removal."""
+        try:
+            self.show_analysis('charging')
         except Exception as e:
             QMessageBox.critical(self, "Analysis Error", f"Error in charging analysis:\n{str(e)}")
     
     def discharging_analysis(self):
         """Perform discharging analysis (descending SOC order) with overlap removal."""
         try:
-            # Use the specific merge logic with overlap removal
-            merged_data = self.merge_datasets_with_overlap_removal(
-                self.dataset1, self.dataset2, 'SOC'
-            )
-            if merged_data is None:
+            self.show_analysis('discharging')
+        except Exception as e:
+            QMessageBox.critical(self, "Analysis Error", f"Error in discharging analysis:\n{str(e)}")
+    
+    def differential_analysis(self, kind):
+        """Plot dV/dSOC ('dva') or dQ/dV ('ica') of the last analysed merged curve."""
+        try:
+            from socmerge.engine import ANALYSIS_MODES
+            from socmerge.render import ANALYSIS_STYLES, DIFFERENTIAL_STYLES, differential_arrays
+            if self.merged_result is None:
+                QMessageBox.warning(self, "Warning", "Please run a charging or discharging analysis first!")
                 return
+            curve, ascending = self.merged_result
+            mode = next(name for name, order in ANALYSIS_MODES.items() if order == ascending)
+            style = DIFFERENTIAL_STYLES[kind]
             
-            # Sort in descending order for discharging
-            merged_data = merged_data.sort_values('SOC', ascending=False).reset_index(drop=True)
-            self.merged_data = merged_data
-            
-            # Plot the merged and sorted data
-            self.figure.clear()
-            ax = self.figure.add_subplot(111)
-            
-            ax.plot(merged_data['SOC'], merged_data['Voltage'], 'o-', 
-                   markersize=5, linewidth=2, color='orange', label='Discharging Curve')
-            
-            ax.set_xlabel('State of Charge (SOC) [%]', fontsize=12)
-            ax.set_ylabel('Voltage [V]', fontsize=12)
-            ax.set_title('Discharging Analysis - Voltage vs SOC (Descending Order)', 
-                        fontsize=14, fontweight='bold')
-            ax.grid(True, alpha=0.3)
-            ax.legend()
-            
-            # Add trend line
-            z = np.polyfit(merged_data['SOC'], merged_data['Voltage'], 2)
-            p = np.poly1d(z)
-            ax.plot(merged_data['SOC'], p(merged_data['SOC']), '--', 
-                   alpha=0.8, color='red', label='Trend')
-            ax.legend()
-            
-            self.figure.tight_layout()
+            # Computed once per merged curve and kept with it
+            with trace.span('plot.differential', plot=kind):
+                curves = curve.differential()
+                x, y = differential_arrays(curves, kind)
+                ax = self.new_plot_axes()
+                self.plot_view.plot(x, y, '-', linewidth=2, color=ANALYSIS_STYLES[mode]['color'],
+                                    label=style['label'])
+                ax.set_xlabel(style['xlabel'], fontsize=12)
+                ax.set_ylabel(style['ylabel'].format(unit=curves.units[kind]), fontsize=12)
+                ax.set_title(f"{style['title']} ({mode.capitalize()})", fontsize=14, fontweight='bold')
+                ax.grid(True, alpha=0.3)
+                ax.legend()
+                self.figure.tight_layout()
             self.canvas.draw()
-            
-            # Enable export button
-            self.export_data_btn.setEnabled(True)
-            
-            # Show detailed merge information
-            first_val = self.dataset1['SOC'].iloc[0]
-            last_val = self.dataset1['SOC'].iloc[-1]
-            min_val = min(first_val, last_val)
-            max_val = max(first_val, last_val)
-            
-            QMessageBox.information(
-                self, "Discharging Analysis Complete",
-                f"Merge Details:\n"
-                f"• Dataset A SOC range: {min_val:.2f}% to {max_val:.2f}%\n"
-                f"• Removed overlapping data from Dataset B\n"
-                f"• Final merged dataset: {len(merged_data)} data points\n"
-                f"• Sorted in descending SOC order for discharging analysis"
-            )
-            
+            self._analysis_view = None
         except Exception as e:
-            QMessageBox.critical(self, "Analysis Error", f"Error in discharging analysis:\n{str(e)}")
+            QMessageBox.critical(self, "Analysis Error", f"Error in differential analysis:\n{str(e)}")
     
     def save_plot(self):
-        """Save the current plot to file."""
+        """Save the current plot to file, rendered off-screen in the background."""
         try:
-            file_path, _ = QFileDialog.getSaveFileName(
+            from socmerge.render import PLOT_FORMATS, PlotSnapshot, Renderer
+            file_path, selected_filter = QFileDialog.getSaveFileName(
                 self, "Save Plot", "", 
                 "PNG Files (*.png);;PDF Files (*.pdf);;SVG Files (*.svg);;All Files (*)"
             )
             
-            if file_path:
-                self.figure.savefig(file_path, dpi=300, bbox_inches='tight')
+            if not file_path:
+                return
+            if os.path.splitext(file_path)[1].lower().lstrip('.') not in PLOT_FORMATS:
+                # Without a known extension, use the selected file type (PNG by default)
+                fmt = next((fmt for fmt in PLOT_FORMATS if f"*.{fmt}" in selected_filter), 'png')
+                file_path += f".{fmt}"
+            
+            # The canvas shows decimated curves; offer to write every point instead
+            full_resolution = False
+            if self.plot_view is not None and self.plot_view.is_decimated():
+                full_resolution = QMessageBox.question(
+                    self, "Plot Resolution",
+                    "The plot is drawn from a decimated copy of the data.\n"
+                    "Save every data point at full resolution? (slower, larger file)",
+                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+                ) == QMessageBox.Yes
+            
+            if self.plot_view is None:
+                # The welcome text has no data behind it; it is drawn and saved in place
+                if self.canvas is None:
+                    self.show_welcome_plot()
+                with trace.span('export.savefig', file=os.path.basename(file_path)):
+                    self.figure.savefig(file_path, dpi=300, bbox_inches='tight')
                 QMessageBox.information(self, "Success", f"Plot saved to:\n{file_path}")
+                return
+            
+            # The worker draws from a copy of the plotted arrays, so the canvas stays usable
+            with trace.span('export.snapshot', file=os.path.basename(file_path),
+                            full_resolution=full_resolution):
+                snapshot = PlotSnapshot.from_axes(
+                    self.plot_view.ax, {line: (x, y) for line, x, y in self.plot_view.series},
+                    full_resolution=full_resolution)
+            if self.renderer is None:
+                self.renderer = Renderer()
+            future = self.renderer.submit(snapshot, [file_path])
+            future.add_done_callback(
+                lambda done, path=file_path: self.render_bridge.render_finished.emit(path, done))
+            self._pending_plots += 1
+            self.save_plot_btn.setText(f"Saving Plot ({self._pending_plots})...")
                 
         except Exception as e:
             QMessageBox.critical(self, "Save Error", f"Error saving plot:\n{str(e)}")
     
+    def on_plot_saved(self, file_path, future):
+        """Report a finished background plot save."""
+        self._pending_plots -= 1
+        self.save_plot_btn.setText(f"Saving Plot ({self._pending_plots})..." if self._pending_plots
+                                   else "Save Current Plot")
+        try:
+            _, events = future.result()
+            trace.TRACER.extend(events)
+            QMessageBox.information(self, "Success", f"Plot saved to:\n{file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Save Error", f"Error saving plot:\n{str(e)}")
+    
     def export_data(self):
-        """Export the merged data to CSV."""
+        """Export the merged data to CSV, Parquet, Feather or HDF5 on a background thread."""
         try:
-            if self.merged_data is None:
+            if self.merged_result is None:
                 QMessageBox.warning(self, "No Data", "No merged data to export. Run analysis first.")
                 return
+            if self._exporter is not None:
+                return
+            from socmerge.export import EXPORT_FORMATS, format_for_path
             
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, "Export Merged Data", "", "CSV Files (*.csv);;All Files (*)"
+            file_path, selected_filter = QFileDialog.getSaveFileName(
+                self, "Export Merged Data", "", ";;".join(EXPORT_FILTERS)
             )
             
             if file_path:
-                if not file_path.lower().endswith('.csv'):
-                    file_path += '.csv'
+                # The extension picks the format; without a known one, use the selected filter's
+                try:
+                    fmt = format_for_path(file_path)
+                except ValueError:
+                    fmt = EXPORT_FILTERS.get(selected_filter, 'csv')
+                    file_path += EXPORT_FORMATS[fmt][0]
                 
-                self.merged_data.to_csv(file_path, index=False)
-                QMessageBox.information(self, "Success", f"Data exported to:\n{file_path}")
+                # Written block by block straight from the merged arrays
+                curve, ascending = self.merged_result
+                mode = 'charging' if ascending else 'discharging'
+                thread = QThread(self)
+                worker = ExportWorker(curve, ascending, file_path, fmt, mode)
+                worker.moveToThread(thread)
+                
+                thread.started.connect(worker.run)
+                worker.succeeded.connect(self.on_export_succeeded)
+                worker.failed.connect(self.on_export_failed)
+                worker.finished.connect(thread.quit)
+                thread.finished.connect(self.on_export_finished)
+                
+                self._exporter = (thread, worker)
+                self.export_data_btn.setEnabled(False)
+                self.export_data_btn.setText("Exporting...")
+                thread.start()
                 
         except Exception as e:
             QMessageBox.critical(self, "Export Error", f"Error exporting data:\n{str(e)}")
-
+    
+    def on_export_succeeded(self, file_path, fmt):
+        QMessageBox.information(self, "Success", f"Data exported ({fmt}) to:\n{file_path}")
+    
+    def on_export_failed(self, message):
+        QMessageBox.critical(self, "Export Error", f"Error exporting data:\n{message}")
+    
+    def on_export_finished(self):
+        """Tear down the export thread and re-enable the button."""
+        thread, worker = self._exporter
+        self._exporter = None
+        worker.deleteLater()
+        thread.deleteLater()
+        self.export_data_btn.setText("Export Merged Data")
+        self.export_data_btn.setEnabled(True)
+    
+    def export_lookup_table(self):
+        """Export the merged curve as a binary SOC/Voltage lookup table."""
+        try:
+            if self.merged_result is None:
+                QMessageBox.warning(self, "No Data", "No merged data to export. Run analysis first.")
+                return
+            
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, "Export Lookup Table", "", "SOC Lookup Tables (*.soclut);;All Files (*)"
+            )
+            
+            if file_path:
+                if not file_path.lower().endswith('.soclut'):
+                    file_path += '.soclut'
+                
+                # The table is direction-independent, so it is the same for both analyses
+                from socmerge.lookup import CurveTable
+                curve, _ = self.merged_result
+                table = CurveTable.from_curve(curve)
+                table.save(file_path)
+                soc_min, soc_max = table.soc_range
+                QMessageBox.information(
+                    self, "Success",
+                    f"Lookup table exported to:\n{file_path}\n"
+                    f"{len(table)} SOC points from {soc_min:.2f}% to {soc_max:.2f}%"
+                )
+                
+        except Exception as e:
+            QMessageBox.critical(self, "Export Error", f"Error exporting lookup table:\n{str(e)}")
+    
+    def toggle_tracing(self, enabled):
+        """Start or stop recording stage timings."""
+        if enabled:
+            trace.enable()
+        else:
+            trace.disable()
+    
+    def on_span_recorded(self, event):
+        """Append one finished stage to the Performance pane."""
+        duration_ms = event['dur'] / 1000.0
+        args = event['args']
+        details = ' '.join(f"{key}={value}" for key, value in args.items()
+                           if key not in ('rss_mb', 'rss_delta_mb'))
+        flag = '!' if duration_ms >= STALL_MS else ' '
+        self.perf_text.append(
+            f"{flag}{event['name']:<16} {duration_ms:9.1f} ms {args['rss_delta_mb']:+7.1f} MB  {details}"
+        )
+    
+    def save_trace(self):
+        """Save the recorded stage timings as a Chrome trace."""
+        try:
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, "Save Trace", "", "Chrome Trace Files (*.json);;All Files (*)"
+            )
+            
+            if file_path:
+                if not file_path.lower().endswith('.json'):
+                    file_path += '.json'
+                
+                trace.write_chrome_trace(file_path)
+                QMessageBox.information(
+                    self, "Success",
+                    f"Trace saved to:\n{file_path}\n"
+                    f"Open it in chrome://tracing or https://ui.perfetto.dev"
+                )
+                
+        except Exception as e:
+            QMessageBox.critical(self, "Save Error", f"Error saving trace:\n{str(e)}")
+    
+    def clear_trace(self):
+        """Forget recorded stage timings."""
+        trace.TRACER.drain()
+        self.perf_text.clear()
 
 def main():
     """Main function to run the application."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     app = QApplication(sys.argv)
     app.setApplicationName("Voltage vs SOC Analyzer")
     
@@ -566,6 +1317,8 @@ def main():
     
     window = VoltageSOCAnalyzer()
     window.show()
+    # Heavy modules load in the background once the event loop has painted the window
+    QTimer.singleShot(0, lambda: threading.Thread(target=preload_modules, daemon=True).start())
     
     sys.exit(app.exec_())
 